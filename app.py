@@ -5,18 +5,34 @@ Aplicação Streamlit para deteção de células sanguíneas usando YOLO.
 
 import streamlit as st
 from pathlib import Path
+import numpy as np
 import pandas as pd
-from typing import List, Dict, Any
+from typing import BinaryIO, List, Dict, Any, Tuple
 import tempfile
 import os
+import time
+import uuid
 import requests
+from functools import partial
 
-from src.infer import load_model, run_inference, calculate_metrics
+from src.annotate import annotate_image
+from src.detections import apply_thresholds
+from src.inputs import extract_archive_members, is_archive_file
+from src.jobs import FINISHED_STATES, QUEUED, JobQueue, start_workers
+from src.profiling import Profiler, timed
+from src.infer import (
+    RAW_CONF_THRESHOLD,
+    RAW_IOU_THRESHOLD,
+    build_result,
+    calculate_metrics
+)
 from src.io_utils import (
-    load_image,
-    create_results_zip,
-    create_results_csv,
-    validate_image_file
+    decode_image,
+    image_to_thumbnail,
+    shrink_image,
+    sniff_image_file,
+    spool_results_zip,
+    create_results_csv
 )
 
 
@@ -36,6 +52,28 @@ HUGGING_FACE_MODEL_URL = os.getenv(
 )
 MODEL_PATH = "models/best.pt"
 
+# Número de imagens por forward pass do modelo
+INFERENCE_BATCH_SIZE = int(os.getenv("INFERENCE_BATCH_SIZE", "4"))
+
+# Motor de inferência: "torch" (PyTorch) ou "onnx" (ONNX Runtime, CPU)
+INFERENCE_ENGINE = os.getenv("INFERENCE_ENGINE", "torch")
+
+# Lado maior das miniaturas (JPEG) mostradas nos resultados; a resolução
+# total só é enviada para o browser a pedido
+PREVIEW_MAX_SIZE = 800
+
+# Cache de resultados em disco (imagens repetidas não voltam a ser inferidas)
+INFERENCE_CACHE_DIR = os.getenv("INFERENCE_CACHE_DIR", ".cache/inference")
+INFERENCE_CACHE_SIZE_MB = float(os.getenv("INFERENCE_CACHE_SIZE_MB", "512"))
+
+# Fila de trabalhos partilhada pelas sessões e número de processos worker
+# lançados pela app (0 = workers lançados à parte com `python -m src.jobs`)
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", ".cache/jobs/jobs.sqlite")
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "2"))
+
+# Intervalo (s) entre atualizações do progresso de um trabalho
+JOB_POLL_INTERVAL_S = 0.5
+
 
 @st.cache_resource
 def download_model_from_huggingface(url: str, save_path: str) -> str:
@@ -45,7 +83,7 @@ def download_model_from_huggingface(url: str, save_path: str) -> str:
     Args:
         url: URL do modelo no Hugging Face
         save_path: Caminho onde guardar o modelo
-        
+    
     Returns:
         Caminho do modelo
     """
@@ -78,7 +116,7 @@ def download_model_from_huggingface(url: str, save_path: str) -> str:
         
         st.success("✅ Modelo descarregado com sucesso!")
         return str(model_path)
-        
+    
     except requests.exceptions.RequestException as e:
         st.error(f"❌ Erro ao fazer download do modelo: {str(e)}")
         st.info(f"Verifica se o URL está correto: {url}")
@@ -86,9 +124,368 @@ def download_model_from_huggingface(url: str, save_path: str) -> str:
 
 
 @st.cache_resource
-def get_model(model_path: str):
-    """Carrega o modelo YOLO uma única vez (cached)."""
-    return load_model(model_path)
+def get_job_queue(model_path: str, engine: str = "torch") -> JobQueue:
+    """
+    Abre a fila de trabalhos e lança os workers de inferência uma única vez
+    (partilhados por todas as sessões).
+    """
+    queue = JobQueue(JOBS_DB_PATH)
+    if INFERENCE_WORKERS > 0:
+        try:
+            start_workers(
+                INFERENCE_WORKERS,
+                JOBS_DB_PATH,
+                model_path,
+                engine=engine,
+                batch_size=INFERENCE_BATCH_SIZE,
+                cache_dir=INFERENCE_CACHE_DIR,
+                cache_size_mb=INFERENCE_CACHE_SIZE_MB
+            )
+        except Exception as e:
+            # Sem cache: o próximo rerun volta a tentar
+            st.error(f"❌ Erro ao exportar o modelo: {str(e)}")
+            st.stop()
+    return queue
+
+
+def get_session_id() -> str:
+    """ID desta sessão na fila (as sessões são servidas à vez)."""
+    if "session_id" not in st.session_state:
+        st.session_state["session_id"] = uuid.uuid4().hex
+    return st.session_state["session_id"]
+
+
+def validate_uploads(uploaded_files: List[Any]) -> Tuple[List[Any], List[Any], List[str]]:
+    """
+    Valida os ficheiros carregados (arquivos são lidos em memória, membro
+    a membro).
+    
+    O resultado fica em session state enquanto os ficheiros carregados não
+    mudarem, pelo que os reruns não voltam a abrir todas as imagens. O
+    cabeçalho lido na validação (formato e tamanho) é guardado para as
+    descodificações seguintes não o voltarem a ler.
+    
+    Returns:
+        Tuplo (ficheiros válidos, cabeçalhos dos ficheiros válidos, avisos)
+    """
+    uploads_key = tuple(getattr(file, "file_id", file.name) for file in uploaded_files)
+    cached = st.session_state.get("uploads")
+    if cached is not None and cached["key"] == uploads_key:
+        return cached["valid_files"], cached["headers"], cached["warnings"]
+    
+    valid_files = []
+    headers = []
+    warnings = []
+    for file in uploaded_files:
+        if is_archive_file(file.name):
+            try:
+                members = extract_archive_members(file)
+            except Exception as e:
+                warnings.append(f"Arquivo ignorado ({e}): {file.name}")
+                continue
+            candidates = members
+        else:
+            candidates = [file]
+        
+        for candidate in candidates:
+            header = sniff_image_file(candidate)
+            if header is not None:
+                valid_files.append(candidate)
+                headers.append(header)
+            else:
+                warnings.append(f"Ficheiro ignorado (formato inválido): {candidate.name}")
+    
+    st.session_state["uploads"] = {
+        "key": uploads_key,
+        "valid_files": valid_files,
+        "headers": headers,
+        "warnings": warnings,
+    }
+    return valid_files, headers, warnings
+
+
+def build_results_table(results: List[Dict[str, Any]]) -> pd.DataFrame:
+    """Tabela detalhada (uma linha por imagem) com contagens e percentagens."""
+    return pd.DataFrame([
+        {
+            "Filename": result["filename"],
+            "RBC": result["counts"].get("RBC", 0),
+            "WBC": result["counts"].get("WBC", 0),
+            "Platelets": result["counts"].get("Platelets", 0),
+            "Total": sum(result["counts"].values()),
+            "RBC %": f"{result['percentages'].get('RBC', 0):.1f}%",
+            "WBC %": f"{result['percentages'].get('WBC', 0):.1f}%",
+            "Platelets %": f"{result['percentages'].get('Platelets', 0):.1f}%",
+        }
+        for result in results
+    ])
+
+
+@st.fragment(run_every=JOB_POLL_INTERVAL_S)
+def show_job_progress(
+    queue: JobQueue,
+    detection_state: Dict[str, Any],
+    files: List[Any],
+    confidence_threshold: float,
+    iou_threshold: float,
+    show_labels: bool,
+    show_conf: bool
+) -> None:
+    """
+    Mostra o progresso de um trabalho e o resultado de cada imagem assim
+    que fica pronto; quando o trabalho termina, volta a correr a app.
+    """
+    status = queue.status(detection_state["job_id"])
+    if status is None or status["status"] in FINISHED_STATES:
+        st.rerun()
+    
+    fetch_ready_results(queue, detection_state, files)
+    
+    processed = status["done"] + status["failed"]
+    if status["status"] == QUEUED:
+        text = "⏳ Em fila, à espera de um worker de inferência..."
+    else:
+        text = f"A processar: {processed}/{status['total']} imagens"
+    st.progress(processed / max(status["total"], 1), text=text)
+    
+    for error in detection_state["errors"].values():
+        st.warning(f"⚠️ {error}")
+    
+    indices = sorted(detection_state["ready"])
+    if indices:
+        st.header("📊 Resultados da Deteção")
+    results = refilter_results(
+        [detection_state["ready"][i] for i in indices], confidence_threshold, iou_threshold
+    )
+    for index, result in zip(indices, results):
+        show_image_result(index, result, show_labels, show_conf)
+
+
+def fetch_ready_results(
+    queue: JobQueue,
+    detection_state: Dict[str, Any],
+    files: List[Any]
+) -> None:
+    """
+    Junta ao estado da sessão as imagens do trabalho já processadas.
+    
+    O modelo correu nos workers com limiares permissivos
+    (RAW_CONF_THRESHOLD / RAW_IOU_THRESHOLD); os candidatos são depois
+    refiltrados com os valores dos sliders, sem novo forward pass. Só as
+    linhas concluídas desde a última consulta são lidas da fila (cursor em
+    `detection_state["cursor"]`), e só essas imagens são descodificadas
+    (já reduzidas) para a miniatura. Só os pixels da miniatura ficam na
+    sessão (para desenhar a miniatura anotada); a resolução total volta a
+    ser descodificada dos bytes do upload quando é precisa.
+    
+    Args:
+        queue: Fila de trabalhos
+        detection_state: Estado da deteção desta sessão; `ready` recebe
+            {índice: {file, header, filename, image_size, detections,
+            timings, previews}} e `errors` {índice: mensagem}
+        files: Ficheiros submetidos, pela mesma ordem
+    """
+    ready = detection_state["ready"]
+    errors = detection_state["errors"]
+    
+    job_results, detection_state["cursor"] = queue.results_since(
+        detection_state["job_id"], detection_state.get("cursor", 0)
+    )
+    for job_result in job_results:
+        index = job_result["index"]
+        if job_result["error"]:
+            errors[index] = job_result["error"]
+            continue
+        
+        file = files[index]
+        header = detection_state["headers"][index]
+        timings = job_result["timings"]
+        with timed(timings, "decode"):
+            preview, image_size = decode_image(file.getvalue(), PREVIEW_MAX_SIZE, header=header)
+            preview = shrink_image(preview, PREVIEW_MAX_SIZE)
+        with timed(timings, "encode"):
+            thumbnail = image_to_thumbnail(preview, PREVIEW_MAX_SIZE)
+        ready[index] = {
+            "file": file,
+            "header": header,
+            "filename": file.name,
+            "image_size": image_size,
+            "detections": job_result["detections"],
+            "timings": timings,
+            "previews": {"original": thumbnail, "pixels": preview},
+        }
+
+
+def refilter_results(
+    raw_results: List[Dict[str, Any]],
+    confidence_threshold: float,
+    iou_threshold: float
+) -> List[Dict[str, Any]]:
+    """
+    Reaplica os limiares atuais aos candidatos guardados (sem novo forward
+    pass).
+    
+    O resultado de cada imagem fica guardado com os limiares usados, pelo
+    que as atualizações do progresso só refiltram as imagens novas.
+    """
+    thresholds = (confidence_threshold, iou_threshold)
+    results = []
+    for raw_result in raw_results:
+        filtered = raw_result.get("filtered")
+        if filtered is None or filtered["thresholds"] != thresholds:
+            detections = apply_thresholds(
+                raw_result["detections"], confidence_threshold, iou_threshold
+            )
+            filtered = build_result(None, detections)
+            filtered["file"] = raw_result["file"]
+            filtered["header"] = raw_result["header"]
+            filtered["filename"] = raw_result["filename"]
+            filtered["image_size"] = raw_result["image_size"]
+            filtered["timings"] = dict(raw_result["timings"])
+            filtered["previews"] = raw_result["previews"]
+            filtered["thresholds"] = thresholds
+            raw_result["filtered"] = filtered
+        results.append(filtered)
+    return results
+
+
+def read_spooled(file: BinaryIO) -> bytes:
+    """Lê do início um ficheiro temporário (para `st.download_button`)."""
+    file.seek(0)
+    return file.read()
+
+
+def decode_upload(file: Any, header: Tuple[str, Tuple[int, int]]) -> np.ndarray:
+    """Descodifica um ficheiro carregado em resolução total (RGB)."""
+    image, _ = decode_image(file.getvalue(), header=header)
+    return image
+
+
+def annotate_upload(
+    file: Any,
+    header: Tuple[str, Tuple[int, int]],
+    detections: Any,
+    show_labels: bool,
+    show_conf: bool
+) -> np.ndarray:
+    """Descodifica um ficheiro carregado e desenha as deteções (para o ZIP)."""
+    return annotate_image(
+        decode_upload(file, header), detections, show_labels=show_labels, show_conf=show_conf
+    )
+
+
+def show_image_result(
+    index: int,
+    result: Dict[str, Any],
+    show_labels: bool,
+    show_conf: bool
+) -> None:
+    """
+    Expander com as miniaturas (JPEG) e as contagens de uma imagem.
+    
+    As imagens em resolução total só são descodificadas e enviadas para o
+    browser quando pedidas; a miniatura anotada é guardada enquanto os
+    limiares e as opções de anotação não mudarem.
+    """
+    with st.expander(f"🖼️ {result['filename']}", expanded=False):
+        full_resolution = st.toggle(
+            "🔍 Resolução total",
+            key=f"full_resolution_{index}",
+            help="Mostra as imagens no tamanho original (mais lento)"
+        )
+        
+        col1, col2 = st.columns(2)
+        
+        if full_resolution:
+            with timed(result["timings"], "decode"):
+                image = decode_upload(result["file"], result["header"])
+        
+        with col1:
+            st.subheader("Original")
+            if full_resolution:
+                st.image(image, use_container_width=True)
+            else:
+                st.image(result["previews"]["original"], use_container_width=True)
+        
+        with col2:
+            st.subheader("Anotada")
+            previews = result["previews"]
+            preview_key = (*result["thresholds"], show_labels, show_conf)
+            if full_resolution:
+                with timed(result["timings"], "annotate"):
+                    annotated = annotate_image(
+                        image,
+                        result["detections"],
+                        show_labels=show_labels,
+                        show_conf=show_conf
+                    )
+                st.image(annotated, use_container_width=True)
+            else:
+                if previews.get("annotated_key") != preview_key:
+                    # Anotação desenhada já à escala da miniatura, sobre os
+                    # pixels guardados da miniatura (sem nova descodificação)
+                    with timed(result["timings"], "annotate"):
+                        annotated = annotate_image(
+                            previews["pixels"],
+                            result["detections"],
+                            show_labels=show_labels,
+                            show_conf=show_conf,
+                            image_size=result["image_size"]
+                        )
+                    with timed(result["timings"], "encode"):
+                        previews["annotated"] = image_to_thumbnail(annotated, PREVIEW_MAX_SIZE)
+                    previews["annotated_key"] = preview_key
+                st.image(previews["annotated"], use_container_width=True)
+        
+        # Métricas individuais
+        st.subheader("Contagens")
+        col_m1, col_m2, col_m3 = st.columns(3)
+        
+        counts = result["counts"]
+        percentages = result["percentages"]
+        total = sum(counts.values())
+        
+        with col_m1:
+            st.metric("🔴 RBC", counts.get("RBC", 0), 
+                     f"{percentages.get('RBC', 0):.1f}%")
+        
+        with col_m2:
+            st.metric("⚪ WBC", counts.get("WBC", 0),
+                     f"{percentages.get('WBC', 0):.1f}%")
+        
+        with col_m3:
+            st.metric("🔵 Platelets", counts.get("Platelets", 0),
+                     f"{percentages.get('Platelets', 0):.1f}%")
+        
+        st.caption(f"**Total de células detetadas:** {total}")
+
+
+def show_timings_panel(profiler: Profiler) -> None:
+    """Painel de debug com os percentis dos tempos de cada fase."""
+    with st.expander("🐞 Tempos por fase (debug)", expanded=True):
+        summary = profiler.summary()
+        total_ms = summary["total"]["total_ms"] if "total" in summary else 0.0
+        st.dataframe(
+            pd.DataFrame([
+                {
+                    "Fase": stage,
+                    "Imagens": stats["count"],
+                    "p50 (ms)": round(stats["p50_ms"], 1),
+                    "p95 (ms)": round(stats["p95_ms"], 1),
+                    "p99 (ms)": round(stats["p99_ms"], 1),
+                    "Máx (ms)": round(stats["max_ms"], 1),
+                    "% total": round(100.0 * stats["total_ms"] / total_ms, 1) if total_ms else 0.0,
+                }
+                for stage, stats in summary.items()
+            ]),
+            use_container_width=True,
+            hide_index=True
+        )
+        st.caption(
+            "decode: leitura da imagem; preprocess/inference/postprocess: "
+            "modelo (imagens na cache não passam pelo modelo); extract: "
+            "cópia das caixas; annotate: desenho da pré-visualização"
+        )
 
 
 def main():
@@ -100,42 +497,49 @@ def main():
     # Download do modelo se necessário
     model_path = download_model_from_huggingface(HUGGING_FACE_MODEL_URL, MODEL_PATH)
     
-    # Carregar modelo
-    with st.spinner("A carregar modelo YOLO..."):
-        try:
-            model = get_model(model_path)
-            st.success("✅ Modelo carregado com sucesso!")
-        except Exception as e:
-            st.error(f"❌ Erro ao carregar modelo: {str(e)}")
-            st.stop()
+    # Fila de trabalhos e workers de inferência (cada um com o seu modelo)
+    queue = get_job_queue(model_path, INFERENCE_ENGINE)
+    worker_errors = [worker["error"] for worker in queue.workers() if worker["error"]]
+    if worker_errors:
+        st.error(f"❌ {worker_errors[0]}")
+        st.stop()
     
     # Sidebar - Configurações
     st.sidebar.header("⚙️ Configurações")
     
+    # Os sliders refiltram os candidatos já calculados (sem repetir a
+    # inferência), por isso ficam dentro dos limiares usados pelo modelo
     confidence_threshold = st.sidebar.slider(
         "Confidence Threshold",
-        min_value=0.0,
+        min_value=RAW_CONF_THRESHOLD,
         max_value=1.0,
         value=0.25,
         step=0.05,
-        help="Limiar mínimo de confiança para deteções"
+        help="Limiar mínimo de confiança para deteções (aplicado sem repetir a inferência)"
     )
     
     iou_threshold = st.sidebar.slider(
         "IOU Threshold",
         min_value=0.0,
-        max_value=1.0,
+        max_value=RAW_IOU_THRESHOLD,
         value=0.45,
         step=0.05,
-        help="Limiar para Non-Maximum Suppression"
+        help="Limiar para Non-Maximum Suppression (aplicado sem repetir a inferência)"
     )
     
     show_labels = st.sidebar.checkbox("Mostrar labels", value=True)
     show_conf = st.sidebar.checkbox("Mostrar confidence", value=True)
+    show_timings = st.sidebar.checkbox(
+        "🐞 Tempos por fase",
+        value=False,
+        help="Mostra quanto tempo demora cada fase (leitura, modelo, anotação)"
+    )
     
     st.sidebar.divider()
     st.sidebar.info(
         "**Modelo:** YOLO Ultralytics\n\n"
+        f"**Motor:** {INFERENCE_ENGINE}\n\n"
+        f"**Workers ativos:** {len(queue.workers())}\n\n"
         f"**Classes:** RBC, WBC, Platelets\n\n"
         f"**Source:** Hugging Face"
     )
@@ -143,23 +547,19 @@ def main():
     # Upload de imagens
     st.header("📤 Upload de Imagens")
     uploaded_files = st.file_uploader(
-        "Escolhe uma ou mais imagens para análise",
-        type=["jpg", "jpeg", "png"],
+        "Escolhe uma ou mais imagens (ou arquivos ZIP/TAR) para análise",
+        type=["jpg", "jpeg", "png", "zip", "tar"],
         accept_multiple_files=True,
-        help="Formatos suportados: JPG, JPEG, PNG"
+        help="Formatos suportados: JPG, JPEG, PNG, ou ZIP/TAR com essas imagens"
     )
     
     if not uploaded_files:
         st.info("👆 Faz upload de imagens para começar a análise.")
         return
     
-    # Validar ficheiros
-    valid_files = []
-    for file in uploaded_files:
-        if validate_image_file(file):
-            valid_files.append(file)
-        else:
-            st.warning(f"⚠️ Ficheiro ignorado (formato inválido): {file.name}")
+    valid_files, headers, warnings = validate_uploads(uploaded_files)
+    for warning in warnings:
+        st.warning(f"⚠️ {warning}")
     
     if not valid_files:
         st.error("Nenhum ficheiro válido foi carregado.")
@@ -167,256 +567,299 @@ def main():
     
     st.success(f"✅ {len(valid_files)} imagens válidas carregadas.")
     
-    # Botão de deteção
+    # Botão de deteção. Os resultados valem para este conjunto de
+    # ficheiros com este modelo e motor
+    files_key = tuple(getattr(file, "file_id", file.name) for file in valid_files)
+    detection_key = (files_key, model_path, INFERENCE_ENGINE)
+    
     if st.button("🔍 Run Detection", type="primary", use_container_width=True):
+        # A inferência corre nos workers; um trabalho anterior ainda em
+        # curso desta sessão deixa de ser preciso
+        previous = st.session_state.get("detection")
+        if previous is not None and not previous["finished"]:
+            queue.cancel(previous["job_id"])
+        job_id = queue.submit(
+            get_session_id(),
+            [(file.name, file.getvalue()) for file in valid_files]
+        )
+        st.session_state["detection"] = {
+            "key": detection_key,
+            "job_id": job_id,
+            "headers": headers,
+            "ready": {},
+            "errors": {},
+            "cursor": 0,
+            "finished": False,
+            "elapsed": 0.0,
+        }
+    
+    # O trabalho e os candidatos ficam em session state (sobrevivem a
+    # reruns) e só valem para estes ficheiros e parâmetros
+    detection_state = st.session_state.get("detection")
+    if detection_state is None or detection_state["key"] != detection_key:
+        return
+    
+    if not detection_state["finished"]:
+        status = queue.status(detection_state["job_id"])
+        if status is None:
+            st.error("❌ O trabalho já não existe na fila. Corre a deteção de novo.")
+            return
+        if status["status"] not in FINISHED_STATES:
+            # Cada imagem aparece assim que o worker a processa
+            show_job_progress(
+                queue, detection_state, valid_files,
+                confidence_threshold, iou_threshold, show_labels, show_conf
+            )
+            return
         
-        # Containers para resultados
-        results_container = st.container()
-        metrics_container = st.container()
+        fetch_ready_results(queue, detection_state, valid_files)
+        for index, file in enumerate(valid_files):
+            if index not in detection_state["ready"] and index not in detection_state["errors"]:
+                detection_state["errors"][index] = f"Imagem não processada: {file.name}"
+        detection_state["finished"] = True
+        detection_state["elapsed"] = (status["finished"] or time.time()) - status["created"]
+    
+    for error in detection_state["errors"].values():
+        st.warning(f"⚠️ {error}")
+    if not detection_state["ready"]:
+        st.error("Nenhuma imagem foi processada.")
+        return
+    
+    # Reaplicar os limiares atuais aos candidatos guardados (sem novo
+    # forward pass): mexer nos sliders só refiltra as deteções. Resultados,
+    # métricas e tabela ficam guardados enquanto os limiares não mudarem,
+    # pelo que outras interações (ex: Análise Extra) não os recalculam
+    view_key = (confidence_threshold, iou_threshold)
+    view = detection_state.get("view")
+    if view is None or view["key"] != view_key:
+        indices = sorted(detection_state["ready"])
+        all_results = refilter_results(
+            [detection_state["ready"][i] for i in indices], confidence_threshold, iou_threshold
+        )
+        table = build_results_table(all_results)
+        view = detection_state["view"] = {
+            "key": view_key,
+            "indices": indices,
+            "results": all_results,
+            "metrics": calculate_metrics(all_results),
+            "table": table,
+            "csv": create_results_csv(table),
+        }
+    
+    indices = view["indices"]
+    all_results = view["results"]
+    total_metrics = view["metrics"]
+    profiler = Profiler()
+    
+    elapsed = detection_state["elapsed"]
+    
+    # Containers para resultados
+    results_container = st.container()
+    metrics_container = st.container()
+    
+    # Mostrar resultados por imagem
+    with results_container:
+        st.header("📊 Resultados da Deteção")
         
-        # Processar imagens
-        all_results = []
-        annotated_images = {}
+        for index, result in zip(indices, all_results):
+            show_image_result(index, result, show_labels, show_conf)
+            profiler.add(result["timings"], result["filename"])
+    
+    # Métricas agregadas
+    with metrics_container:
+        st.header("📈 Resumo do Batch")
         
-        progress_bar = st.progress(0)
-        status_text = st.empty()
+        col1, col2, col3, col4 = st.columns(4)
         
-        for idx, file in enumerate(valid_files):
-            status_text.text(f"A processar: {file.name} ({idx + 1}/{len(valid_files)})")
-            
-            # Carregar imagem
-            original_image = load_image(file)
-            
-            # Inferência
-            result = run_inference(
-                model=model,
-                image=original_image,
-                conf_threshold=confidence_threshold,
-                iou_threshold=iou_threshold,
-                show_labels=show_labels,
-                show_conf=show_conf
-            )
-            
-            # Guardar resultados
-            result["filename"] = file.name
-            all_results.append(result)
-            annotated_images[file.name] = result["annotated_image"]
-            
-            # Atualizar progresso
-            progress_bar.progress((idx + 1) / len(valid_files))
+        with col1:
+            st.metric("📁 Imagens Processadas", len(all_results))
+            if elapsed > 0:
+                st.caption(
+                    f"⚡ {len(all_results) / elapsed:.2f} imagens/s "
+                    f"(batch size {INFERENCE_BATCH_SIZE})"
+                )
         
-        status_text.empty()
-        progress_bar.empty()
+        with col2:
+            st.metric("🔴 Total RBC", total_metrics["total_counts"]["RBC"])
         
-        # Calcular métricas agregadas
-        total_metrics = calculate_metrics(all_results)
+        with col3:
+            st.metric("⚪ Total WBC", total_metrics["total_counts"]["WBC"])
         
-        # Mostrar resultados por imagem
-        with results_container:
-            st.header("📊 Resultados da Deteção")
-            
-            for result in all_results:
-                with st.expander(f"🖼️ {result['filename']}", expanded=False):
-                    col1, col2 = st.columns(2)
-                    
-                    with col1:
-                        st.subheader("Original")
-                        st.image(result["original_image"], use_container_width=True)
-                    
-                    with col2:
-                        st.subheader("Anotada")
-                        st.image(result["annotated_image"], use_container_width=True)
-                    
-                    # Métricas individuais
-                    st.subheader("Contagens")
-                    col_m1, col_m2, col_m3 = st.columns(3)
-                    
-                    counts = result["counts"]
-                    percentages = result["percentages"]
-                    total = sum(counts.values())
-                    
-                    with col_m1:
-                        st.metric("🔴 RBC", counts.get("RBC", 0), 
-                                 f"{percentages.get('RBC', 0):.1f}%")
-                    
-                    with col_m2:
-                        st.metric("⚪ WBC", counts.get("WBC", 0),
-                                 f"{percentages.get('WBC', 0):.1f}%")
-                    
-                    with col_m3:
-                        st.metric("🔵 Platelets", counts.get("Platelets", 0),
-                                 f"{percentages.get('Platelets', 0):.1f}%")
-                    
-                    st.caption(f"**Total de células detetadas:** {total}")
-        
-        # Métricas agregadas
-        with metrics_container:
-            st.header("📈 Resumo do Batch")
-            
-            col1, col2, col3, col4 = st.columns(4)
-            
-            with col1:
-                st.metric("📁 Imagens Processadas", len(all_results))
-            
-            with col2:
-                st.metric("🔴 Total RBC", total_metrics["total_counts"]["RBC"])
-            
-            with col3:
-                st.metric("⚪ Total WBC", total_metrics["total_counts"]["WBC"])
-            
-            with col4:
-                st.metric("🔵 Total Platelets", total_metrics["total_counts"]["Platelets"])
-            
-            st.subheader("Percentagens Agregadas")
-            col_p1, col_p2, col_p3 = st.columns(3)
-            
-            with col_p1:
-                st.metric("RBC %", f"{total_metrics['percentages']['RBC']:.2f}%")
-            
-            with col_p2:
-                st.metric("WBC %", f"{total_metrics['percentages']['WBC']:.2f}%")
-            
-            with col_p3:
-                st.metric("Platelets %", f"{total_metrics['percentages']['Platelets']:.2f}%")
-            
-            # Tabela detalhada
-            st.subheader("📋 Tabela Detalhada")
-            df_data = []
-            for result in all_results:
-                row = {
-                    "Filename": result["filename"],
-                    "RBC": result["counts"].get("RBC", 0),
-                    "WBC": result["counts"].get("WBC", 0),
-                    "Platelets": result["counts"].get("Platelets", 0),
-                    "Total": sum(result["counts"].values()),
-                    "RBC %": f"{result['percentages'].get('RBC', 0):.1f}%",
-                    "WBC %": f"{result['percentages'].get('WBC', 0):.1f}%",
-                    "Platelets %": f"{result['percentages'].get('Platelets', 0):.1f}%",
-                }
-                df_data.append(row)
-            
-            df = pd.DataFrame(df_data)
-            st.dataframe(df, use_container_width=True, hide_index=True)
-            
-            # Botões de download
-            st.subheader("💾 Downloads")
-            col_d1, col_d2 = st.columns(2)
+        with col4:
+            st.metric("🔵 Total Platelets", total_metrics["total_counts"]["Platelets"])
+        
+        st.subheader("Percentagens Agregadas")
+        col_p1, col_p2, col_p3 = st.columns(3)
+        
+        with col_p1:
+            st.metric("RBC %", f"{total_metrics['percentages']['RBC']:.2f}%")
+        
+        with col_p2:
+            st.metric("WBC %", f"{total_metrics['percentages']['WBC']:.2f}%")
+        
+        with col_p3:
+            st.metric("Platelets %", f"{total_metrics['percentages']['Platelets']:.2f}%")
+        
+        # Tabela detalhada
+        st.subheader("📋 Tabela Detalhada")
+        st.dataframe(view["table"], use_container_width=True, hide_index=True)
+        
+        # Botões de download
+        st.subheader("💾 Downloads")
+        col_d1, col_d2 = st.columns(2)
+        
+        with col_d1:
+            st.download_button(
+                label="📄 Download CSV",
+                data=view["csv"],
+                file_name="blood_cell_results.csv",
+                mime="text/csv",
+                use_container_width=True
+            )
+        
+        with col_d2:
+            # O ZIP só é gerado quando pedido, em streaming e em paralelo;
+            # fica guardado enquanto os resultados e opções não mudarem
+            zip_key = (detection_key, confidence_threshold, iou_threshold, show_labels, show_conf)
+            prepared_zip = st.session_state.get("results_zip")
+            if prepared_zip is not None and prepared_zip["key"] != zip_key:
+                prepared_zip["file"].close()
+                prepared_zip = st.session_state["results_zip"] = None
             
-            with col_d1:
-                csv_data = create_results_csv(df)
-                st.download_button(
-                    label="📄 Download CSV",
-                    data=csv_data,
-                    file_name="blood_cell_results.csv",
-                    mime="text/csv",
-                    use_container_width=True
-                )
+            if prepared_zip is None and st.button(
+                "🗜️ Preparar ZIP (Imagens Anotadas)", use_container_width=True
+            ):
+                with st.spinner("A preparar ZIP..."):
+                    zip_file = spool_results_zip(
+                        (
+                            result["filename"],
+                            partial(
+                                annotate_upload,
+                                result["file"],
+                                result["header"],
+                                result["detections"],
+                                show_labels,
+                                show_conf
+                            )
+                        )
+                        for result in all_results
+                    )
+                prepared_zip = {"key": zip_key, "file": zip_file}
+                st.session_state["results_zip"] = prepared_zip
             
-            with col_d2:
-                zip_data = create_results_zip(annotated_images)
+            if prepared_zip is not None:
+                # O ZIP só é lido quando o download é pedido, não a cada rerun
                 st.download_button(
                     label="🗜️ Download ZIP (Imagens Anotadas)",
-                    data=zip_data,
+                    data=partial(read_spooled, prepared_zip["file"]),
                     file_name="annotated_images.zip",
                     mime="application/zip",
                     use_container_width=True
                 )
         
-        # Feature Extra: Análise Extra (>50 imagens)
-        if len(valid_files) > 50:
-            st.divider()
-            st.header("🔬 Análise Extra Desbloqueada")
-            st.info("**Processaste mais de 50 imagens!** Análise comparativa disponível abaixo.")
-            
-            with st.expander("⚠️ **AVISO IMPORTANTE - LER ANTES DE CONTINUAR**", expanded=True):
-                st.warning(
-                    """
-                    **IMPORTANTE: Esta não é uma ferramenta de diagnóstico médico**
-                    
-                    - ❌ Isto **NÃO** é um exame clínico nem diagnóstico
-                    - ❌ As contagens em imagens **NÃO** equivalem a valores laboratoriais (ex: hemograma)
-                    - ✅ É apenas uma **demonstração educacional** com valores de referência configuráveis
-                    - ✅ Os "valores de referência" são placeholders genéricos
-                    
-                    **Se tens preocupações sobre a tua saúde, consulta um profissional de saúde qualificado.**
-                    
-                    Esta funcionalidade serve apenas para fins educacionais e de demonstração técnica.
-                    """
-                )
-            
-            st.subheader("📝 Informação do Utilizador (Demonstração)")
-            
-            col_u1, col_u2, col_u3 = st.columns(3)
-            
-            with col_u1:
-                user_age = st.number_input(
-                    "Idade *",
-                    min_value=1,
-                    max_value=120,
-                    value=30,
-                    help="Obrigatório"
-                )
+        if show_timings:
+            show_timings_panel(profiler)
+    
+    # Feature Extra: Análise Extra (>50 imagens)
+    if len(valid_files) > 50:
+        st.divider()
+        st.header("🔬 Análise Extra Desbloqueada")
+        st.info("**Processaste mais de 50 imagens!** Análise comparativa disponível abaixo.")
+        
+        with st.expander("⚠️ **AVISO IMPORTANTE - LER ANTES DE CONTINUAR**", expanded=True):
+            st.warning(
+                """
+                **IMPORTANTE: Esta não é uma ferramenta de diagnóstico médico**
+                
+                - ❌ Isto **NÃO** é um exame clínico nem diagnóstico
+                - ❌ As contagens em imagens **NÃO** equivalem a valores laboratoriais (ex: hemograma)
+                - ✅ É apenas uma **demonstração educacional** com valores de referência configuráveis
+                - ✅ Os "valores de referência" são placeholders genéricos
+                
+                **Se tens preocupações sobre a tua saúde, consulta um profissional de saúde qualificado.**
+                
+                Esta funcionalidade serve apenas para fins educacionais e de demonstração técnica.
+                """
+            )
+        
+        st.subheader("📝 Informação do Utilizador (Demonstração)")
+        
+        col_u1, col_u2, col_u3 = st.columns(3)
+        
+        with col_u1:
+            user_age = st.number_input(
+                "Idade *",
+                min_value=1,
+                max_value=120,
+                value=30,
+                help="Obrigatório"
+            )
+        
+        with col_u2:
+            user_sex = st.selectbox(
+                "Sexo *",
+                options=["Masculino", "Feminino", "Outro"],
+                help="Obrigatório"
+            )
+        
+        with col_u3:
+            user_weight = st.number_input(
+                "Peso (kg)",
+                min_value=0.0,
+                max_value=300.0,
+                value=70.0,
+                help="Opcional"
+            )
+        
+        if st.button("📊 Gerar Comparação (Não Clínica)", type="secondary"):
+            st.session_state["comparison_key"] = detection_key
+        
+        # A comparação continua visível nos reruns seguintes (ex: ao mudar
+        # a idade) enquanto os resultados forem os mesmos
+        if st.session_state.get("comparison_key") == detection_key:
+            st.subheader("Comparação com Valores de Referência (Configuráveis)")
             
-            with col_u2:
-                user_sex = st.selectbox(
-                    "Sexo *",
-                    options=["Masculino", "Feminino", "Outro"],
-                    help="Obrigatório"
-                )
+            # Valores de referência PLACEHOLDER (editáveis no código)
+            reference_ranges = {
+                "RBC": {"min": 40.0, "max": 55.0, "unit": "%"},
+                "WBC": {"min": 0.5, "max": 2.0, "unit": "%"},
+                "Platelets": {"min": 15.0, "max": 40.0, "unit": "%"},
+            }
             
-            with col_u3:
-                user_weight = st.number_input(
-                    "Peso (kg)",
-                    min_value=0.0,
-                    max_value=300.0,
-                    value=70.0,
-                    help="Opcional"
-                )
+            st.caption("**Nota:** Valores de referência são placeholders genéricos para demonstração.")
             
-            if st.button("📊 Gerar Comparação (Não Clínica)", type="secondary"):
-                st.subheader("Comparação com Valores de Referência (Configuráveis)")
-                
-                # Valores de referência PLACEHOLDER (editáveis no código)
-                reference_ranges = {
-                    "RBC": {"min": 40.0, "max": 55.0, "unit": "%"},
-                    "WBC": {"min": 0.5, "max": 2.0, "unit": "%"},
-                    "Platelets": {"min": 15.0, "max": 40.0, "unit": "%"},
-                }
+            comparison_data = []
+            for cell_type in ["RBC", "WBC", "Platelets"]:
+                observed = total_metrics['percentages'][cell_type]
+                ref_range = reference_ranges[cell_type]
                 
-                st.caption("**Nota:** Valores de referência são placeholders genéricos para demonstração.")
+                status = "Dentro do intervalo configurado"
+                if observed < ref_range["min"]:
+                    status = "Abaixo do intervalo configurado"
+                elif observed > ref_range["max"]:
+                    status = "Acima do intervalo configurado"
                 
-                comparison_data = []
-                for cell_type in ["RBC", "WBC", "Platelets"]:
-                    observed = total_metrics['percentages'][cell_type]
-                    ref_range = reference_ranges[cell_type]
-                    
-                    status = "Dentro do intervalo configurado"
-                    if observed < ref_range["min"]:
-                        status = "Abaixo do intervalo configurado"
-                    elif observed > ref_range["max"]:
-                        status = "Acima do intervalo configurado"
-                    
-                    comparison_data.append({
-                        "Tipo de Célula": cell_type,
-                        "Observado": f"{observed:.2f}%",
-                        "Intervalo Configurado": f"{ref_range['min']}-{ref_range['max']}%",
-                        "Status (Não Clínico)": status
-                    })
-                
-                df_comparison = pd.DataFrame(comparison_data)
-                st.dataframe(df_comparison, use_container_width=True, hide_index=True)
+                comparison_data.append({
+                    "Tipo de Célula": cell_type,
+                    "Observado": f"{observed:.2f}%",
+                    "Intervalo Configurado": f"{ref_range['min']}-{ref_range['max']}%",
+                    "Status (Não Clínico)": status
+                })
+            
+            df_comparison = pd.DataFrame(comparison_data)
+            st.dataframe(df_comparison, use_container_width=True, hide_index=True)
+            
+            st.info(
+                f"""
+                **Dados do utilizador (demonstração):**
+                - Idade: {user_age} anos
+                - Sexo: {user_sex}
+                - Peso: {user_weight if user_weight > 0 else 'Não fornecido'} kg
+                - Total de células analisadas: {sum(total_metrics['total_counts'].values())}
                 
-                st.info(
-                    f"""
-                    **Dados do utilizador (demonstração):**
-                    - Idade: {user_age} anos
-                    - Sexo: {user_sex}
-                    - Peso: {user_weight if user_weight > 0 else 'Não fornecido'} kg
-                    - Total de células analisadas: {sum(total_metrics['total_counts'].values())}
-                    
-                    **Lembrete:** Esta informação não tem valor clínico. Consulta um profissional de saúde.
-                    """
-                )
+                **Lembrete:** Esta informação não tem valor clínico. Consulta um profissional de saúde.
+                """
+            )
 
 
 if __name__ == "__main__":
@@ -4,13 +4,66 @@ Execute: python batch_process.py --input <pasta> --output <pasta>
 """
 
 import argparse
-from pathlib import Path
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
+from functools import partial
+import io
+from itertools import chain, islice
+import multiprocessing
+import os
+from pathlib import Path, PurePosixPath
 import sys
-from typing import List
-import pandas as pd
+import time
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
-from src.infer import load_model, run_inference, calculate_metrics
-from src.io_utils import load_image, save_image_local
+from src.annotate import annotate_image
+from src.cache import DEFAULT_CACHE_SIZE_MB, InferenceCache, file_digest, hash_bytes
+from src.infer import (
+    ENGINES,
+    TILE_MAX_OBJECT_SIZE,
+    MetricsAggregator,
+    build_result,
+    compare_engines,
+    load_model,
+    min_tile_overlap,
+    run_inference_batch,
+    run_inference_tiled,
+    tile_stride
+)
+from src.inputs import (
+    InputFile,
+    is_archive_file,
+    is_compressed_tar,
+    iter_archive_members,
+    read_file_list,
+    read_input_bytes,
+    scan_image_files
+)
+from src.io_utils import MODEL_INPUT_DECODE, MODEL_INPUT_SIZE, ImageSource, decode_image, open_image_source, save_image_local
+from src.manifest import ManifestMismatchError, RunManifest, entries_to_results, is_done
+from src.onnx_engine import export_onnx, find_int8_onnx
+from src.profiling import Profiler, add_timings, timed
+from src.writers import (
+    DETECTION_FIELDS,
+    OUTPUT_FORMATS,
+    RESULT_FIELDS,
+    ResultBuffer,
+    ResultSink,
+    TableWriter,
+    result_to_row,
+    rows_to_columns
+)
+
+
+# Lado maior máximo das imagens anotadas de fontes lidas por regiões (--tile)
+ANNOTATED_MAX_SIZE = 8192
+
+# Imagens por ficheiro part-*.parquet (em CSV, as linhas são escritas logo)
+PARQUET_FLUSH_IMAGES = 256
+
+# Trace dos tempos por fase (--profile), na pasta de resultados
+PROFILE_FILENAME = "profile.json"
 
 
 def parse_args():
@@ -23,8 +76,36 @@ def parse_args():
         "--input",
         "-i",
         type=str,
-        required=True,
-        help="Pasta com imagens de input"
+        default=None,
+        help="Pasta ou arquivo (.zip/.tar) com imagens de input (ou base dos caminhos relativos de --file-list)"
+    )
+    
+    parser.add_argument(
+        "--recursive",
+        "-r",
+        action="store_true",
+        help="Procurar imagens também nas subpastas de --input"
+    )
+    
+    parser.add_argument(
+        "--include",
+        action="append",
+        default=None,
+        help="Processar só imagens que correspondam ao padrão (ex: 'patient_*/*.png'; repetível)"
+    )
+    
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        default=None,
+        help="Ignorar imagens que correspondam ao padrão (repetível)"
+    )
+    
+    parser.add_argument(
+        "--file-list",
+        type=str,
+        default=None,
+        help="Ficheiro com a lista de imagens, uma por linha ('-' para stdin)"
     )
     
     parser.add_argument(
@@ -43,6 +124,21 @@ def parse_args():
         help="Caminho para o modelo YOLO (default: models/best.pt)"
     )
     
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default="torch",
+        help="Motor de inferência: torch, onnx (ONNX Runtime, CPU; exporta o .onnx uma vez) ou onnx-int8 (modelo quantizado com python -m src.quantize) (default: torch)"
+    )
+    
+    parser.add_argument(
+        "--check-parity",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Antes de processar, comparar o motor escolhido (onnx, se --engine torch) com o torch nas primeiras N imagens"
+    )
+    
     parser.add_argument(
         "--conf",
         "-c",
@@ -58,16 +154,120 @@ def parse_args():
         help="IOU threshold (default: 0.45)"
     )
     
+    parser.add_argument(
+        "--batch-size",
+        "-b",
+        type=int,
+        default=1,
+        help="Número de imagens por forward pass do modelo (default: 1)"
+    )
+    
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=8,
+        help="Máximo de imagens descodificadas/à espera de escrita em memória (default: 8)"
+    )
+    
+    parser.add_argument(
+        "--io-threads",
+        type=int,
+        default=4,
+        help="Threads para descodificar e para guardar imagens (default: 4)"
+    )
+    
+    parser.add_argument(
+        "--tile",
+        action="store_true",
+        help="Inferência por tiles (imagens grandes, sem reduzir a imagem inteira)"
+    )
+    
+    parser.add_argument(
+        "--tile-size",
+        type=int,
+        default=640,
+        help="Lado de cada tile em pixels (default: 640)"
+    )
+    
+    parser.add_argument(
+        "--tile-overlap",
+        type=float,
+        default=0.2,
+        help="Sobreposição entre tiles, fração do tile (default: 0.2)"
+    )
+    
+    parser.add_argument(
+        "--max-object-size",
+        type=int,
+        default=TILE_MAX_OBJECT_SIZE,
+        help=f"Lado maior do maior objeto esperado em pixels; a sobreposição "
+             f"entre tiles tem de ser maior (default: {TILE_MAX_OBJECT_SIZE})"
+    )
+    
+    parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        default=1,
+        help="Número de processos, cada um com o seu modelo (default: 1)"
+    )
+    
+    parser.add_argument(
+        "--threads-per-worker",
+        type=int,
+        default=None,
+        help="Threads do torch por processo (default: nº de cores / --workers)"
+    )
+    
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=None,
+        help="Pasta da cache de resultados (desativada por defeito)"
+    )
+    
+    parser.add_argument(
+        "--cache-size-mb",
+        type=float,
+        default=DEFAULT_CACHE_SIZE_MB,
+        help=f"Tamanho máximo da cache em MB (default: {DEFAULT_CACHE_SIZE_MB})"
+    )
+    
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Retomar uma execução interrompida (salta imagens já no manifesto)"
+    )
+    
     parser.add_argument(
         "--save-annotated",
         action="store_true",
         help="Guardar imagens anotadas"
     )
     
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help=f"Mostrar p50/p95/p99 de cada fase no fim e guardar o trace em {PROFILE_FILENAME}"
+    )
+    
     parser.add_argument(
         "--save-csv",
         action="store_true",
-        help="Guardar resultados em CSV"
+        help="Guardar resultados por imagem (results.csv ou results/ em Parquet)"
+    )
+    
+    parser.add_argument(
+        "--save-detections",
+        action="store_true",
+        help="Guardar uma linha por deteção (detections.csv ou detections/ em Parquet)"
+    )
+    
+    parser.add_argument(
+        "--format",
+        choices=OUTPUT_FORMATS,
+        default="csv",
+        help="Formato das tabelas de resultados (default: csv; parquet requer pyarrow)"
     )
     
     return parser.parse_args()
@@ -75,23 +275,696 @@ def parse_args():
 
 def get_image_files(input_dir: Path) -> List[Path]:
     """Obtém lista de ficheiros de imagem numa pasta."""
-    valid_extensions = ['.jpg', '.jpeg', '.png']
+    return [input_file.path for input_file in scan_image_files(input_dir)]
+
+
+def iter_input_files(args: argparse.Namespace) -> Iterator[InputFile]:
+    """
+    Devolve as imagens de input à medida que são encontradas.
+    
+    Com --file-list, lê a lista (ficheiro ou stdin); se --input for um
+    arquivo ZIP/TAR, lista os seus membros; caso contrário, percorre a
+    pasta --input (com --recursive, também as subpastas).
+    """
+    if args.file_list:
+        return read_file_list(args.file_list, args.input, args.include, args.exclude)
+    
+    if Path(args.input).is_file():
+        return iter_archive_members(args.input, args.include, args.exclude)
+    
+    def on_error(error: OSError) -> None:
+        print(f"⚠️  Pasta ignorada: {error}")
+    
+    return scan_image_files(
+        args.input, args.recursive, args.include, args.exclude, on_error=on_error
+    )
+
+
+def read_threads(args: argparse.Namespace) -> int:
+    """
+    Threads de leitura e descodificação: --io-threads, exceto com um TAR
+    comprimido como --input, cujos membros são lidos um a um pela ordem do
+    arquivo (com várias threads, os pedidos fora de ordem obrigariam a
+    descomprimir de novo desde o início).
+    """
+    if not args.file_list and Path(args.input).is_file() and is_compressed_tar(args.input):
+        return 1
+    return args.io_threads
+
+
+def progress_tag(idx: int, num_files: Optional[int]) -> str:
+    """Prefixo de progresso das mensagens ([i/total] ou [i] se o total não for conhecido)."""
+    return f"[{idx}/{num_files}]" if num_files else f"[{idx}]"
+
+
+def _load_file(
+    input_file: InputFile,
+    args: argparse.Namespace,
+    cache: Optional[InferenceCache] = None,
+    model_digest: str = ""
+) -> Dict[str, Any]:
+    """
+    Lê uma imagem (do disco ou de um arquivo), consulta a cache e
+    descodifica se necessário.
+    
+    A entrada do modelo é sempre descodificada da mesma forma (os JPEG já
+    reduzidos ao tamanho de entrada do modelo), com ou sem
+    --save-annotated, para que as deteções não dependam das opções de
+    saída. Com --save-annotated, os bytes ficam em `data` e a imagem
+    anotada é descodificada na resolução original só no estágio de escrita
+    (`write_result`). No modo --tile, a imagem não é descodificada: é
+    aberta como fonte lida por regiões (tile a tile), e em caso de cache
+    hit só é aberta se for precisa (--save-annotated).
+    
+    Returns:
+        Dicionário com:
+            - image: imagem (RGB), fonte de imagem ou None se não for necessária
+            - cache_key: chave da cache (None sem cache)
+            - detections: deteções da cache (None se for preciso inferir)
+            - original_size: (largura, altura) da imagem original, se
+              `image` for uma versão reduzida
+            - data: bytes da imagem, para a imagem anotada (só com
+              --save-annotated, fora do modo --tile)
+    """
+    item = {"image": None, "cache_key": None, "detections": None, "timings": {}}
+    
+    # No modo --tile o ficheiro pode ser enorme: não o ler de uma vez
+    # (membros de arquivos são sempre lidos para memória)
+    if args.tile and input_file.member is None:
+        data = None
+    else:
+        with timed(item["timings"], "read"):
+            data = read_input_bytes(input_file)
+        if args.save_annotated and not args.tile:
+            item["data"] = data
+    
+    if cache is not None:
+        image_digest = file_digest(input_file.path) if data is None else hash_bytes(data)
+        item["cache_key"] = cache.make_key(
+            image_digest, model_digest, args.conf, args.iou, inference_variant(args)
+        )
+        item["detections"] = cache.get(item["cache_key"])
+        if item["detections"] is not None and not (args.tile and args.save_annotated):
+            return item
+    
+    with timed(item["timings"], "decode"):
+        if data is None:
+            item["image"] = open_image_source(input_file.path)
+        elif args.tile:
+            item["image"] = open_image_source(io.BytesIO(data))
+        else:
+            # Só para o modelo: descodificar já perto do tamanho de entrada
+            item["image"], item["original_size"] = decode_image(data, MODEL_INPUT_SIZE)
+    return item
+
+
+def inference_variant(args: argparse.Namespace) -> str:
+    """Descreve as opções que mudam as deteções (para a chave da cache)."""
+    parts = []
+    if args.engine != "torch":
+        parts.append(f"engine:{args.engine}")
+    if args.tile:
+        parts.append(f"tile:{args.tile_size}:{args.tile_overlap}")
+    else:
+        parts.append(MODEL_INPUT_DECODE)
+    return "|".join(parts)
+
+
+def run_parity_check(model_path: Path, args: argparse.Namespace) -> None:
+    """
+    Compara o motor escolhido com o torch nas primeiras --check-parity
+    imagens (com --engine torch, compara o onnx).
+    
+    Mostra as diferenças de contagens e de caixas; não interrompe o
+    processamento.
+    """
+    input_files = list(islice(iter_input_files(args), args.check_parity))
+    images = [decode_image(read_input_bytes(f))[0] for f in input_files]
+    if not images:
+        return
+    
+    engine = "onnx" if args.engine == "torch" else args.engine
+    print(f"🔬 A comparar motores torch e {engine} em {len(images)} imagens...")
+    report = compare_engines(
+        load_model(str(model_path)),
+        load_model(str(model_path), engine=engine),
+        images,
+        conf_threshold=args.conf,
+        iou_threshold=args.iou,
+        batch_size=args.batch_size
+    )
+    
+    for input_file, counts in zip(input_files, report["per_image"]):
+        if counts["reference"] != counts["candidate"]:
+            print(f"   ⚠️  {input_file.name}: torch {counts['reference']} vs {engine} {counts['candidate']}")
+    
+    status = "✅" if report["count_mismatches"] == 0 else "⚠️ "
+    print(
+        f"{status} Paridade: {report['num_images'] - report['count_mismatches']}/{report['num_images']} "
+        f"imagens com as mesmas contagens, IOU mínimo {report['min_iou']:.4f}, "
+        f"diferença máx. de confiança {report['max_conf_diff']:.2e}"
+    )
+
+
+def iter_decoded(
+    image_files: Iterable[Tuple[int, InputFile]],
+    load_fn: Callable[[InputFile], Any],
+    prefetch: int,
+    num_threads: int
+) -> Iterator[Tuple[int, InputFile, Any, Optional[Exception]]]:
+    """
+    Lê e descodifica imagens numa thread pool, à frente da inferência.
+    
+    No máximo `prefetch` imagens estão em descodificação ou à espera de
+    serem consumidas, o que limita a memória usada por este estágio.
+    
+    Args:
+        image_files: Pares (índice 1-based, imagem de input) a descodificar
+        load_fn: Função que lê e descodifica um ficheiro
+        prefetch: Número máximo de imagens em avanço
+        num_threads: Número de threads de descodificação
+    
+    Yields:
+        Tuplos (índice 1-based, caminho, resultado de load_fn, erro), pela
+        ordem original. Em caso de erro, o resultado é None e o erro contém
+        a exceção.
+    """
+    files = iter(image_files)
+    pending: Deque[Tuple[int, InputFile, Future]] = deque()
+    
+    with ThreadPoolExecutor(max_workers=num_threads) as pool:
+        for idx, input_file in islice(files, prefetch):
+            pending.append((idx, input_file, pool.submit(load_fn, input_file)))
+        
+        while pending:
+            idx, input_file, future = pending.popleft()
+            
+            # Manter a fila cheia enquanto este item é consumido
+            for next_idx, next_path in islice(files, 1):
+                pending.append(
+                    (next_idx, next_path, pool.submit(load_fn, next_path))
+                )
+            
+            try:
+                yield idx, input_file, future.result(), None
+            except Exception as e:
+                yield idx, input_file, None, e
+
+
+def write_result(
+    result: Dict[str, Any],
+    input_file: InputFile,
+    output_dir: Path,
+    save_annotated: bool
+) -> Dict[str, Any]:
+    """
+    Estágio de escrita: desenha e guarda a imagem anotada (encode PNG).
+    
+    Se `original_image` trouxer os bytes da imagem, esta é descodificada
+    aqui na resolução original, só para a anotação.
+    
+    Corre na writer pool, em paralelo com a inferência do batch seguinte.
+    
+    Returns:
+        Resultado sem os arrays de imagem (filename, counts, percentages,
+        detections, timings), para que a memória das imagens seja
+        libertada logo após a escrita
+    """
+    image = result["original_image"]
+    timings = result["timings"]
+    
+    if save_annotated:
+        if isinstance(image, bytes):
+            # O modelo recebeu a versão reduzida: a anotada usa a original
+            with timed(timings, "decode"):
+                image, _ = decode_image(image)
+        # Subpastas do input replicadas na pasta de resultados
+        output_path = output_dir / f"{PurePosixPath(input_file.name).with_suffix('')}_annotated.png"
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        with timed(timings, "annotate"):
+            if isinstance(image, ImageSource):
+                # Fonte lida por regiões: anotar uma versão reduzida
+                annotated_image = annotate_image(
+                    image.read_downsampled(ANNOTATED_MAX_SIZE),
+                    result["detections"],
+                    image_size=(image.width, image.height)
+                )
+            else:
+                annotated_image = annotate_image(image, result["detections"])
+        with timed(timings, "encode"):
+            save_image_local(annotated_image, str(output_path))
     
-    image_files = []
-    for ext in valid_extensions:
-        image_files.extend(input_dir.glob(f'*{ext}'))
-        image_files.extend(input_dir.glob(f'*{ext.upper()}'))
+    if isinstance(image, ImageSource):
+        image.close()
     
-    return sorted(image_files)
+    return {
+        "index": result["index"],
+        "filename": result["filename"],
+        "counts": result["counts"],
+        "percentages": result["percentages"],
+        "detections": result["detections"],
+        "timings": timings,
+    }
+
+
+def open_tables(
+    output_dir: Path,
+    args: argparse.Namespace
+) -> Tuple[Optional[TableWriter], Optional[TableWriter]]:
+    """Abre as tabelas pedidas (--save-csv, --save-detections)."""
+    results_table = detections_table = None
+    if args.save_csv:
+        results_table = TableWriter(output_dir, "results", RESULT_FIELDS, args.format)
+    if args.save_detections:
+        detections_table = TableWriter(output_dir, "detections", DETECTION_FIELDS, args.format)
+    return results_table, detections_table
+
+
+def open_sink(output_dir: Path, args: argparse.Namespace) -> ResultSink:
+    """Cria o destino dos resultados de um processo (manifesto e tabelas)."""
+    results_table, detections_table = open_tables(output_dir, args)
+    return ResultSink(
+        RunManifest(output_dir, run_params(args)),
+        results_table,
+        detections_table,
+        flush_every=PARQUET_FLUSH_IMAGES if args.format == "parquet" else 1
+    )
+
+
+def run_params(args: argparse.Namespace) -> Dict[str, Any]:
+    """Parâmetros que determinam as deteções (cabeçalho do manifesto)."""
+    return {
+        "model": file_digest(args.model),
+        "conf": args.conf,
+        "iou": args.iou,
+        "variant": inference_variant(args),
+    }
+
+
+def process_files(
+    model: Any,
+    image_files: Iterable[Tuple[int, InputFile]],
+    num_files: Optional[int],
+    output_dir: Path,
+    args: argparse.Namespace,
+    cache: Optional[InferenceCache] = None,
+    sink: Optional[Union[ResultSink, ResultBuffer]] = None
+) -> Tuple[MetricsAggregator, float, Optional[Profiler]]:
+    """
+    Processa uma lista de imagens com o pipeline descodificação -> inferência
+    -> escrita.
+    
+    A descodificação corre numa thread pool, a inferência na thread atual e
+    a escrita numa writer pool. As filas são limitadas por --prefetch, pelo
+    que a memória não cresce com o número de imagens. Imagens encontradas
+    na cache não passam pelo modelo. Cada imagem concluída é entregue a
+    `sink` pela ordem do input (escrita nas tabelas de resultados e
+    registada no manifesto); só os totais ficam em memória.
+    
+    Args:
+        model: Modelo YOLO carregado
+        image_files: Pares (índice 1-based, imagem de input) a processar
+        num_files: Número total de imagens (para mensagens de progresso),
+            ou None se não for conhecido
+        output_dir: Pasta de resultados
+        args: Argumentos da linha de comandos
+        cache: Cache de resultados (opcional)
+        sink: Destino dos resultados (por omissão, as tabelas e o
+            manifesto da pasta de resultados)
+    
+    Returns:
+        Tuplo (métricas agregadas das imagens processadas, tempo de
+        inferência em s, tempos por fase de cada imagem com --profile ou
+        None)
+    """
+    aggregator = MetricsAggregator()
+    profiler = Profiler() if args.profile else None
+    if sink is None:
+        sink = open_sink(output_dir, args)
+    pending_writes: Deque[Tuple[int, InputFile, Future]] = deque()
+    inference_time = 0.0
+    
+    def collect_write(idx: int, input_file: InputFile, future: Future) -> None:
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"{progress_tag(idx, num_files)} {input_file.name}... ❌ Erro ao guardar: {e}")
+            return
+        
+        aggregator.add(result)
+        sink.add(result, input_file.path)
+        if profiler is not None:
+            profiler.add(result["timings"], input_file.name)
+    
+    def emit(
+        idx: int,
+        input_file: InputFile,
+        item: Dict[str, Any],
+        result: Dict[str, Any],
+        cached: bool
+    ) -> None:
+        result["index"] = idx
+        result["filename"] = input_file.name
+        if "data" in item:
+            # Bytes para a imagem anotada (descodificada em write_result)
+            result["original_image"] = item["data"]
+        
+        # Mostrar resumo
+        counts = result["counts"]
+        total = sum(counts.values())
+        source = " (cache)" if cached else ""
+        print(f"{progress_tag(idx, num_files)} {input_file.name}... ✅ Detetadas {total} células (RBC:{counts['RBC']}, WBC:{counts['WBC']}, PLT:{counts['Platelets']}){source}", flush=True)
+        
+        # Enviar para a writer pool (respeitando o limite da fila)
+        while len(pending_writes) >= args.prefetch:
+            collect_write(*pending_writes.popleft())
+        pending_writes.append((
+            idx,
+            input_file,
+            writer_pool.submit(
+                write_result, result, input_file, output_dir, args.save_annotated
+            )
+        ))
+    
+    def run_batch(batch: List[Tuple[int, InputFile, Dict[str, Any]]]) -> None:
+        nonlocal inference_time
+        
+        with ExitStack() as sources:
+            # As fontes lidas por regiões (--tile) são fechadas se a
+            # inferência falhar; caso contrário, passam para write_result
+            for _, _, item in batch:
+                if isinstance(item["image"], ImageSource):
+                    sources.enter_context(item["image"])
+            
+            # Inferência (um forward pass por batch; no modo tiled, os
+            # batches são de tiles de cada imagem)
+            try:
+                t0 = time.perf_counter()
+                if args.tile:
+                    batch_results = [
+                        run_inference_tiled(
+                            model=model,
+                            image=item["image"],
+                            tile_size=args.tile_size,
+                            overlap=args.tile_overlap,
+                            batch_size=args.batch_size,
+                            max_object_size=args.max_object_size,
+                            conf_threshold=args.conf,
+                            iou_threshold=args.iou
+                        )
+                        for _, _, item in batch
+                    ]
+                else:
+                    batch_results = run_inference_batch(
+                        model=model,
+                        images=[item["image"] for _, _, item in batch],
+                        batch_size=args.batch_size,
+                        conf_threshold=args.conf,
+                        iou_threshold=args.iou
+                    )
+                inference_time += time.perf_counter() - t0
+            except Exception as e:
+                for idx, input_file, _ in batch:
+                    print(f"{progress_tag(idx, num_files)} {input_file.name}... ❌ Erro: {e}")
+                return
+            
+            sources.pop_all()
+        
+        for (idx, input_file, item), result in zip(batch, batch_results):
+            if "original_size" in item:
+                # Caixas da imagem reduzida para coordenadas da original
+                image = item["image"]
+                result["detections"] = result["detections"].rescale(
+                    (image.shape[1], image.shape[0]), item["original_size"]
+                )
+            if cache is not None:
+                cache.put(item["cache_key"], result["detections"])
+            result["timings"] = add_timings(item["timings"], result["timings"])
+            emit(idx, input_file, item, result, cached=False)
+    
+    load_fn = partial(
+        _load_file,
+        args=args,
+        cache=cache,
+        model_digest=file_digest(args.model) if cache is not None else ""
+    )
+    decoded = iter_decoded(image_files, load_fn, args.prefetch, read_threads(args))
+    
+    with ThreadPoolExecutor(max_workers=args.io_threads) as writer_pool:
+        batch = []
+        
+        for idx, input_file, item, error in decoded:
+            if error is not None:
+                print(f"{progress_tag(idx, num_files)} {input_file.name}... ❌ Erro: {error}")
+                continue
+            
+            # Cache hit: resultado pronto, sem inferência
+            if item["detections"] is not None:
+                result = build_result(item["image"], item["detections"])
+                result["timings"] = item["timings"]
+                emit(idx, input_file, item, result, cached=True)
+                continue
+            
+            batch.append((idx, input_file, item))
+            if len(batch) == args.batch_size:
+                run_batch(batch)
+                batch = []
+        
+        if batch:
+            run_batch(batch)
+        del batch
+        
+        while pending_writes:
+            collect_write(*pending_writes.popleft())
+    
+    sink.flush()
+    return aggregator, inference_time, profiler
+
+
+# Modelo e cache do processo worker (criados uma vez por processo em _init_worker)
+_worker_model = None
+_worker_cache = None
+
+
+def _init_worker(model_path: str, num_threads: int, args: argparse.Namespace) -> None:
+    """Inicializa um processo worker: limita threads e carrega o modelo."""
+    global _worker_model, _worker_cache
+    
+    import cv2
+    
+    # Evitar oversubscription: cada worker usa apenas a sua fatia de cores
+    # (os motores ONNX recebem o número de threads em `load_model`)
+    if args.engine == "torch":
+        import torch
+        
+        torch.set_num_threads(num_threads)
+    cv2.setNumThreads(1)
+    
+    _worker_model = load_model(model_path, engine=args.engine, num_threads=num_threads)
+    _worker_cache = open_cache(args)
+
+
+def _process_shard(
+    shard: List[Tuple[int, InputFile]],
+    num_files: Optional[int],
+    output_dir: Path,
+    args: argparse.Namespace
+) -> Tuple[MetricsAggregator, float, Optional[Profiler], List[Tuple[Dict[str, Any], Path]]]:
+    """
+    Processa um shard de imagens num processo worker.
+    
+    Returns:
+        Tuplo (métricas, tempo de inferência, tempos por fase, resultados
+        por imagem para o processo principal escrever)
+    """
+    buffer = ResultBuffer(keep_detections=args.save_detections)
+    metrics, inference_time, profiler = process_files(
+        _worker_model, shard, num_files, output_dir, args, _worker_cache, buffer
+    )
+    return metrics, inference_time, profiler, buffer.items
+
+
+def open_cache(args: argparse.Namespace) -> Optional[InferenceCache]:
+    """Abre a cache de resultados, se --cache-dir estiver definido."""
+    if not args.cache_dir:
+        return None
+    return InferenceCache(args.cache_dir, args.cache_size_mb)
+
+
+def iter_shards(
+    image_files: Iterable[Tuple[int, InputFile]],
+    shard_size: int = 16
+) -> Iterator[List[Tuple[int, InputFile]]]:
+    """
+    Divide as imagens em shards contíguos para os workers.
+    
+    Os shards são criados à medida que as imagens são encontradas e têm no
+    máximo `shard_size` imagens, para que o trabalho fique equilibrado
+    entre workers mesmo com imagens de tamanhos diferentes.
+    """
+    files = iter(image_files)
+    while True:
+        shard = list(islice(files, shard_size))
+        if not shard:
+            return
+        yield shard
+
+
+def process_files_parallel(
+    model_path: Path,
+    image_files: Iterable[Tuple[int, InputFile]],
+    output_dir: Path,
+    args: argparse.Namespace
+) -> Tuple[MetricsAggregator, float, Optional[Profiler]]:
+    """
+    Processa as imagens em --workers processos, cada um com o seu modelo.
+    
+    Os shards são enviados aos workers à medida que as imagens são
+    encontradas, com no máximo dois shards por worker em espera. Os
+    resultados são recolhidos pela ordem de envio e escritos neste
+    processo, pelo que as tabelas ficam pela ordem do input.
+    
+    Returns:
+        Tuplo (métricas agregadas de todos os workers, soma dos tempos de
+        inferência dos workers em s, tempos por fase com --profile ou None)
+    """
+    num_threads = args.threads_per_worker or max(1, (os.cpu_count() or 1) // args.workers)
+    print(f"   Workers: {args.workers} (threads por worker: {num_threads})")
+    print()
+    
+    aggregator = MetricsAggregator()
+    profiler = Profiler() if args.profile else None
+    sink = open_sink(output_dir, args)
+    inference_time = 0.0
+    
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(str(model_path), num_threads, args)
+    ) as pool:
+        pending: Deque[Future] = deque()
+        
+        def collect(future: Future) -> None:
+            nonlocal inference_time
+            shard_metrics, shard_time, shard_profiler, shard_results = future.result()
+            for result, path in shard_results:
+                sink.add(result, path)
+            aggregator.merge(shard_metrics)
+            inference_time += shard_time
+            if profiler is not None:
+                profiler.merge(shard_profiler)
+        
+        for shard in iter_shards(image_files):
+            while len(pending) >= 2 * args.workers:
+                collect(pending.popleft())
+            pending.append(pool.submit(_process_shard, shard, None, output_dir, args))
+        
+        while pending:
+            collect(pending.popleft())
+    
+    sink.flush()
+    return aggregator, inference_time, profiler
+
+
+def run_pending(
+    model_path: Path,
+    pending: Iterable[Tuple[int, InputFile]],
+    output_dir: Path,
+    args: argparse.Namespace
+) -> Tuple[MetricsAggregator, float, float, Optional[Profiler]]:
+    """
+    Carrega o modelo e processa as imagens por processar.
+    
+    Returns:
+        Tuplo (métricas da execução, tempo de inferência, tempo total,
+        tempos por fase com --profile ou None)
+    """
+    # Carregar modelo (no modo multi-processo, cada worker carrega o seu;
+    # o .onnx é exportado e o modelo INT8 verificado aqui, uma vez, antes
+    # de arrancar os workers)
+    print(f"🤖 A carregar modelo: {model_path} (motor: {args.engine})")
+    try:
+        if args.engine == "onnx" or (args.check_parity and args.engine == "torch"):
+            export_onnx(model_path)
+        elif args.engine == "onnx-int8":
+            find_int8_onnx(model_path)
+        if args.workers == 1:
+            model = load_model(str(model_path), engine=args.engine)
+        print("✅ Modelo carregado com sucesso!")
+    except Exception as e:
+        print(f"❌ Erro ao carregar modelo: {e}")
+        sys.exit(1)
+    
+    if args.check_parity:
+        run_parity_check(model_path, args)
+    
+    # Processar imagens
+    print("\n🔍 A processar imagens...")
+    print(f"   Confidence: {args.conf}")
+    print(f"   IOU: {args.iou}")
+    print(f"   Batch size: {args.batch_size}")
+    if args.tile:
+        print(f"   Tiles: {args.tile_size}px, sobreposição {args.tile_overlap:.0%}")
+    if read_threads(args) < args.io_threads:
+        print("   Leitura: 1 thread (TAR comprimido, membros pela ordem do arquivo)")
+    
+    start_time = time.perf_counter()
+    
+    if args.cache_dir:
+        print(f"   Cache: {args.cache_dir}")
+    
+    if args.workers == 1:
+        print()
+        run_metrics, inference_time, profiler = process_files(
+            model, pending, None, output_dir, args, open_cache(args)
+        )
+    else:
+        try:
+            run_metrics, inference_time, profiler = process_files_parallel(
+                model_path, pending, output_dir, args
+            )
+        except Exception as e:
+            print(f"❌ Erro nos processos worker: {e}")
+            sys.exit(1)
+    
+    return run_metrics, inference_time, time.perf_counter() - start_time, profiler
+
+
+def print_profile(profiler: Profiler) -> None:
+    """Mostra os percentis dos tempos de cada fase (--profile)."""
+    print()
+    print(f"⏱️  Tempos por fase (ms por imagem, {len(profiler.images)} imagens):")
+    print(f"   {'Fase':<12}{'p50':>10}{'p95':>10}{'p99':>10}{'máx':>10}{'% total':>9}")
+    summary = profiler.summary()
+    total_ms = summary["total"]["total_ms"] if "total" in summary else 0.0
+    for stage, stats in summary.items():
+        share = 100.0 * stats["total_ms"] / total_ms if total_ms else 0.0
+        print(
+            f"   {stage:<12}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}"
+            f"{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}{share:>8.1f}%"
+        )
 
 
 def main():
     args = parse_args()
     
     # Validar inputs
-    input_dir = Path(args.input)
-    if not input_dir.exists():
-        print(f"❌ Erro: Pasta de input não existe: {input_dir}")
+    if args.input is None and args.file_list is None:
+        print("❌ Erro: Indica uma pasta de input (--input) ou uma lista de ficheiros (--file-list)")
+        sys.exit(1)
+    
+    input_dir = Path(args.input) if args.input else None
+    if input_dir is not None and not input_dir.is_dir():
+        if not input_dir.exists():
+            print(f"❌ Erro: Pasta de input não existe: {input_dir}")
+            sys.exit(1)
+        if args.file_list or not is_archive_file(input_dir.name):
+            print(f"❌ Erro: --input tem de ser uma pasta ou um arquivo .zip/.tar: {input_dir}")
+            sys.exit(1)
+    
+    if args.file_list not in (None, "-") and not Path(args.file_list).is_file():
+        print(f"❌ Erro: Lista de ficheiros não existe: {args.file_list}")
         sys.exit(1)
     
     output_dir = Path(args.output)
@@ -102,72 +975,103 @@ def main():
         print(f"❌ Erro: Modelo não encontrado: {model_path}")
         sys.exit(1)
     
-    # Obter ficheiros
-    image_files = get_image_files(input_dir)
-    if not image_files:
-        print(f"❌ Erro: Nenhuma imagem encontrada em: {input_dir}")
+    for option in ("batch_size", "prefetch", "io_threads", "workers", "threads_per_worker"):
+        value = getattr(args, option)
+        if value is not None and value < 1:
+            flag = "--" + option.replace("_", "-")
+            print(f"❌ Erro: {flag} tem de ser >= 1 (recebido: {value})")
+            sys.exit(1)
+    
+    if args.tile and (args.tile_size < 32 or not 0 <= args.tile_overlap < 1):
+        print("❌ Erro: --tile-size tem de ser >= 32 e --tile-overlap estar em [0, 1)")
         sys.exit(1)
     
-    print(f"📁 Encontradas {len(image_files)} imagens em: {input_dir}")
+    if args.tile:
+        overlap_px = args.tile_size - tile_stride(args.tile_size, args.tile_overlap)
+        min_overlap = min_tile_overlap(args.max_object_size)
+        if overlap_px < min_overlap:
+            print(
+                f"❌ Erro: a sobreposição entre tiles ({overlap_px} px) tem de ter pelo menos "
+                f"{min_overlap:.0f} px para objetos até {args.max_object_size} px "
+                f"(aumenta --tile-overlap ou ajusta --max-object-size)"
+            )
+            sys.exit(1)
+    
+    # As imagens são procuradas à medida que o processamento avança
+    input_source = args.file_list if args.file_list else input_dir
+    if args.file_list == "-":
+        input_source = "stdin"
+    recursive = " (recursivo)" if args.recursive and not args.file_list else ""
+    print(f"📁 A procurar imagens em: {input_source}{recursive}")
     
-    # Carregar modelo
-    print(f"🤖 A carregar modelo: {model_path}")
+    # Manifesto: regista as imagens concluídas para poder retomar (--resume)
+    manifest = RunManifest(output_dir, run_params(args))
     try:
-        model = load_model(str(model_path))
-        print("✅ Modelo carregado com sucesso!")
-    except Exception as e:
-        print(f"❌ Erro ao carregar modelo: {e}")
+        done_entries = manifest.start(resume=args.resume)
+    except ManifestMismatchError as e:
+        print(f"❌ Erro: {e}")
+        print("   Usa os mesmos parâmetros, outra pasta de output ou corre sem --resume.")
         sys.exit(1)
     
-    # Processar imagens
-    print(f"\n🔍 A processar {len(image_files)} imagens...")
-    print(f"   Confidence: {args.conf}")
-    print(f"   IOU: {args.iou}")
-    print()
+    # Tabelas de resultados, escritas à medida que as imagens são concluídas
+    try:
+        results_table, detections_table = open_tables(output_dir, args)
+    except ImportError as e:
+        print(f"❌ Erro: {e}")
+        sys.exit(1)
+    # Ao retomar, as linhas de imagens que não chegaram ao manifesto são
+    # removidas (vão ser processadas de novo)
+    if results_table is not None and results_table.start(resume=args.resume, committed=done_entries):
+        # Primeira vez com --save-csv numa execução retomada
+        results_table.write(rows_to_columns(
+            map(result_to_row, entries_to_results(done_entries)), RESULT_FIELDS
+        ))
+    if detections_table is not None:
+        detections_table.start(resume=args.resume, committed=done_entries)
     
-    all_results = []
+    # Imagens já concluídas (--resume) entram só nos totais
+    resumed_metrics = MetricsAggregator()
+    num_found = 0
     
-    for idx, img_path in enumerate(image_files, 1):
-        print(f"[{idx}/{len(image_files)}] {img_path.name}...", end=" ")
-        
-        try:
-            # Carregar imagem
-            with open(img_path, 'rb') as f:
-                image = load_image(f)
-            
-            # Inferência
-            result = run_inference(
-                model=model,
-                image=image,
-                conf_threshold=args.conf,
-                iou_threshold=args.iou,
-                show_labels=True,
-                show_conf=True
-            )
-            
-            result["filename"] = img_path.name
-            all_results.append(result)
-            
-            # Guardar imagem anotada se solicitado
-            if args.save_annotated:
-                output_path = output_dir / f"{img_path.stem}_annotated.png"
-                save_image_local(result["annotated_image"], str(output_path))
-            
-            # Mostrar resumo
-            counts = result["counts"]
-            total = sum(counts.values())
-            print(f"✅ Detetadas {total} células (RBC:{counts['RBC']}, WBC:{counts['WBC']}, PLT:{counts['Platelets']})")
-            
-        except Exception as e:
-            print(f"❌ Erro: {e}")
-            continue
+    def pending_files() -> Iterator[Tuple[int, InputFile]]:
+        nonlocal num_found
+        for idx, input_file in enumerate(iter_input_files(args), 1):
+            num_found = idx
+            entry = done_entries.get(input_file.name)
+            if is_done(entry, input_file.path):
+                resumed_metrics.add(entry)
+            else:
+                yield idx, input_file
+    
+    # Procurar a primeira imagem por processar antes de carregar o modelo:
+    # sem imagens (ou com todas já concluídas) o modelo não é carregado
+    pending = pending_files()
+    first_pending = next(pending, None)
+    if num_found == 0:
+        print(f"❌ Erro: Nenhuma imagem encontrada em: {input_source}")
+        sys.exit(1)
+    
+    if first_pending is None:
+        # Todas as imagens já concluídas (--resume): nada a carregar
+        run_metrics, inference_time, elapsed, profiler = MetricsAggregator(), 0.0, 0.0, None
+    else:
+        run_metrics, inference_time, elapsed, profiler = run_pending(
+            model_path, chain([first_pending], pending), output_dir, args
+        )
     
     # Calcular métricas agregadas
     print("\n" + "="*60)
     print("📊 RESUMO")
     print("="*60)
     
-    metrics = calculate_metrics(all_results)
+    # Totais desta execução e das imagens já concluídas (--resume)
+    num_processed = run_metrics.num_images
+    run_metrics.merge(resumed_metrics)
+    metrics = run_metrics.metrics()
+    
+    print(f"Imagens encontradas: {num_found}")
+    if args.resume:
+        print(f"⏭️  Já processadas antes (--resume): {resumed_metrics.num_images}")
     
     print(f"Total de imagens processadas: {metrics['num_images']}")
     print(f"Total de células detetadas: {sum(metrics['total_counts'].values())}")
@@ -177,28 +1081,34 @@ def main():
         pct = metrics['percentages'][cls]
         print(f"  {cls:>10}: {count:>6} ({pct:>5.2f}%)")
     
-    # Guardar CSV se solicitado
-    if args.save_csv:
-        csv_path = output_dir / "results.csv"
-        
-        df_data = []
-        for result in all_results:
-            row = {
-                "filename": result["filename"],
-                "RBC": result["counts"]["RBC"],
-                "WBC": result["counts"]["WBC"],
-                "Platelets": result["counts"]["Platelets"],
-                "Total": sum(result["counts"].values()),
-                "RBC_pct": result["percentages"]["RBC"],
-                "WBC_pct": result["percentages"]["WBC"],
-                "Platelets_pct": result["percentages"]["Platelets"],
-            }
-            df_data.append(row)
-        
-        df = pd.DataFrame(df_data)
-        df.to_csv(csv_path, index=False)
-        
-        print(f"\n💾 CSV guardado em: {csv_path}")
+    # Throughput (permite comparar diferentes valores de --batch-size)
+    if num_processed and elapsed > 0:
+        print()
+        print(f"⚡ Throughput (batch size {args.batch_size}):")
+        print(f"   {'Total:':<12}{num_processed / elapsed:>8.2f} imagens/s")
+        if inference_time > 0:
+            # Com vários workers, o tempo de inferência é somado entre processos
+            per_process = num_processed / inference_time
+            print(f"   {'Inferência:':<12}{per_process * args.workers:>8.2f} imagens/s")
+    
+    # Tempos por fase (--profile)
+    if profiler is not None and profiler.images:
+        print_profile(profiler)
+        profile_path = output_dir / PROFILE_FILENAME
+        profiler.write_trace(profile_path, meta={
+            **run_params(args),
+            "engine": args.engine,
+            "batch_size": args.batch_size,
+            "workers": args.workers,
+            "elapsed_s": elapsed,
+        })
+        print(f"💾 Trace guardado em: {profile_path}")
+    
+    # Tabelas escritas durante o processamento
+    if results_table is not None:
+        print(f"\n💾 Resultados guardados em: {results_table.path}")
+    if detections_table is not None:
+        print(f"💾 Deteções guardadas em: {detections_table.path}")
     
     if args.save_annotated:
         print(f"🖼️  Imagens anotadas guardadas em: {output_dir}")
@@ -0,0 +1,527 @@
+"""
+Benchmark dos caminhos críticos de inferência e I/O.
+Corre offline em CPU: usa imagens sintéticas semelhantes a esfregaços de
+sangue e um modelo YOLOv8 com pesos aleatórios (3 classes), pelo que não
+precisa de pesos descarregados. Os resultados são guardados em JSON para
+comparar entre commits.
+
+Uso:
+    python benchmark.py
+    python benchmark.py --compare benchmarks/abc1234.json
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+
+from src.annotate import annotate_image
+from src.infer import (
+    ENGINES,
+    _extract_detections,
+    build_result,
+    calculate_metrics,
+    load_model,
+    run_inference,
+    run_inference_batch,
+)
+from src.io_utils import create_results_zip, image_to_bytes, load_image
+
+
+# Classes do modelo sintético (as mesmas do modelo treinado)
+BENCHMARK_CLASSES = {0: "RBC", 1: "WBC", 2: "Platelets"}
+
+# Resoluções por omissão (largura x altura)
+DEFAULT_SIZES = "640x480,1280x960,1920x1440"
+
+# Pasta por omissão dos resultados (um ficheiro por commit)
+DEFAULT_OUTPUT_DIR = "benchmarks"
+
+
+def parse_args():
+    """Parse argumentos da linha de comandos."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark da inferência e do I/O (offline, CPU)",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Exemplos:
+  python benchmark.py
+  python benchmark.py --sizes 640x480,2592x1944 --repeat 10
+  python benchmark.py --compare benchmarks/abc1234.json --max-regression 15
+        """
+    )
+    
+    parser.add_argument(
+        "--arch",
+        type=str,
+        default="yolov8n.yaml",
+        help="Arquitetura do modelo aleatório (default: yolov8n.yaml)"
+    )
+    
+    parser.add_argument(
+        "--model", "-m",
+        type=str,
+        default=None,
+        help="Usar um modelo .pt existente em vez do modelo aleatório"
+    )
+    
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default="torch",
+        help="Motor de inferência (default: torch)"
+    )
+    
+    parser.add_argument(
+        "--sizes",
+        type=str,
+        default=DEFAULT_SIZES,
+        help=f"Resoluções das imagens, LxA separadas por vírgulas (default: {DEFAULT_SIZES})"
+    )
+    
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="Repetições medidas de cada operação (default: 5)"
+    )
+    
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=1,
+        help="Repetições de aquecimento, não medidas (default: 1)"
+    )
+    
+    parser.add_argument(
+        "--batch-sizes",
+        type=str,
+        default="1,4",
+        help="Batch sizes a medir em run_inference_batch (default: 1,4)"
+    )
+    
+    parser.add_argument(
+        "--zip-images",
+        type=int,
+        default=8,
+        help="Número de imagens anotadas no ZIP (default: 8)"
+    )
+    
+    parser.add_argument(
+        "--metrics-results",
+        type=int,
+        default=10000,
+        help="Número de resultados em calculate_metrics (default: 10000)"
+    )
+    
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help="Threads do PyTorch (default: as do PyTorch)"
+    )
+    
+    parser.add_argument(
+        "--output", "-o",
+        type=str,
+        default=None,
+        help=f"Ficheiro JSON de resultados (default: {DEFAULT_OUTPUT_DIR}/<commit>.json)"
+    )
+    
+    parser.add_argument(
+        "--compare",
+        type=str,
+        default=None,
+        help="JSON de uma execução anterior, para comparar as medianas"
+    )
+    
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=None,
+        help="Com --compare, falhar (exit 1) se alguma operação ficar mais de X%% mais lenta"
+    )
+    
+    return parser.parse_args()
+
+
+def parse_sizes(text: str) -> List[Tuple[int, int]]:
+    """Converte "640x480,1280x960" em [(640, 480), (1280, 960)]."""
+    sizes = []
+    for item in text.split(","):
+        width, height = item.lower().strip().split("x")
+        sizes.append((int(width), int(height)))
+    return sizes
+
+
+def make_smear_image(width: int, height: int, seed: int = 0) -> np.ndarray:
+    """
+    Gera uma imagem sintética semelhante a um esfregaço de sangue.
+    
+    Fundo rosado com muitos glóbulos vermelhos (discos com centro mais
+    claro), alguns glóbulos brancos (núcleo roxo lobulado) e plaquetas
+    (pontos roxos pequenos), com desfoque e ruído.
+    
+    Args:
+        width: Largura em pixels
+        height: Altura em pixels
+        seed: Semente do gerador aleatório (imagens reprodutíveis)
+    
+    Returns:
+        Imagem RGB (uint8)
+    """
+    import cv2
+    
+    rng = np.random.default_rng(seed)
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[:] = (236, 214, 220)
+    
+    # Densidade semelhante a um campo de 100x: ~1 RBC por 60x60 px
+    scale = min(width, height) / 480
+    num_rbc = int(width * height / 3600)
+    for _ in range(num_rbc):
+        center = (int(rng.integers(width)), int(rng.integers(height)))
+        radius = max(3, int(rng.normal(18, 2) * scale))
+        color = tuple(int(c) for c in rng.normal((200, 110, 120), 8))
+        cv2.circle(image, center, radius, color, -1, cv2.LINE_AA)
+        cv2.circle(image, center, radius // 2, (225, 160, 170), -1, cv2.LINE_AA)
+    
+    for _ in range(max(1, num_rbc // 150)):
+        center = (int(rng.integers(width)), int(rng.integers(height)))
+        radius = max(6, int(28 * scale))
+        cv2.circle(image, center, radius, (215, 200, 230), -1, cv2.LINE_AA)
+        for _ in range(3):
+            offset = rng.integers(-radius // 2, radius // 2 + 1, size=2)
+            lobe = (center[0] + int(offset[0]), center[1] + int(offset[1]))
+            cv2.circle(image, lobe, radius // 3, (110, 50, 140), -1, cv2.LINE_AA)
+    
+    for _ in range(max(1, num_rbc // 20)):
+        center = (int(rng.integers(width)), int(rng.integers(height)))
+        cv2.circle(image, center, max(2, int(4 * scale)), (140, 80, 160), -1, cv2.LINE_AA)
+    
+    image = cv2.GaussianBlur(image, (3, 3), 0)
+    noise = rng.normal(0, 4, image.shape)
+    return np.clip(image + noise, 0, 255).astype(np.uint8)
+
+
+def build_random_model(arch: str, output_dir: Path) -> Path:
+    """
+    Cria um modelo YOLO com pesos aleatórios e as classes do projeto.
+    
+    Args:
+        arch: Configuração da arquitetura do Ultralytics (ex: yolov8n.yaml)
+        output_dir: Pasta onde guardar o ficheiro .pt
+    
+    Returns:
+        Caminho do ficheiro .pt (carregável com `load_model`)
+    """
+    import torch
+    from ultralytics.nn.tasks import DetectionModel
+    
+    torch.manual_seed(0)
+    model = DetectionModel(arch, nc=len(BENCHMARK_CLASSES), verbose=False)
+    model.names = dict(BENCHMARK_CLASSES)
+    
+    path = output_dir / f"{Path(arch).stem}-random.pt"
+    torch.save({"model": model, "train_args": {}}, path)
+    return path
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Estatísticas de uma lista de tempos (em milissegundos)."""
+    return {
+        "n": len(samples),
+        "median_ms": statistics.median(samples),
+        "mean_ms": statistics.fmean(samples),
+        "min_ms": min(samples),
+        "max_ms": max(samples),
+        "stdev_ms": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+    }
+
+
+class Benchmark:
+    """Mede operações e junta os resultados por nome."""
+    
+    def __init__(self, repeat: int, warmup: int):
+        """
+        Args:
+            repeat: Repetições medidas de cada operação
+            warmup: Repetições de aquecimento, não medidas
+        """
+        self.repeat = repeat
+        self.warmup = warmup
+        self.results: Dict[str, Dict[str, float]] = {}
+    
+    def run(self, name: str, fn: Callable[[], Any], per: int = 1) -> Any:
+        """
+        Mede `fn` e regista o resultado como `name`.
+        
+        Args:
+            name: Nome da operação (chave no JSON)
+            fn: Função sem argumentos a medir
+            per: Divide os tempos por este valor (ex: tempo por imagem)
+        
+        Returns:
+            Valor devolvido pela última chamada de `fn`
+        """
+        for _ in range(self.warmup):
+            value = fn()
+        
+        samples = []
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            value = fn()
+            samples.append((time.perf_counter() - start) * 1000 / per)
+        
+        self.results[name] = summarize(samples)
+        print(f"   {name:<40} {self.results[name]['median_ms']:>10.2f} ms")
+        return value
+    
+    def record(self, name: str, samples: List[float]) -> None:
+        """Regista tempos medidos fora de `run` (em milissegundos)."""
+        self.results[name] = summarize(samples)
+        print(f"   {name:<40} {self.results[name]['median_ms']:>10.2f} ms")
+
+
+def bench_inference(
+    bench: Benchmark,
+    model: Any,
+    image: np.ndarray,
+    tag: str,
+    engine: str
+) -> Dict[str, Any]:
+    """
+    Mede `run_inference` numa imagem e as suas fases: predict, extração
+    das caixas e desenho das deteções (plot).
+    
+    Returns:
+        Resultado de `run_inference` (para as medições seguintes)
+    """
+    kwargs = dict(conf_threshold=0.25, iou_threshold=0.45, max_det=300)
+    result = bench.run(f"run_inference[{tag}]", lambda: run_inference(model, image, **kwargs))
+    
+    if engine == "torch":
+        predictions = bench.run(f"run_inference.predict[{tag}]", lambda: model.predict(
+            image[..., ::-1], conf=0.25, iou=0.45, max_det=300, verbose=False
+        ))
+        bench.run(f"run_inference.extract[{tag}]", lambda: build_result(
+            image, _extract_detections(model, predictions[0])
+        ))
+    else:
+        detections = bench.run(f"run_inference.predict[{tag}]", lambda: model.predict_detections(
+            [image], 0.25, 0.45, 300
+        ))
+        bench.run(f"run_inference.extract[{tag}]", lambda: build_result(image, detections[0]))
+    
+    bench.run(f"run_inference.plot[{tag}]", lambda: annotate_image(image, result["detections"]))
+    return result
+
+
+def bench_batches(
+    bench: Benchmark,
+    model: Any,
+    image: np.ndarray,
+    tag: str,
+    batch_sizes: List[int]
+) -> None:
+    """Mede `run_inference_batch` (tempo por imagem) para cada batch size."""
+    for batch_size in batch_sizes:
+        images = [image] * batch_size
+        bench.run(
+            f"run_inference_batch[{tag},bs={batch_size}]/img",
+            lambda: run_inference_batch(model, images, batch_size=batch_size),
+            per=batch_size
+        )
+
+
+def make_metrics_results(num_results: int) -> List[Dict[str, Any]]:
+    """Resultados sintéticos (só contagens) para `calculate_metrics`."""
+    rng = np.random.default_rng(0)
+    counts = rng.poisson((250, 3, 15), size=(num_results, 3))
+    return [
+        {"filename": f"img{i}.png", "counts": dict(zip(("RBC", "WBC", "Platelets"), map(int, row)))}
+        for i, row in enumerate(counts)
+    ]
+
+
+def git_commit() -> Optional[str]:
+    """Commit atual (abreviado), ou None fora de um repositório git."""
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=Path(__file__).resolve().parent
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip() or None
+
+
+def environment_info(args: argparse.Namespace, model_path: Path) -> Dict[str, Any]:
+    """Descreve a máquina e as versões (para comparar execuções)."""
+    import cv2
+    import torch
+    import ultralytics
+    
+    return {
+        "commit": git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "torch": torch.__version__,
+        "ultralytics": ultralytics.__version__,
+        "engine": args.engine,
+        "model": args.model or args.arch,
+        "model_size_mb": round(model_path.stat().st_size / (1024 * 1024), 2),
+        "repeat": args.repeat,
+        "warmup": args.warmup,
+    }
+
+
+def compare_results(
+    current: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    max_regression: Optional[float] = None
+) -> List[str]:
+    """
+    Mostra as medianas atuais lado a lado com as de uma execução anterior.
+    
+    Args:
+        current: Resultados desta execução
+        baseline: Resultados da execução anterior
+        max_regression: Percentagem a partir da qual uma operação mais
+            lenta conta como regressão
+    
+    Returns:
+        Nomes das operações com regressão
+    """
+    regressions = []
+    
+    print(f"\n   {'Operação':<40} {'antes':>10} {'agora':>10} {'dif.':>8}")
+    for name, stats in current.items():
+        if name not in baseline:
+            print(f"   {name:<40} {'-':>10} {stats['median_ms']:>10.2f}")
+            continue
+        
+        before = baseline[name]["median_ms"]
+        change = 100.0 * (stats["median_ms"] - before) / before if before else 0.0
+        flag = ""
+        if max_regression is not None and change > max_regression:
+            regressions.append(name)
+            flag = " ❌"
+        print(f"   {name:<40} {before:>10.2f} {stats['median_ms']:>10.2f} {change:>+7.1f}%{flag}")
+    
+    return regressions
+
+
+def main():
+    """Função principal."""
+    args = parse_args()
+    
+    try:
+        sizes = parse_sizes(args.sizes)
+        batch_sizes = [int(b) for b in args.batch_sizes.split(",") if b.strip()]
+    except ValueError:
+        print(f"❌ Erro: --sizes ou --batch-sizes inválidos: {args.sizes} / {args.batch_sizes}")
+        sys.exit(1)
+    
+    baseline = None
+    if args.compare:
+        try:
+            with open(args.compare, "r", encoding="utf-8") as f:
+                baseline = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"❌ Erro ao ler {args.compare}: {e}")
+            sys.exit(1)
+    
+    if args.threads is not None:
+        import torch
+        torch.set_num_threads(args.threads)
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.model:
+            model_path = Path(args.model)
+        else:
+            print(f"🤖 A criar modelo aleatório: {args.arch} ({len(BENCHMARK_CLASSES)} classes)")
+            model_path = build_random_model(args.arch, Path(tmp_dir))
+        
+        bench = Benchmark(args.repeat, args.warmup)
+        
+        print(f"⏱️  load_model (motor: {args.engine})")
+        start = time.perf_counter()
+        try:
+            model = load_model(str(model_path), engine=args.engine)
+        except Exception as e:
+            print(f"❌ Erro ao carregar modelo: {e}")
+            sys.exit(1)
+        bench.record("load_model", [(time.perf_counter() - start) * 1000])
+        
+        meta = environment_info(args, model_path)
+    
+    annotated = {}
+    for idx, (width, height) in enumerate(sizes):
+        tag = f"{width}x{height}"
+        print(f"\n🖼️  Imagem sintética {tag}")
+        image = make_smear_image(width, height, seed=idx)
+        
+        png = image_to_bytes(image, format="PNG")
+        jpeg = image_to_bytes(image, format="JPEG")
+        bench.run(f"load_image.png[{tag}]", lambda: load_image(io.BytesIO(png)))
+        bench.run(f"load_image.jpeg[{tag}]", lambda: load_image(io.BytesIO(jpeg)))
+        
+        result = bench_inference(bench, model, image, tag, args.engine)
+        bench_batches(bench, model, image, tag, batch_sizes)
+        
+        annotated[tag] = annotate_image(image, result["detections"])
+        bench.run(f"image_to_bytes.png[{tag}]", lambda: image_to_bytes(annotated[tag], format="PNG"))
+    
+    print("\n📦 Exportação e métricas")
+    for tag, image in annotated.items():
+        images = {f"img{i}": image for i in range(args.zip_images)}
+        bench.run(
+            f"create_results_zip[{tag}]/img",
+            lambda: create_results_zip(images),
+            per=args.zip_images
+        )
+    
+    metrics_results = make_metrics_results(args.metrics_results)
+    bench.run(
+        f"calculate_metrics[{args.metrics_results}]",
+        lambda: calculate_metrics(metrics_results)
+    )
+    
+    output_path = Path(args.output or Path(DEFAULT_OUTPUT_DIR) / f"{meta['commit'] or 'local'}.json")
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": bench.results}, f, indent=2)
+    print(f"\n💾 Resultados guardados em: {output_path}")
+    
+    if baseline is not None:
+        print(f"\n📊 Comparação com {args.compare} (commit {baseline['meta'].get('commit')})")
+        for key in ("engine", "model", "cpu_count", "torch_threads"):
+            if baseline["meta"].get(key) != meta[key]:
+                print(f"   ⚠️  {key} diferente: {baseline['meta'].get(key)} → {meta[key]}")
+        regressions = compare_results(bench.results, baseline["results"], args.max_regression)
+        if regressions:
+            print(f"\n❌ {len(regressions)} operações mais de {args.max_regression}% mais lentas")
+            sys.exit(1)
+    
+    print("\n✅ Benchmark concluído!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,401 @@
+"""
+Serviço HTTP local de deteção de células sanguíneas.
+Mantém o modelo carregado e agrupa pedidos concorrentes num único forward
+pass (micro-batching dinâmico).
+
+Uso:
+    python serve.py --port 8000
+    curl --data-binary @imagem.png "http://127.0.0.1:8000/predict?conf=0.3"
+    curl -F file=@a.png -F file=@b.jpg "http://127.0.0.1:8000/predict?annotated=1"
+
+Endpoints:
+    GET  /health   Estado do serviço e parâmetros do batching
+    POST /predict  Imagem no corpo do pedido (ou várias em multipart/form-data);
+                   devolve {"results": [{filename, counts, percentages,
+                   detections, timings, batch_size[, annotated_image]}]}
+                   Parâmetros (query string): conf, iou, annotated (0/1),
+                   labels (0/1), show_conf (0/1)
+"""
+
+import argparse
+import base64
+import json
+import sys
+from functools import partial
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from src.annotate import annotate_image
+from src.batching import BatcherClosedError, MicroBatcher
+from src.detections import apply_thresholds
+from src.infer import (
+    ENGINES,
+    RAW_CONF_THRESHOLD,
+    RAW_IOU_THRESHOLD,
+    RAW_MAX_DET,
+    build_result,
+    load_model,
+    run_inference_batch,
+)
+from src.io_utils import MODEL_INPUT_SIZE, decode_image, image_to_bytes
+from src.profiling import timed
+
+
+def parse_args():
+    """Parse argumentos da linha de comandos."""
+    parser = argparse.ArgumentParser(
+        description="Serviço HTTP de deteção de células sanguíneas",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Exemplos:
+  python serve.py
+  python serve.py --port 9000 --max-batch-size 16 --max-wait-ms 20
+  python serve.py --engine onnx --host 0.0.0.0
+        """
+    )
+    
+    parser.add_argument(
+        "--host",
+        type=str,
+        default="127.0.0.1",
+        help="Endereço onde escutar (default: 127.0.0.1)"
+    )
+    
+    parser.add_argument(
+        "--port", "-p",
+        type=int,
+        default=8000,
+        help="Porta (default: 8000)"
+    )
+    
+    parser.add_argument(
+        "--model", "-m",
+        type=str,
+        default="models/best.pt",
+        help="Caminho para o modelo YOLO (default: models/best.pt)"
+    )
+    
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default="torch",
+        help="Motor de inferência (default: torch)"
+    )
+    
+    parser.add_argument(
+        "--max-batch-size",
+        type=int,
+        default=8,
+        help="Número máximo de imagens por forward pass (default: 8)"
+    )
+    
+    parser.add_argument(
+        "--max-wait-ms",
+        type=float,
+        default=10.0,
+        help="Tempo máximo de espera por mais pedidos para o mesmo batch, em ms (default: 10)"
+    )
+    
+    parser.add_argument(
+        "--max-upload-mb",
+        type=float,
+        default=50.0,
+        help="Tamanho máximo de cada pedido, em MB (default: 50)"
+    )
+    
+    parser.add_argument(
+        "--verbose", "-v",
+        action="store_true",
+        help="Mostrar cada pedido no terminal"
+    )
+    
+    return parser.parse_args()
+
+
+class RequestError(Exception):
+    """Pedido inválido; a mensagem é devolvida ao cliente."""
+    
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class InferenceServer(ThreadingHTTPServer):
+    """Servidor HTTP (um thread por ligação) com o batcher partilhado."""
+    
+    daemon_threads = True
+    
+    def __init__(self, address: Tuple[str, int], batcher: MicroBatcher, args: argparse.Namespace):
+        super().__init__(address, InferenceHandler)
+        self.batcher = batcher
+        self.args = args
+
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    """Trata os pedidos /health e /predict."""
+    
+    server: InferenceServer
+    protocol_version = "HTTP/1.1"
+    
+    def do_GET(self):
+        if urlparse(self.path).path != "/health":
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": "Endpoint não encontrado"})
+            return
+        
+        args = self.server.args
+        self._send_json(HTTPStatus.OK, {
+            "status": "ok",
+            "model": args.model,
+            "engine": args.engine,
+            "max_batch_size": args.max_batch_size,
+            "max_wait_ms": args.max_wait_ms,
+        })
+    
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/predict":
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": "Endpoint não encontrado"})
+            return
+        
+        try:
+            params = parse_qs(url.query)
+            files = self._read_files(params)
+            results = predict(self.server.batcher, files, params)
+        except RequestError as e:
+            self._send_json(e.status, {"error": str(e)})
+            return
+        except BatcherClosedError:
+            self._send_json(HTTPStatus.SERVICE_UNAVAILABLE, {"error": "O serviço está a terminar"})
+            return
+        except Exception as e:
+            self._send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": f"Erro na inferência: {e}"})
+            return
+        
+        self._send_json(HTTPStatus.OK, {"results": results})
+    
+    def _read_files(self, params: Dict[str, List[str]]) -> List[Tuple[str, bytes]]:
+        """Lê as imagens do corpo do pedido (bytes da imagem ou multipart)."""
+        length = self.headers.get("Content-Length")
+        if length is None:
+            raise RequestError(HTTPStatus.LENGTH_REQUIRED, "Falta o cabeçalho Content-Length")
+        try:
+            length = int(length)
+        except ValueError:
+            length = -1
+        if length < 0:
+            # Fechar a ligação: não se sabe onde acaba o corpo
+            self.close_connection = True
+            raise RequestError(HTTPStatus.BAD_REQUEST, f"Content-Length inválido: {self.headers['Content-Length']}")
+        if length > self.server.args.max_upload_mb * 1024 * 1024:
+            # Fechar a ligação: o corpo não é lido
+            self.close_connection = True
+            raise RequestError(
+                HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                f"Pedido maior do que {self.server.args.max_upload_mb:g} MB"
+            )
+        body = self.rfile.read(length)
+        
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.startswith("multipart/form-data"):
+            files = parse_multipart(body, content_type)
+        else:
+            files = [(params.get("filename", ["image"])[0], body)]
+        
+        if not files or not all(data for _, data in files):
+            raise RequestError(HTTPStatus.BAD_REQUEST, "Nenhuma imagem no pedido")
+        return files
+    
+    def _send_json(self, status: HTTPStatus, payload: Dict[str, Any]) -> None:
+        """Envia uma resposta JSON."""
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        if self.server.args.verbose:
+            super().log_message(format, *args)
+
+
+def parse_multipart(body: bytes, content_type: str) -> List[Tuple[str, bytes]]:
+    """
+    Extrai os ficheiros de um corpo multipart/form-data.
+    
+    Returns:
+        Lista de (nome do ficheiro, bytes), pela ordem do pedido
+    """
+    from email import policy
+    from email.parser import BytesParser
+    
+    message = BytesParser(policy=policy.HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body
+    )
+    if not message.is_multipart():
+        raise RequestError(HTTPStatus.BAD_REQUEST, "Corpo multipart inválido")
+    
+    return [
+        (part.get_filename(), part.get_payload(decode=True) or b"")
+        for part in message.iter_parts()
+        if part.get_filename()
+    ]
+
+
+def _flag(params: Dict[str, List[str]], name: str, default: bool) -> bool:
+    """Lê um parâmetro booleano da query string (1/0, true/false)."""
+    if name not in params:
+        return default
+    return params[name][0].lower() in ("1", "true", "yes", "on")
+
+
+def _threshold(params: Dict[str, List[str]], name: str, default: float, low: float, high: float) -> float:
+    """Lê um limiar da query string e verifica o intervalo."""
+    try:
+        value = float(params.get(name, [default])[0])
+    except ValueError:
+        raise RequestError(HTTPStatus.BAD_REQUEST, f"{name} inválido: {params[name][0]}")
+    if not low <= value <= high:
+        raise RequestError(HTTPStatus.BAD_REQUEST, f"{name} tem de estar em [{low}, {high}]")
+    return value
+
+
+def predict(
+    batcher: MicroBatcher,
+    files: List[Tuple[str, bytes]],
+    params: Dict[str, List[str]]
+) -> List[Dict[str, Any]]:
+    """
+    Deteta as células nas imagens de um pedido.
+    
+    O modelo corre com limiares permissivos (como na app), pelo que
+    pedidos com limiares diferentes partilham o mesmo batch; os limiares
+    de cada pedido são aplicados depois, sem novo forward pass.
+    
+    Args:
+        batcher: Batcher partilhado
+        files: Lista de (nome, bytes da imagem)
+        params: Parâmetros da query string
+    
+    Returns:
+        Um resultado por imagem, pronto para JSON
+    """
+    conf = _threshold(params, "conf", 0.25, RAW_CONF_THRESHOLD, 1.0)
+    iou = _threshold(params, "iou", 0.45, 0.0, RAW_IOU_THRESHOLD)
+    annotated = _flag(params, "annotated", False)
+    
+    # Descodificar no thread do pedido (em paralelo com os outros pedidos).
+    # Os JPEG são sempre descodificados já reduzidos ao tamanho de entrada
+    # do modelo, com ou sem imagem anotada, para que as deteções não
+    # dependam dessa opção
+    images = []
+    original_sizes = []
+    timings = []
+    for name, data in files:
+        image_timings: Dict[str, float] = {}
+        try:
+            with timed(image_timings, "decode"):
+                image, original_size = decode_image(data, MODEL_INPUT_SIZE)
+        except Exception:
+            raise RequestError(HTTPStatus.BAD_REQUEST, f"Imagem inválida: {name}")
+        images.append(image)
+        original_sizes.append(original_size)
+        timings.append(image_timings)
+    
+    futures = [batcher.submit(image) for image in images]
+    
+    results = []
+    for (name, data), image, original_size, image_timings, future in zip(
+        files, images, original_sizes, timings, futures
+    ):
+        raw = future.result()
+        image_timings.update(raw["timings"])
+        
+        detections = apply_thresholds(raw["detections"], conf, iou).rescale(
+            (image.shape[1], image.shape[0]), original_size
+        )
+        result = build_result(image, detections)
+        payload = {
+            "filename": name,
+            "counts": result["counts"],
+            "percentages": result["percentages"],
+            "detections": detections.to_list(),
+            "batch_size": raw["batch_size"],
+            "timings": image_timings,
+        }
+        
+        if annotated:
+            # A anotada é desenhada na resolução original
+            with timed(image_timings, "decode"):
+                full_image, _ = decode_image(data)
+            with timed(image_timings, "annotate"):
+                annotated_image = annotate_image(
+                    full_image,
+                    detections,
+                    show_labels=_flag(params, "labels", True),
+                    show_conf=_flag(params, "show_conf", True)
+                )
+            with timed(image_timings, "encode"):
+                png = image_to_bytes(annotated_image, format="PNG")
+            payload["annotated_image"] = base64.b64encode(png).decode("ascii")
+        
+        results.append(payload)
+    
+    return results
+
+
+def main():
+    """Função principal."""
+    args = parse_args()
+    
+    model_path = Path(args.model)
+    if not model_path.exists():
+        print(f"❌ Erro: Modelo não encontrado: {model_path}")
+        sys.exit(1)
+    if args.max_batch_size < 1:
+        print(f"❌ Erro: --max-batch-size tem de ser >= 1 (recebido: {args.max_batch_size})")
+        sys.exit(1)
+    
+    print(f"🤖 A carregar modelo: {model_path} (motor: {args.engine})")
+    try:
+        model = load_model(str(model_path), engine=args.engine)
+    except Exception as e:
+        print(f"❌ Erro ao carregar modelo: {e}")
+        sys.exit(1)
+    
+    batcher = MicroBatcher(
+        partial(
+            run_inference_batch,
+            model,
+            batch_size=args.max_batch_size,
+            conf_threshold=RAW_CONF_THRESHOLD,
+            iou_threshold=RAW_IOU_THRESHOLD,
+            max_det=RAW_MAX_DET
+        ),
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms
+    )
+    
+    try:
+        server = InferenceServer((args.host, args.port), batcher, args)
+    except OSError as e:
+        print(f"❌ Erro ao abrir {args.host}:{args.port}: {e}")
+        batcher.close()
+        sys.exit(1)
+    
+    print(f"🚀 A servir em http://{args.host}:{args.port} (POST /predict, GET /health)")
+    print(f"   Batch: até {args.max_batch_size} imagens, espera máx. {args.max_wait_ms:g} ms")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n⏹️  A terminar...")
+    finally:
+        server.server_close()
+        batcher.close()
+
+
+if __name__ == "__main__":
+    main()
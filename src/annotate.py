@@ -0,0 +1,140 @@
+"""
+Módulo de anotação de imagens.
+Desenha as deteções guardadas sobre a imagem, só quando a imagem anotada é
+pedida (visualização, download ou --save-annotated).
+"""
+
+from typing import Optional, Tuple
+import numpy as np
+
+from src.detections import Detections
+
+
+# Cores por classe (RGB)
+CLASS_COLORS = {
+    "RBC": (220, 20, 60),
+    "WBC": (30, 144, 255),
+    "Platelets": (255, 165, 0),
+}
+DEFAULT_COLOR = (128, 128, 128)
+
+
+def annotate_image(
+    image: np.ndarray,
+    detections: Detections,
+    show_labels: bool = True,
+    show_conf: bool = True,
+    line_width: int = 2,
+    max_size: Optional[int] = None,
+    image_size: Optional[Tuple[int, int]] = None
+) -> np.ndarray:
+    """
+    Desenha as deteções sobre uma cópia da imagem.
+    
+    Alternativa leve a `results.plot` do Ultralytics: trabalha diretamente
+    sobre os arrays das deteções e em RGB, sem conversões de cor. Com
+    `max_size`, a imagem é reduzida antes de desenhar, pelo que uma
+    pré-visualização custa apenas o tamanho da pré-visualização.
+    
+    Args:
+        image: Imagem original em formato numpy array (RGB)
+        detections: Deteções da imagem (formato colunar)
+        show_labels: Se True, mostra labels nas deteções
+        show_conf: Se True, mostra confiança nas deteções
+        line_width: Espessura das linhas em pixels
+        max_size: Se definido, lado maior máximo da imagem devolvida
+        image_size: Tamanho (largura, altura) a que as coordenadas das
+            deteções se referem, se `image` for uma versão reduzida da
+            imagem original (por defeito, o tamanho de `image`)
+    
+    Returns:
+        Imagem anotada (RGB)
+    """
+    import cv2
+    
+    canvas, scale = _prepare_canvas(image, max_size)
+    if image_size is not None:
+        scale *= image.shape[1] / image_size[0]
+    
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    font_scale = 0.4
+    thickness = max(1, line_width // 2)
+    
+    # Coordenadas e cores calculadas em bloco para todas as caixas
+    boxes = np.rint(detections.xyxy * scale).astype(np.int32).tolist()
+    colors = [CLASS_COLORS.get(name, DEFAULT_COLOR) for name in detections.names]
+    
+    for (x1, y1, x2, y2), class_id, confidence in zip(
+        boxes, detections.cls.tolist(), detections.conf.tolist()
+    ):
+        color = colors[class_id]
+        
+        cv2.rectangle(canvas, (x1, y1), (x2, y2), color, line_width, cv2.LINE_AA)
+        
+        label = _make_label(
+            detections.names[class_id], confidence, show_labels, show_conf
+        )
+        if not label:
+            continue
+        
+        # Fundo do texto acima da caixa (ou dentro, se não houver espaço)
+        (text_w, text_h), baseline = cv2.getTextSize(label, font, font_scale, thickness)
+        top = y1 - text_h - baseline - 2
+        if top < 0:
+            top = y1
+        cv2.rectangle(
+            canvas,
+            (x1, top),
+            (x1 + text_w + 2, top + text_h + baseline + 2),
+            color,
+            -1
+        )
+        cv2.putText(
+            canvas,
+            label,
+            (x1 + 1, top + text_h + 1),
+            font,
+            font_scale,
+            (255, 255, 255),
+            thickness,
+            cv2.LINE_AA
+        )
+    
+    return canvas
+
+
+def _prepare_canvas(
+    image: np.ndarray,
+    max_size: Optional[int]
+) -> Tuple[np.ndarray, float]:
+    """
+    Cria a imagem onde se vai desenhar (cópia ou versão reduzida).
+    
+    Returns:
+        Tuplo (canvas, fator de escala aplicado às coordenadas)
+    """
+    height, width = image.shape[:2]
+    
+    if max_size is not None and max(height, width) > max_size:
+        import cv2
+        
+        scale = max_size / max(height, width)
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        return cv2.resize(image, size, interpolation=cv2.INTER_AREA), scale
+    
+    return image.copy(), 1.0
+
+
+def _make_label(
+    class_name: str,
+    confidence: float,
+    show_labels: bool,
+    show_conf: bool
+) -> str:
+    """Constrói o texto da label de uma deteção."""
+    parts = []
+    if show_labels:
+        parts.append(class_name)
+    if show_conf:
+        parts.append(f"{confidence:.2f}")
+    return " ".join(parts)
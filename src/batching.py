@@ -0,0 +1,134 @@
+"""
+Micro-batching dinâmico de pedidos de inferência.
+Pedidos que chegam de vários threads dentro de uma janela curta são
+agrupados num único forward pass do modelo.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+
+
+class BatcherClosedError(RuntimeError):
+    """O `MicroBatcher` foi fechado e já não aceita pedidos."""
+
+
+class MicroBatcher:
+    """
+    Agrupa pedidos de inferência concorrentes em batches.
+    
+    Um único thread consome a fila: quando chega um pedido, espera no
+    máximo `max_wait_ms` por mais pedidos (ou até ter `max_batch_size`) e
+    envia-os todos a `predict_fn` numa só chamada. Com um pedido de cada
+    vez, a latência extra é no máximo `max_wait_ms`; com muitos pedidos em
+    simultâneo, os batches enchem sem esperar.
+    """
+    
+    def __init__(
+        self,
+        predict_fn: Callable[[List[np.ndarray]], List[Dict[str, Any]]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10.0
+    ):
+        """
+        Args:
+            predict_fn: Função que recebe uma lista de imagens e devolve um
+                resultado por imagem (ex: `run_inference_batch` com o
+                modelo já carregado)
+            max_batch_size: Número máximo de imagens por chamada
+            max_wait_ms: Tempo máximo de espera por mais pedidos, em ms
+        """
+        if max_batch_size < 1:
+            raise ValueError(f"max_batch_size tem de ser >= 1 (recebido: {max_batch_size})")
+        
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue[Optional[Tuple[np.ndarray, Future, float]]]" = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+    
+    def submit(self, image: np.ndarray) -> Future:
+        """
+        Adiciona uma imagem à fila.
+        
+        Args:
+            image: Imagem em formato numpy array
+        
+        Returns:
+            Future com o resultado da imagem (`result["timings"]` inclui
+            "queue", o tempo em ms à espera do batch)
+        
+        Raises:
+            BatcherClosedError: Se o batcher já tiver sido fechado
+        """
+        future: Future = Future()
+        with self._lock:
+            if self._closed:
+                raise BatcherClosedError("O batcher foi fechado")
+            self._queue.put((image, future, time.perf_counter()))
+        return future
+    
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Processa os pedidos em fila e termina o thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join(timeout)
+    
+    def _next_batch(self) -> Tuple[List[Tuple[np.ndarray, Future, float]], bool]:
+        """
+        Espera pelo próximo batch.
+        
+        Returns:
+            Tuplo (pedidos do batch, True se o batcher foi fechado)
+        """
+        item = self._queue.get()
+        if item is None:
+            return [], True
+        
+        batch = [item]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+    
+    def _run(self) -> None:
+        """Ciclo do thread: agrupa os pedidos e corre o modelo."""
+        closed = False
+        while not closed:
+            batch, closed = self._next_batch()
+            if not batch:
+                continue
+            
+            start = time.perf_counter()
+            # Pedidos cancelados entretanto não vão ao modelo
+            batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            
+            try:
+                results = self.predict_fn([image for image, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            
+            for (_, future, submitted), result in zip(batch, results):
+                result.setdefault("timings", {})["queue"] = (start - submitted) * 1000
+                result["batch_size"] = len(batch)
+                future.set_result(result)
@@ -0,0 +1,233 @@
+"""
+Cache persistente de resultados de inferência.
+Guarda as deteções em disco (SQLite), indexadas pelo conteúdo da imagem,
+pelo modelo e pelos limiares usados, para não repetir a inferência quando
+a mesma imagem volta a ser processada.
+"""
+
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional, Union
+import numpy as np
+
+from src.detections import Detections
+
+
+# Tamanho máximo por defeito da cache (MB)
+DEFAULT_CACHE_SIZE_MB = 512
+
+
+def hash_bytes(data: bytes) -> str:
+    """
+    Calcula o hash (SHA-256) do conteúdo de um ficheiro.
+    
+    Args:
+        data: Conteúdo em bytes
+    
+    Returns:
+        Hash em hexadecimal
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_digest(path: Union[str, Path]) -> str:
+    """
+    Calcula o hash (SHA-256) de um ficheiro em disco, ex: o modelo.
+    
+    O resultado é memorizado enquanto o tamanho e a data de modificação do
+    ficheiro não mudarem.
+    
+    Args:
+        path: Caminho do ficheiro
+    
+    Returns:
+        Hash em hexadecimal
+    """
+    stat = os.stat(path)
+    return _file_digest(str(Path(path).resolve()), stat.st_size, stat.st_mtime_ns)
+
+
+@lru_cache(maxsize=32)
+def _file_digest(path: str, size: int, mtime_ns: int) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class InferenceCache:
+    """
+    Cache de deteções em disco, com limite de tamanho e remoção LRU.
+    
+    Os dados ficam numa base de dados SQLite em modo WAL, pelo que vários
+    processos (workers do CLI, sessões da app) podem ler e escrever em
+    simultâneo. Cada thread usa a sua própria ligação.
+    """
+    
+    def __init__(
+        self,
+        cache_dir: Union[str, Path],
+        max_size_mb: float = DEFAULT_CACHE_SIZE_MB
+    ):
+        """
+        Args:
+            cache_dir: Pasta onde guardar a cache
+            max_size_mb: Tamanho máximo da cache em MB
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.cache_dir / "inference_cache.sqlite"
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self._local = threading.local()
+        
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    payload BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_last_access ON entries (last_access)"
+            )
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Devolve a ligação SQLite da thread atual."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+    
+    @staticmethod
+    def make_key(
+        image_digest: str,
+        model_digest: str,
+        conf_threshold: float,
+        iou_threshold: float,
+        variant: str = ""
+    ) -> str:
+        """
+        Constrói a chave da cache.
+        
+        Args:
+            image_digest: Hash do conteúdo da imagem
+            model_digest: Hash do ficheiro do modelo
+            conf_threshold: Limiar de confiança
+            iou_threshold: Limiar de IOU
+            variant: Outras opções que mudam as deteções (ex: modo tiled)
+        
+        Returns:
+            Chave (hash SHA-256 em hexadecimal)
+        """
+        raw = (
+            f"{image_digest}:{model_digest}:{conf_threshold:.6f}:"
+            f"{iou_threshold:.6f}:{variant}"
+        )
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+    
+    def get(self, key: str) -> Optional[Detections]:
+        """
+        Procura as deteções guardadas para uma chave.
+        
+        Args:
+            key: Chave (ver `make_key`)
+        
+        Returns:
+            Deteções guardadas, ou None se não existirem
+        """
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT payload FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        
+        with conn:
+            conn.execute(
+                "UPDATE entries SET last_access = ? WHERE key = ?",
+                (time.time(), key)
+            )
+        
+        return decode_detections(row[0])
+    
+    def put(self, key: str, detections: Detections) -> None:
+        """
+        Guarda as deteções de uma imagem e remove entradas antigas se a
+        cache exceder o tamanho máximo.
+        
+        Args:
+            key: Chave (ver `make_key`)
+            detections: Deteções a guardar
+        """
+        payload = encode_detections(detections)
+        conn = self._connect()
+        
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, payload, size, last_access) "
+                "VALUES (?, ?, ?, ?)",
+                (key, payload, len(payload), time.time())
+            )
+        
+        self._evict()
+    
+    def _evict(self) -> None:
+        """Remove as entradas menos usadas até a cache caber no limite."""
+        conn = self._connect()
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_size:
+            return
+        
+        with conn:
+            # Margem de 10% para não repetir a remoção a cada escrita
+            excess = total - int(self.max_size * 0.9)
+            rows = conn.execute(
+                "SELECT key, size FROM entries ORDER BY last_access ASC"
+            )
+            to_delete = []
+            for key, size in rows:
+                if excess <= 0:
+                    break
+                to_delete.append((key,))
+                excess -= size
+            conn.executemany("DELETE FROM entries WHERE key = ?", to_delete)
+    
+    def clear(self) -> None:
+        """Remove todas as entradas da cache."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entries")
+
+
+def encode_detections(detections: Detections) -> bytes:
+    """Serializa deteções para npz (sem pickle)."""
+    buf = io.BytesIO()
+    np.savez(
+        buf,
+        xyxy=detections.xyxy,
+        conf=detections.conf,
+        cls=detections.cls,
+        names=np.array(detections.names, dtype=str)
+    )
+    return buf.getvalue()
+
+
+def decode_detections(payload: bytes) -> Detections:
+    """Reconstrói deteções serializadas com `encode_detections`."""
+    with np.load(io.BytesIO(payload), allow_pickle=False) as data:
+        return Detections(
+            data["xyxy"], data["conf"], data["cls"], data["names"].tolist()
+        )
@@ -0,0 +1,270 @@
+"""
+Estrutura colunar para deteções.
+Guarda as caixas, confianças e classes em arrays NumPy, em vez de um
+dicionário Python por deteção.
+"""
+
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+import numpy as np
+
+
+# Classes standard, pela ordem usada nas contagens
+CLASS_NAMES = ("RBC", "WBC", "Platelets")
+
+
+class Detections:
+    """
+    Deteções de uma imagem em formato colunar.
+    
+    Attributes:
+        xyxy: Caixas (N, 4) em pixels, float32
+        conf: Confianças (N,), float32
+        cls: Índices de classe (N,) em `names`, int64
+        names: Nomes das classes; as primeiras são sempre CLASS_NAMES e as
+            restantes são classes do modelo sem mapeamento standard
+    
+    Para compatibilidade, iterar ou indexar com um inteiro devolve
+    dicionários {"class", "confidence", "bbox"}, como a antiga lista de
+    deteções. Usa `to_list()` para obter essa lista completa.
+    """
+    
+    __slots__ = ("xyxy", "conf", "cls", "names")
+    
+    def __init__(
+        self,
+        xyxy: np.ndarray,
+        conf: np.ndarray,
+        cls: np.ndarray,
+        names: Sequence[str] = CLASS_NAMES
+    ):
+        self.xyxy = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+        self.conf = np.asarray(conf, dtype=np.float32).reshape(-1)
+        self.cls = np.asarray(cls, dtype=np.int64).reshape(-1)
+        self.names = tuple(names)
+    
+    @classmethod
+    def empty(cls, names: Sequence[str] = CLASS_NAMES) -> "Detections":
+        """Cria um conjunto de deteções vazio."""
+        return cls(
+            np.zeros((0, 4), dtype=np.float32),
+            np.zeros(0, dtype=np.float32),
+            np.zeros(0, dtype=np.int64),
+            names
+        )
+    
+    def __len__(self) -> int:
+        return len(self.conf)
+    
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(self.to_list())
+    
+    def __getitem__(
+        self,
+        index: Union[int, slice, np.ndarray]
+    ) -> Union[Dict[str, Any], "Detections"]:
+        """
+        Indexa as deteções.
+        
+        Um inteiro devolve uma deteção como dicionário; um slice, máscara
+        booleana ou array de índices devolve um novo objeto Detections.
+        """
+        if isinstance(index, (int, np.integer)):
+            return {
+                "class": self.names[self.cls[index]],
+                "confidence": float(self.conf[index]),
+                "bbox": self.xyxy[index].tolist()
+            }
+        return Detections(self.xyxy[index], self.conf[index], self.cls[index], self.names)
+    
+    def __repr__(self) -> str:
+        return f"Detections(n={len(self)}, counts={self.counts()})"
+    
+    def rescale(self, from_size: Tuple[int, int], to_size: Tuple[int, int]) -> "Detections":
+        """
+        Converte as caixas entre dois tamanhos da mesma imagem, ex: de uma
+        versão reduzida para a original.
+        
+        Args:
+            from_size: Tamanho (largura, altura) a que as caixas se referem
+            to_size: Tamanho (largura, altura) de destino
+        
+        Returns:
+            Novas deteções (as mesmas, se os tamanhos forem iguais)
+        """
+        if tuple(from_size) == tuple(to_size):
+            return self
+        scale_x = to_size[0] / from_size[0]
+        scale_y = to_size[1] / from_size[1]
+        scale = np.array([scale_x, scale_y, scale_x, scale_y], dtype=np.float32)
+        return Detections(self.xyxy * scale, self.conf, self.cls, self.names)
+    
+    def class_names(self) -> List[str]:
+        """Devolve o nome da classe de cada deteção."""
+        return [self.names[i] for i in self.cls.tolist()]
+    
+    def counts(self) -> Dict[str, int]:
+        """
+        Conta as deteções por classe standard (RBC, WBC, Platelets).
+        
+        Returns:
+            Dicionário {classe: contagem}
+        """
+        bins = np.bincount(self.cls, minlength=len(self.names))
+        return {name: int(bins[i]) for i, name in enumerate(CLASS_NAMES)}
+    
+    def to_list(self) -> List[Dict[str, Any]]:
+        """
+        Converte para a lista de dicionários usada antes do formato colunar.
+        
+        Returns:
+            Lista de {"class", "confidence", "bbox"}
+        """
+        return [
+            {"class": name, "confidence": confidence, "bbox": bbox}
+            for name, confidence, bbox in zip(
+                self.class_names(), self.conf.tolist(), self.xyxy.tolist()
+            )
+        ]
+
+
+def build_class_lut(
+    model_names: Dict[int, str],
+    map_name: Optional[Callable[[str], str]] = None
+) -> Tuple[Tuple[str, ...], np.ndarray]:
+    """
+    Pré-calcula a tabela de conversão das classes do modelo.
+    
+    Args:
+        model_names: Dicionário {id: nome} do modelo
+        map_name: Função que mapeia um nome do modelo para o nome standard
+    
+    Returns:
+        Tuplo (names, lut) em que `lut[id_do_modelo]` é o índice da classe
+        em `names`. Classes sem nome standard são acrescentadas no fim.
+    """
+    names = list(CLASS_NAMES)
+    num_ids = max(model_names) + 1 if model_names else 0
+    lut = np.zeros(num_ids, dtype=np.int64)
+    
+    for class_id, class_name in model_names.items():
+        mapped = map_name(class_name) if map_name else class_name
+        if mapped not in names:
+            names.append(mapped)
+        lut[class_id] = names.index(mapped)
+    
+    return tuple(names), lut
+
+
+# Número máximo de pares de caixas avaliados de cada vez em `nms`
+NMS_CHUNK_PAIRS = 1 << 20
+
+
+def nms(
+    xyxy: np.ndarray,
+    scores: np.ndarray,
+    iou_threshold: float,
+    classes: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Non-Maximum Suppression vetorizado em NumPy.
+    
+    Os pares candidatos são encontrados por sort-and-sweep: com as caixas
+    ordenadas por x1, cada caixa só é comparada com as seguintes que
+    começam antes de ela acabar. A memória usada cresce com o número de
+    caixas e de pares vizinhos (avaliados em blocos de `NMS_CHUNK_PAIRS`),
+    não com o quadrado do número de caixas, pelo que imagens inteiras com
+    centenas de milhares de células cabem em memória. O passo greedy só
+    percorre as caixas que se sobrepõem a alguma outra. Com `classes`, a
+    supressão é feita por classe (como no Ultralytics), deslocando as
+    caixas de cada classe para regiões disjuntas.
+    
+    Args:
+        xyxy: Caixas (N, 4)
+        scores: Confianças (N,)
+        iou_threshold: Caixas com IOU acima deste valor são suprimidas
+        classes: Classe de cada caixa (N,), opcional
+    
+    Returns:
+        Índices das caixas mantidas, por ordem decrescente de confiança
+    """
+    if len(scores) == 0:
+        return np.zeros(0, dtype=np.int64)
+    
+    order = np.argsort(-scores, kind="stable")
+    boxes = xyxy[order].astype(np.float32)
+    if classes is not None:
+        boxes += (classes[order].astype(np.float32) * (boxes.max() + 1))[:, None]
+    
+    x1, y1, x2, y2 = boxes.T
+    areas = (x2 - x1).clip(min=0) * (y2 - y1).clip(min=0)
+    n = len(boxes)
+    
+    # Candidatas de cada caixa (na ordem por x1): as seguintes até à
+    # primeira que começa depois de ela acabar
+    by_x = np.argsort(x1, kind="stable")
+    ends = np.searchsorted(x1[by_x], x2[by_x], side="left")
+    num_candidates = np.maximum(ends - np.arange(n) - 1, 0)
+    cumulative = np.cumsum(num_candidates)
+    
+    # Pares (mais confiante, menos confiante), por posição em `order`
+    winners, losers = [], []
+    start = 0
+    while start < n:
+        done = cumulative[start - 1] if start else 0
+        end = max(int(np.searchsorted(cumulative, done + NMS_CHUNK_PAIRS, side="right")), start + 1)
+        counts = num_candidates[start:end]
+        rows = np.repeat(np.arange(start, end), counts)
+        offsets = np.arange(len(rows)) - np.repeat(cumulative[start:end] - counts - done, counts)
+        a = by_x[rows]
+        b = by_x[rows + 1 + offsets]
+        start = end
+        
+        inter_w = (np.minimum(x2[a], x2[b]) - np.maximum(x1[a], x1[b])).clip(min=0)
+        inter_h = (np.minimum(y2[a], y2[b]) - np.maximum(y1[a], y1[b])).clip(min=0)
+        inter = inter_w * inter_h
+        iou = inter / np.maximum(areas[a] + areas[b] - inter, 1e-9)
+        overlapping = iou > iou_threshold
+        a, b = a[overlapping], b[overlapping]
+        winners.append(np.minimum(a, b))
+        losers.append(np.maximum(a, b))
+    
+    winners = np.concatenate(winners)
+    losers = np.concatenate(losers)
+    pair_order = np.argsort(winners, kind="stable")
+    winners, losers = winners[pair_order], losers[pair_order]
+    heads, first = np.unique(winners, return_index=True)
+    
+    # Greedy, por ordem de confiança: só caixas com sobreposições podem
+    # suprimir outras
+    suppressed = np.zeros(n, dtype=bool)
+    for i, suppresses in zip(heads.tolist(), np.split(losers, first[1:])):
+        if not suppressed[i]:
+            suppressed[suppresses] = True
+    
+    return order[~suppressed]
+
+
+def apply_thresholds(
+    detections: Detections,
+    conf_threshold: float,
+    iou_threshold: float
+) -> Detections:
+    """
+    Reaplica os limiares de confiança e de IOU a deteções já calculadas.
+    
+    Permite mudar os limiares sem voltar a correr o modelo, desde que as
+    deteções tenham sido obtidas com limiares mais permissivos (confiança
+    mais baixa e IOU mais alto). Como no Ultralytics, só ficam as deteções
+    com confiança estritamente acima do limiar.
+    
+    Args:
+        detections: Deteções candidatas
+        conf_threshold: Limiar de confiança
+        iou_threshold: Limiar de IOU para NMS
+    
+    Returns:
+        Deteções filtradas, por ordem decrescente de confiança
+    """
+    candidates = detections[detections.conf > conf_threshold]
+    keep = nms(candidates.xyxy, candidates.conf, iou_threshold, candidates.cls)
+    return candidates[keep]
@@ -3,43 +3,91 @@ Módulo de inferência com YOLO.
 Funções para carregar modelo, executar deteção e calcular métricas.
 """
 
-from ultralytics import YOLO
+from functools import lru_cache
 import numpy as np
-import cv2
-from typing import Dict, List, Any, Tuple
-from PIL import Image
+from typing import TYPE_CHECKING, Dict, Iterable, List, Any, Optional, Tuple, Union
 
+from src.detections import Detections, build_class_lut, nms
+from src.io_utils import ImageSource
+from src.onnx_engine import OnnxEngine, export_onnx, find_int8_onnx
+from src.profiling import add_timings, timed
 
-def load_model(model_path: str) -> YOLO:
+if TYPE_CHECKING:
+    from ultralytics import YOLO
+
+
+# Limiares permissivos para guardar candidatos e refiltrar sem novo forward
+# pass (ver `src.detections.apply_thresholds`)
+RAW_CONF_THRESHOLD = 0.05
+RAW_IOU_THRESHOLD = 0.9
+RAW_MAX_DET = 3000
+
+# Inferência por tiles: lado maior (em pixels) do maior objeto esperado e
+# margem a partir da qual uma caixa conta como cortada pela borda do tile
+TILE_MAX_OBJECT_SIZE = 100
+TILE_EDGE_MARGIN = 2.0
+
+# Motores de inferência suportados por `load_model`
+ENGINES = ("torch", "onnx", "onnx-int8")
+
+# Modelo carregado: YOLO (PyTorch) ou OnnxEngine
+Model = Union["YOLO", OnnxEngine]
+
+
+def load_model(
+    model_path: str,
+    engine: str = "torch",
+    num_threads: Optional[int] = None
+) -> Model:
     """
     Carrega o modelo YOLO a partir do caminho especificado.
     
     Args:
         model_path: Caminho para o ficheiro .pt do modelo
-        
+        engine: "torch" (Ultralytics/PyTorch), "onnx" (ONNX Runtime, CPU;
+            o modelo é exportado para .onnx ao lado dos pesos na primeira
+            utilização) ou "onnx-int8" (modelo quantizado criado com
+            `python -m src.quantize`)
+        num_threads: Threads do ONNX Runtime (só com os motores ONNX)
+    
     Returns:
-        Modelo YOLO carregado
-        
+        Modelo carregado (o resto do módulo aceita qualquer dos motores)
+    
     Raises:
-        FileNotFoundError: Se o ficheiro do modelo não existir
+        FileNotFoundError: Se o ficheiro do modelo (ou o modelo INT8) não
+            existir
+        ValueError: Se o motor não for suportado ou o modelo INT8 não tiver
+            passado a verificação de precisão
         Exception: Se houver erro ao carregar o modelo
     """
+    if engine not in ENGINES:
+        raise ValueError(f"Motor inválido: {engine} (opções: {ENGINES})")
+    
+    if engine == "onnx-int8":
+        return OnnxEngine(find_int8_onnx(model_path), num_threads=num_threads)
+    
     try:
+        if engine == "onnx":
+            return OnnxEngine(export_onnx(model_path), num_threads=num_threads)
+        # Importado só aqui: o Ultralytics (e o PyTorch) demoram segundos a
+        # importar e não são precisos com os motores ONNX
+        from ultralytics import YOLO
         model = YOLO(model_path)
         return model
     except FileNotFoundError:
         raise FileNotFoundError(f"Modelo não encontrado em: {model_path}")
+    except ImportError:
+        raise
     except Exception as e:
         raise Exception(f"Erro ao carregar modelo: {str(e)}")
 
 
 def run_inference(
-    model: YOLO,
+    model: Model,
     image: np.ndarray,
     conf_threshold: float = 0.25,
     iou_threshold: float = 0.45,
-    show_labels: bool = True,
-    show_conf: bool = True
+    max_det: int = 300
 ) -> Dict[str, Any]:
     """
     Executa inferência numa imagem e retorna resultados.
@@ -49,63 +97,332 @@ def run_inference(
         image: Imagem em formato numpy array (RGB)
         conf_threshold: Limiar de confiança
         iou_threshold: Limiar de IOU para NMS
-        show_labels: Se True, mostra labels nas deteções
-        show_conf: Se True, mostra confiança nas deteções
-        
+        max_det: Número máximo de deteções por imagem
+    
     Returns:
         Dicionário com:
             - original_image: imagem original
-            - annotated_image: imagem com bounding boxes
             - counts: contagens por classe
             - percentages: percentagens por classe
-            - detections: lista de deteções raw
+            - detections: deteções em formato colunar (`Detections`);
+              iterar devolve os dicionários {class, confidence, bbox}
+            - timings: tempos desta imagem em ms por fase (preprocess,
+              inference, postprocess, extract; ver `src.profiling`)
+        
+        A imagem anotada não é gerada aqui; usa
+        `src.annotate.annotate_image` apenas quando for necessária.
+    """
+    return run_inference_batch(
+        model,
+        [image],
+        batch_size=1,
+        conf_threshold=conf_threshold,
+        iou_threshold=iou_threshold,
+        max_det=max_det
+    )[0]
+
+
+def run_inference_batch(
+    model: Model,
+    images: List[np.ndarray],
+    batch_size: int = 8,
+    conf_threshold: float = 0.25,
+    iou_threshold: float = 0.45,
+    max_det: int = 300
+) -> List[Dict[str, Any]]:
+    """
+    Executa inferência em várias imagens, agrupadas em batches.
+    
+    Cada batch é enviado ao modelo num único forward pass, o que aproveita
+    melhor o CPU/GPU do que uma imagem de cada vez.
+    
+    Args:
+        model: Modelo YOLO carregado
+        images: Lista de imagens em formato numpy array (RGB)
+        batch_size: Número máximo de imagens por forward pass
+        conf_threshold: Limiar de confiança
+        iou_threshold: Limiar de IOU para NMS
+        max_det: Número máximo de deteções por imagem
+    
+    Returns:
+        Lista de resultados (um por imagem, pela mesma ordem), cada um
+        no mesmo formato devolvido por `run_inference`
+    
+    Raises:
+        ValueError: Se batch_size for inferior a 1
+    """
+    if batch_size < 1:
+        raise ValueError(f"batch_size tem de ser >= 1 (recebido: {batch_size})")
+    
+    outputs = []
+    
+    for start in range(0, len(images), batch_size):
+        batch = list(images[start:start + batch_size])
+        
+        # Executar predição (um forward pass para todo o batch)
+        timings: Dict[str, float] = {}
+        batch_detections = _predict_arrays(
+            model, batch, conf_threshold, iou_threshold, max_det, timings
+        )
+        
+        for image, detections in zip(batch, batch_detections):
+            result = build_result(image, detections)
+            result["timings"] = dict(timings)
+            outputs.append(result)
+    
+    return outputs
+
+
+def run_inference_tiled(
+    model: Model,
+    image: Union[np.ndarray, ImageSource],
+    tile_size: int = 640,
+    overlap: float = 0.2,
+    batch_size: int = 8,
+    conf_threshold: float = 0.25,
+    iou_threshold: float = 0.45,
+    max_det: int = RAW_MAX_DET,
+    max_object_size: int = TILE_MAX_OBJECT_SIZE
+) -> Dict[str, Any]:
+    """
+    Executa inferência por tiles, para imagens grandes.
+    
+    A imagem é dividida em tiles de `tile_size` pixels com sobreposição,
+    que são enviados ao modelo em batches sem redimensionar a imagem
+    inteira (as plaquetas mantêm o tamanho em pixels). As caixas são
+    convertidas para coordenadas globais; caixas cortadas por uma
+    fronteira interior de um tile são descartadas (a célula aparece inteira
+    no tile vizinho, porque a sobreposição tem de ser maior do que o maior
+    objeto esperado) e os duplicados na zona de sobreposição são removidos
+    com NMS, que só compara caixas vizinhas (memória linear no número de
+    caixas).
+    
+    Com uma `ImageSource` (ver `src.io_utils.open_image_source`), cada tile
+    é lido do ficheiro só quando é enviado ao modelo, pelo que imagens
+    maiores do que a memória disponível podem ser processadas.
+    
+    Args:
+        model: Modelo YOLO carregado
+        image: Imagem em formato numpy array (RGB) ou fonte de imagem
+        tile_size: Lado de cada tile em pixels
+        overlap: Fração de sobreposição entre tiles vizinhos (0 a <1)
+        batch_size: Número de tiles por forward pass
+        conf_threshold: Limiar de confiança
+        iou_threshold: Limiar de IOU para NMS (em cada tile e entre tiles)
+        max_det: Número máximo de deteções por tile
+        max_object_size: Lado maior, em pixels, do maior objeto esperado;
+            objetos maiores do que a sobreposição seriam cortados em todos
+            os tiles e não seriam contados
+    
+    Returns:
+        Dicionário no mesmo formato devolvido por `run_inference`
+    
+    Raises:
+        ValueError: Se tile_size, overlap ou batch_size forem inválidos, ou
+            se a sobreposição for menor do que `max_object_size`
     """
-    # Executar predição
-    results = model.predict(
-        image,
+    if tile_size < 32:
+        raise ValueError(f"tile_size tem de ser >= 32 (recebido: {tile_size})")
+    if not 0 <= overlap < 1:
+        raise ValueError(f"overlap tem de estar em [0, 1) (recebido: {overlap})")
+    if batch_size < 1:
+        raise ValueError(f"batch_size tem de ser >= 1 (recebido: {batch_size})")
+    min_overlap = min_tile_overlap(max_object_size)
+    if tile_size - tile_stride(tile_size, overlap) < min_overlap:
+        raise ValueError(
+            f"A sobreposição entre tiles tem de ter pelo menos {min_overlap:.0f} px "
+            f"(objetos até {max_object_size} px); recebido: {overlap} de {tile_size} px"
+        )
+    
+    height, width = image.shape[:2]
+    tiles = make_tile_grid(width, height, tile_size, overlap)
+    
+    parts = []
+    timings: Dict[str, float] = {}
+    for start in range(0, len(tiles), batch_size):
+        batch_tiles = tiles[start:start + batch_size]
+        
+        # Com arrays, os crops são views (sem cópia); com fontes de imagem,
+        # só os pixels destes tiles são lidos
+        if isinstance(image, ImageSource):
+            with timed(timings, "decode"):
+                crops = [image.read_region(*tile) for tile in batch_tiles]
+        else:
+            crops = [image[y0:y1, x0:x1] for x0, y0, x1, y1 in batch_tiles]
+        
+        batch_timings: Dict[str, float] = {}
+        predictions = _predict_arrays(
+            model, crops, conf_threshold, iou_threshold, max_det, batch_timings
+        )
+        add_timings(timings, batch_timings, scale=len(crops))
+        
+        for (x0, y0, x1, y1), detections in zip(batch_tiles, predictions):
+            
+            # Descartar caixas cortadas por fronteiras interiores do tile
+            inner_edges = np.array([x0 > 0, y0 > 0, x1 < width, y1 < height])
+            margin = TILE_EDGE_MARGIN
+            touches = np.stack([
+                detections.xyxy[:, 0] <= margin,
+                detections.xyxy[:, 1] <= margin,
+                detections.xyxy[:, 2] >= (x1 - x0) - margin,
+                detections.xyxy[:, 3] >= (y1 - y0) - margin,
+            ], axis=1)
+            detections = detections[~(touches & inner_edges).any(axis=1)]
+            
+            # Converter para coordenadas globais
+            detections.xyxy += np.array([x0, y0, x0, y0], dtype=np.float32)
+            parts.append(detections)
+    
+    with timed(timings, "postprocess"):
+        merged = Detections(
+            np.concatenate([d.xyxy for d in parts]),
+            np.concatenate([d.conf for d in parts]),
+            np.concatenate([d.cls for d in parts]),
+            parts[0].names
+        )
+        
+        # Remover duplicados entre tiles (zonas de sobreposição)
+        keep = nms(merged.xyxy, merged.conf, iou_threshold, merged.cls)
+    
+    result = build_result(image, merged[keep])
+    result["timings"] = timings
+    return result
+
+
+def make_tile_grid(
+    width: int,
+    height: int,
+    tile_size: int,
+    overlap: float
+) -> List[Tuple[int, int, int, int]]:
+    """
+    Calcula a grelha de tiles que cobre a imagem.
+    
+    Os últimos tiles de cada linha/coluna são encostados à margem da imagem,
+    para que todos tenham `tile_size` pixels (exceto em imagens menores).
+    
+    Args:
+        width: Largura da imagem
+        height: Altura da imagem
+        tile_size: Lado de cada tile
+        overlap: Fração de sobreposição entre tiles vizinhos
+    
+    Returns:
+        Lista de tiles (x0, y0, x1, y1)
+    """
+    stride = tile_stride(tile_size, overlap)
+    
+    def starts(length: int) -> List[int]:
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, stride))
+        positions.append(length - tile_size)
+        return positions
+    
+    return [
+        (x0, y0, min(x0 + tile_size, width), min(y0 + tile_size, height))
+        for y0 in starts(height)
+        for x0 in starts(width)
+    ]
+
+
+def tile_stride(tile_size: int, overlap: float) -> int:
+    """Distância em pixels entre o início de tiles vizinhos."""
+    return max(1, int(tile_size * (1 - overlap)))
+
+
+def min_tile_overlap(max_object_size: int) -> float:
+    """
+    Sobreposição mínima, em pixels, para que um objeto com lado até
+    `max_object_size` apareça inteiro (longe das bordas) em algum tile.
+    """
+    return max_object_size + 2 * TILE_EDGE_MARGIN
+
+
+def _predict_arrays(
+    model: Model,
+    images: List[np.ndarray],
+    conf_threshold: float,
+    iou_threshold: float,
+    max_det: int,
+    timings: Optional[Dict[str, float]] = None
+) -> List[Detections]:
+    """
+    Executa um forward pass num batch de imagens, com qualquer dos motores.
+    
+    Args:
+        model: Modelo carregado com `load_model`
+        images: Lista de imagens em formato numpy array (RGB)
+        conf_threshold: Limiar de confiança
+        iou_threshold: Limiar de IOU para NMS
+        max_det: Número máximo de deteções por imagem
+        timings: Se definido, recebe os tempos médios por imagem (ms) de
+            cada fase: preprocess, inference e postprocess (`results.speed`
+            do Ultralytics) e extract
+    
+    Returns:
+        Deteções de cada imagem, pela mesma ordem
+    """
+    if isinstance(model, OnnxEngine):
+        return model.predict_detections(
+            images, conf_threshold, iou_threshold, max_det, map_class_name,
+            speed=timings
+        )
+    
+    # O Ultralytics trata arrays numpy como BGR: as imagens (RGB) seguem
+    # como vistas com os canais invertidos, sem cópia
+    predictions = model.predict(
+        [image[..., ::-1] for image in images],
         conf=conf_threshold,
         iou=iou_threshold,
+        max_det=max_det,
         verbose=False
-    )[0]
+    )
+    
+    extract_timings: Dict[str, float] = {}
+    with timed(extract_timings, "extract"):
+        detections = [_extract_detections(model, results) for results in predictions]
+    
+    if timings is not None and predictions:
+        # O Ultralytics já dá os tempos por imagem (média do batch)
+        add_timings(timings, predictions[0].speed)
+        add_timings(timings, extract_timings, scale=1 / len(images))
+    return detections
+
+
+def _extract_detections(model: "YOLO", results: Any) -> Detections:
+    """
+    Extrai as deteções de um objeto Results do Ultralytics, em bloco (uma
+    única cópia device -> host).
+    """
+    names, lut = _class_lut(tuple(sorted(model.names.items())))
+    
+    if results.boxes is None or len(results.boxes) == 0:
+        return Detections.empty(names)
     
-    # Obter imagem anotada
-    annotated_image = results.plot(
-        labels=show_labels,
-        conf=show_conf,
-        line_width=2,
-        font_size=12
+    data = results.boxes.data.cpu().numpy()
+    return Detections(
+        xyxy=data[:, :4],
+        conf=data[:, -2],
+        cls=lut[data[:, -1].astype(np.int64)],
+        names=names
     )
+
+
+def build_result(image: Any, detections: Detections) -> Dict[str, Any]:
+    """
+    Constrói o dicionário de resultados a partir das deteções de uma imagem.
     
-    # Converter de BGR para RGB (OpenCV usa BGR)
-    annotated_image = cv2.cvtColor(annotated_image, cv2.COLOR_BGR2RGB)
+    Usado também quando as deteções vêm da cache, sem passar pelo modelo.
     
-    # Extrair deteções
-    detections = []
-    counts = {"RBC": 0, "WBC": 0, "Platelets": 0}
+    Args:
+        image: Imagem original (RGB)
+        detections: Deteções da imagem
     
-    if results.boxes is not None and len(results.boxes) > 0:
-        for box in results.boxes:
-            # Extrair informação da deteção
-            class_id = int(box.cls[0])
-            confidence = float(box.conf[0])
-            bbox = box.xyxy[0].cpu().numpy()
-            
-            # Obter nome da classe
-            class_name = model.names[class_id]
-            
-            # Mapear nomes de classes (caso não sejam exatamente RBC/WBC/Platelets)
-            class_name_mapped = map_class_name(class_name)
-            
-            # Atualizar contagens
-            if class_name_mapped in counts:
-                counts[class_name_mapped] += 1
-            
-            # Guardar deteção
-            detections.append({
-                "class": class_name_mapped,
-                "confidence": confidence,
-                "bbox": bbox.tolist()
-            })
+    Returns:
+        Dicionário de resultados (ver `run_inference`)
+    """
+    counts = detections.counts()
     
     # Calcular percentagens
     total = sum(counts.values())
@@ -116,89 +433,133 @@ def run_inference(
     
     return {
         "original_image": image,
-        "annotated_image": annotated_image,
         "counts": counts,
         "percentages": percentages,
         "detections": detections
     }
 
 
+@lru_cache(maxsize=16)
+def _class_lut(model_names: Tuple[Tuple[int, str], ...]) -> Tuple[Tuple[str, ...], np.ndarray]:
+    """Tabela de conversão das classes do modelo (calculada uma vez por modelo)."""
+    return build_class_lut(dict(model_names), map_class_name)
+
+
+# Dicionário de mapeamento de nomes de classes (configurável)
+CLASS_NAME_MAPPING = {
+    # Adicionar mapeamentos se necessário, ex:
+    # "red_blood_cell": "RBC",
+    # "white_blood_cell": "WBC",
+    # "platelet": "Platelets",
+    
+    # Por defeito, nomes standard
+    "RBC": "RBC",
+    "WBC": "WBC",
+    "Platelets": "Platelets",
+    
+    # Variações comuns
+    "rbc": "RBC",
+    "wbc": "WBC",
+    "platelets": "Platelets",
+    "platelet": "Platelets",
+}
+
+
 def map_class_name(class_name: str) -> str:
     """
     Mapeia nomes de classes do modelo para nomes standard.
     
     Útil se o modelo usar nomes diferentes (ex: 'red_blood_cell' -> 'RBC').
-    Adiciona mapeamentos conforme necessário.
+    Adiciona mapeamentos em CLASS_NAME_MAPPING conforme necessário.
     
     Args:
         class_name: Nome da classe do modelo
-        
+    
     Returns:
         Nome da classe mapeado
     """
-    # Dicionário de mapeamento (configurável)
-    mapping = {
-        # Adicionar mapeamentos se necessário, ex:
-        # "red_blood_cell": "RBC",
-        # "white_blood_cell": "WBC",
-        # "platelet": "Platelets",
+    return CLASS_NAME_MAPPING.get(class_name, class_name)
+
+
+class MetricsAggregator:
+    """
+    Acumula as métricas agregadas imagem a imagem.
+    
+    Guarda apenas os totais, pelo que a memória usada é constante,
+    qualquer que seja o número de imagens.
+    """
+    
+    def __init__(self):
+        self.total_counts = {"RBC": 0, "WBC": 0, "Platelets": 0}
+        self.num_images = 0
+    
+    def add(self, result: Dict[str, Any]) -> None:
+        """
+        Acrescenta o resultado de uma imagem.
         
-        # Por defeito, nomes standard
-        "RBC": "RBC",
-        "WBC": "WBC",
-        "Platelets": "Platelets",
+        Args:
+            result: Resultado de inferência (só é usado `counts`)
+        """
+        for cls, count in result["counts"].items():
+            if cls in self.total_counts:
+                self.total_counts[cls] += count
+        self.num_images += 1
+    
+    def merge(self, other: "MetricsAggregator") -> None:
+        """
+        Junta os totais de outro agregador (ex: de um processo worker).
         
-        # Variações comuns
-        "rbc": "RBC",
-        "wbc": "WBC",
-        "platelets": "Platelets",
-        "platelet": "Platelets",
-    }
+        Args:
+            other: Agregador a juntar
+        """
+        for cls, count in other.total_counts.items():
+            self.total_counts[cls] += count
+        self.num_images += other.num_images
     
-    return mapping.get(class_name, class_name)
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Devolve as métricas agregadas (ver `calculate_metrics`).
+        """
+        # Calcular percentagens
+        total = sum(self.total_counts.values())
+        percentages = {
+            cls: (count / total * 100) if total > 0 else 0.0
+            for cls, count in self.total_counts.items()
+        }
+        
+        return {
+            "total_counts": dict(self.total_counts),
+            "percentages": percentages,
+            "num_images": self.num_images
+        }
 
 
-def calculate_metrics(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+def calculate_metrics(results: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
     """
     Calcula métricas agregadas a partir de múltiplos resultados.
     
     Args:
-        results: Lista de resultados de inferência
-        
+        results: Resultados de inferência (lista ou iterável)
+    
     Returns:
         Dicionário com métricas agregadas:
             - total_counts: contagens totais por classe
             - percentages: percentagens agregadas
             - num_images: número de imagens processadas
     """
-    total_counts = {"RBC": 0, "WBC": 0, "Platelets": 0}
-    
+    aggregator = MetricsAggregator()
     for result in results:
-        for cls, count in result["counts"].items():
-            if cls in total_counts:
-                total_counts[cls] += count
-    
-    # Calcular percentagens
-    total = sum(total_counts.values())
-    percentages = {
-        cls: (count / total * 100) if total > 0 else 0.0
-        for cls, count in total_counts.items()
-    }
-    
-    return {
-        "total_counts": total_counts,
-        "percentages": percentages,
-        "num_images": len(results)
-    }
+        aggregator.add(result)
+    return aggregator.metrics()
 
 
-def get_model_info(model: YOLO) -> Dict[str, Any]:
+def get_model_info(model: Model) -> Dict[str, Any]:
     """
     Retorna informação sobre o modelo.
     
     Args:
         model: Modelo YOLO carregado
-        
+    
     Returns:
         Dicionário com informação do modelo
     """
@@ -207,3 +568,89 @@ def get_model_info(model: YOLO) -> Dict[str, Any]:
         "class_names": model.names,
         "num_classes": len(model.names) if model.names else 0
     }
+
+
+def compare_engines(
+    reference: Model,
+    candidate: Model,
+    images: List[np.ndarray],
+    conf_threshold: float = 0.25,
+    iou_threshold: float = 0.45,
+    max_det: int = 300,
+    batch_size: int = 8
+) -> Dict[str, Any]:
+    """
+    Compara as deteções de dois motores (ex: PyTorch e ONNX) nas mesmas
+    imagens.
+    
+    Cada caixa do motor de referência é emparelhada com a caixa da mesma
+    classe do outro motor com maior IOU.
+    
+    Args:
+        reference: Modelo de referência (ex: `load_model(path)`)
+        candidate: Modelo a validar (ex: `load_model(path, engine="onnx")`)
+        images: Lista de imagens em formato numpy array
+        conf_threshold: Limiar de confiança
+        iou_threshold: Limiar de IOU para NMS
+        max_det: Número máximo de deteções por imagem
+        batch_size: Número de imagens por forward pass
+    
+    Returns:
+        Dicionário com:
+            - num_images: número de imagens comparadas
+            - count_mismatches: imagens com contagens por classe diferentes
+            - min_iou: pior IOU entre caixas emparelhadas (1.0 = idênticas)
+            - max_conf_diff: maior diferença de confiança entre caixas
+              emparelhadas
+            - per_image: contagens de cada motor, por imagem
+    """
+    kwargs = dict(
+        batch_size=batch_size,
+        conf_threshold=conf_threshold,
+        iou_threshold=iou_threshold,
+        max_det=max_det
+    )
+    reference_results = run_inference_batch(reference, images, **kwargs)
+    candidate_results = run_inference_batch(candidate, images, **kwargs)
+    
+    count_mismatches = 0
+    min_iou = 1.0
+    max_conf_diff = 0.0
+    per_image = []
+    
+    for ref, cand in zip(reference_results, candidate_results):
+        per_image.append({"reference": ref["counts"], "candidate": cand["counts"]})
+        if ref["counts"] != cand["counts"]:
+            count_mismatches += 1
+        
+        ref_det, cand_det = ref["detections"], cand["detections"]
+        for class_id in np.unique(ref_det.cls):
+            ref_mask = ref_det.cls == class_id
+            cand_mask = cand_det.cls == class_id
+            if not cand_mask.any():
+                min_iou = 0.0
+                continue
+            
+            iou = _pairwise_iou(ref_det.xyxy[ref_mask], cand_det.xyxy[cand_mask])
+            best = iou.argmax(axis=1)
+            min_iou = min(min_iou, float(iou.max(axis=1).min()))
+            conf_diff = np.abs(ref_det.conf[ref_mask] - cand_det.conf[cand_mask][best])
+            max_conf_diff = max(max_conf_diff, float(conf_diff.max()))
+    
+    return {
+        "num_images": len(images),
+        "count_mismatches": count_mismatches,
+        "min_iou": min_iou,
+        "max_conf_diff": max_conf_diff,
+        "per_image": per_image
+    }
+
+
+def _pairwise_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """IOU entre todas as caixas (N, 4) de `a` e (M, 4) de `b`."""
+    inter_w = (np.minimum(a[:, None, 2], b[:, 2]) - np.maximum(a[:, None, 0], b[:, 0])).clip(min=0)
+    inter_h = (np.minimum(a[:, None, 3], b[:, 3]) - np.maximum(a[:, None, 1], b[:, 1])).clip(min=0)
+    inter = inter_w * inter_h
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b - inter, 1e-9)
@@ -0,0 +1,443 @@
+"""
+Descoberta e leitura das imagens de input do processamento batch.
+Percorre pastas com uma única passagem de `os.scandir` (opcionalmente
+recursiva), lê listas de ficheiros ou o conteúdo de arquivos ZIP/TAR, e
+devolve as imagens à medida que são encontradas, para que o processamento
+comece antes do fim da procura. Os membros dos arquivos são lidos
+diretamente, sem extrair o arquivo para disco.
+"""
+
+import io
+import os
+import sys
+import tarfile
+import threading
+import zipfile
+from fnmatch import fnmatch
+from pathlib import Path, PurePosixPath
+from typing import (
+    BinaryIO, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional,
+    Sequence, Tuple, Union
+)
+
+
+# Extensões de imagem aceites (sem distinção de maiúsculas)
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff')
+
+# Extensões de arquivos aceites como input
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+
+
+class InputFile(NamedTuple):
+    """
+    Imagem de input.
+    
+    Attributes:
+        path: Caminho do ficheiro (ou do arquivo que contém a imagem)
+        name: Nome relativo à pasta de input (com subpastas, separador "/")
+            ou nome do membro do arquivo; usado como `filename` nos
+            resultados e no manifesto
+        member: Nome do membro no arquivo ZIP/TAR (None para ficheiros)
+    """
+    path: Path
+    name: str
+    member: Optional[str] = None
+
+
+def is_image_file(name: str) -> bool:
+    """Verifica se um nome de ficheiro tem uma extensão de imagem aceite."""
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def is_archive_file(name: str) -> bool:
+    """Verifica se um nome de ficheiro tem uma extensão de arquivo aceite."""
+    return name.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def matches_patterns(
+    name: str,
+    include: Optional[Sequence[str]] = None,
+    exclude: Optional[Sequence[str]] = None
+) -> bool:
+    """
+    Aplica os padrões de inclusão/exclusão a um nome relativo.
+    
+    Os padrões usam a sintaxe de `fnmatch` (ex: "*.png", "patient_01/*")
+    e são comparados com o nome relativo completo e com o nome do ficheiro.
+    
+    Args:
+        name: Nome relativo (separador "/")
+        include: Se definido, o nome tem de corresponder a um destes padrões
+        exclude: O nome não pode corresponder a nenhum destes padrões
+    
+    Returns:
+        True se o ficheiro deve ser processado
+    """
+    basename = name.rsplit("/", 1)[-1]
+    
+    def matches(patterns: Sequence[str]) -> bool:
+        return any(fnmatch(name, p) or fnmatch(basename, p) for p in patterns)
+    
+    if include and not matches(include):
+        return False
+    return not (exclude and matches(exclude))
+
+
+def scan_image_files(
+    root: Union[str, Path],
+    recursive: bool = False,
+    include: Optional[Sequence[str]] = None,
+    exclude: Optional[Sequence[str]] = None,
+    on_error: Optional[Callable[[OSError], None]] = None
+) -> Iterator[InputFile]:
+    """
+    Procura imagens numa pasta, com uma única passagem de `os.scandir`.
+    
+    Cada pasta é lida uma vez e as entradas são ordenadas por nome, pelo
+    que a ordem é determinística. As imagens são devolvidas à medida que
+    cada pasta é lida. Ficheiros e pastas ocultos (começados por ".") são
+    ignorados, tal como links simbólicos para pastas (evita ciclos).
+    
+    Args:
+        root: Pasta de input
+        recursive: Se True, procura também nas subpastas
+        include: Padrões de inclusão (ver `matches_patterns`)
+        exclude: Padrões de exclusão (ver `matches_patterns`)
+        on_error: Chamada com o erro se uma pasta não puder ser lida (por
+            defeito, a pasta é ignorada)
+    
+    Yields:
+        Imagens encontradas
+    """
+    root = Path(root)
+    stack = [(root, "")]
+    
+    while stack:
+        directory, prefix = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError as e:
+            if on_error is not None:
+                on_error(e)
+            continue
+        
+        subdirs = []
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            name = prefix + entry.name
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        subdirs.append((Path(entry.path), name + "/"))
+                    continue
+                is_file = entry.is_file()
+            except OSError:
+                continue
+            if is_file and is_image_file(entry.name) and matches_patterns(name, include, exclude):
+                yield InputFile(Path(entry.path), name)
+        
+        # Subpastas depois dos ficheiros da pasta, por ordem de nome
+        stack.extend(reversed(subdirs))
+
+
+def read_file_list(
+    source: str,
+    root: Optional[Union[str, Path]] = None,
+    include: Optional[Sequence[str]] = None,
+    exclude: Optional[Sequence[str]] = None
+) -> Iterator[InputFile]:
+    """
+    Lê uma lista de imagens (um caminho por linha) de um ficheiro ou stdin.
+    
+    Linhas vazias e começadas por "#" são ignoradas. Caminhos relativos são
+    relativos a `root` (se definido). O nome de cada imagem é o caminho
+    relativo a `root` ou, se não estiver dentro de `root`, o caminho tal
+    como aparece na lista (ou só o nome do ficheiro, se for absoluto).
+    
+    Args:
+        source: Caminho do ficheiro com a lista, ou "-" para stdin
+        root: Pasta base dos caminhos relativos (opcional)
+        include: Padrões de inclusão (ver `matches_patterns`)
+        exclude: Padrões de exclusão (ver `matches_patterns`)
+    
+    Yields:
+        Imagens da lista, pela ordem da lista
+    """
+    if source == "-":
+        yield from _parse_file_list(sys.stdin, root, include, exclude)
+        return
+    
+    with open(source, "r", encoding="utf-8") as f:
+        yield from _parse_file_list(f, root, include, exclude)
+
+
+def _parse_file_list(
+    lines: Iterable[str],
+    root: Optional[Union[str, Path]],
+    include: Optional[Sequence[str]],
+    exclude: Optional[Sequence[str]]
+) -> Iterator[InputFile]:
+    """Converte as linhas de uma lista de ficheiros em imagens de input."""
+    root = Path(root) if root is not None else None
+    resolved_root = root.resolve() if root is not None else None
+    
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        
+        listed = Path(line)
+        path = root / listed if root is not None and not listed.is_absolute() else listed
+        name = _relative_name(path, listed, resolved_root)
+        if matches_patterns(name, include, exclude):
+            yield InputFile(path, name)
+
+
+def _relative_name(path: Path, listed: Path, resolved_root: Optional[Path]) -> str:
+    """Nome relativo de uma imagem de uma lista de ficheiros."""
+    if resolved_root is not None:
+        try:
+            return path.resolve().relative_to(resolved_root).as_posix()
+        except ValueError:
+            pass
+    
+    # Só aceitar caminhos que não saiam da pasta de resultados (sem "..")
+    if not listed.is_absolute() and ".." not in listed.parts:
+        return PurePosixPath(*listed.parts).as_posix()
+    return listed.name
+
+
+def iter_archive_members(
+    archive_path: Union[str, Path],
+    include: Optional[Sequence[str]] = None,
+    exclude: Optional[Sequence[str]] = None
+) -> Iterator[InputFile]:
+    """
+    Lista as imagens de um arquivo ZIP ou TAR, sem o extrair.
+    
+    Os membros são devolvidos pela ordem do arquivo (num TAR, à medida que
+    os cabeçalhos são lidos). Pastas, membros ocultos e nomes inseguros
+    (absolutos ou com "..") são normalizados ou ignorados.
+    
+    Args:
+        archive_path: Caminho do arquivo
+        include: Padrões de inclusão (ver `matches_patterns`)
+        exclude: Padrões de exclusão (ver `matches_patterns`)
+    
+    Yields:
+        Imagens do arquivo (`member` com o nome do membro)
+    """
+    archive_path = Path(archive_path)
+    for member, name in _list_members(archive_path):
+        if matches_patterns(name, include, exclude):
+            yield InputFile(archive_path, name, member)
+
+
+def _list_members(archive_path: Path) -> Iterator[Tuple[str, str]]:
+    """Devolve pares (nome do membro, nome normalizado) das imagens de um arquivo."""
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as zf:
+            members = [info.filename for info in zf.infolist() if not info.is_dir()]
+        yield from _filter_members(members)
+        return
+    
+    with tarfile.open(archive_path, mode="r:*") as tf:
+        yield from _filter_members(info.name for info in tf if info.isfile())
+
+
+def _filter_members(members: Iterable[str]) -> Iterator[Tuple[str, str]]:
+    """Filtra membros que não são imagens e normaliza os nomes."""
+    for member in members:
+        name = safe_member_name(member)
+        if name and is_image_file(name):
+            yield member, name
+
+
+def safe_member_name(member: str) -> str:
+    """
+    Normaliza o nome de um membro de um arquivo para usar como `filename`.
+    
+    Remove "/" inicial, "." e "..", para que o nome não aponte para fora da
+    pasta de resultados. Membros ocultos (ex: "__MACOSX/", ".DS_Store")
+    dão um nome vazio.
+    
+    Args:
+        member: Nome do membro no arquivo
+    
+    Returns:
+        Nome relativo (separador "/"), ou "" se o membro deve ser ignorado
+    """
+    parts = [part for part in member.replace("\\", "/").split("/") if part not in ("", ".", "..")]
+    if any(part.startswith(".") or part == "__MACOSX" for part in parts):
+        return ""
+    return "/".join(parts)
+
+
+def read_input_bytes(input_file: InputFile) -> bytes:
+    """
+    Lê o conteúdo de uma imagem de input (ficheiro ou membro de arquivo).
+    
+    Os arquivos ficam abertos (um por processo) entre leituras. Membros de
+    TAR não comprimidos são lidos diretamente na sua posição no ficheiro,
+    sem passar pelo `tarfile`; ZIP e TAR comprimidos usam o módulo
+    respetivo (num TAR comprimido, os membros devem ser pedidos pela ordem
+    do arquivo).
+    
+    Args:
+        input_file: Imagem de input
+    
+    Returns:
+        Conteúdo em bytes
+    """
+    if input_file.member is None:
+        return input_file.path.read_bytes()
+    return _get_archive(input_file.path).read(input_file.member)
+
+
+class _ArchiveReader:
+    """Leitor de membros de um arquivo, partilhado entre threads."""
+    
+    def __init__(self, path: Path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._zip: Optional[zipfile.ZipFile] = None
+        self._tar: Optional[tarfile.TarFile] = None
+        self._fd: Optional[int] = None
+        self._offsets: Dict[str, Tuple[int, int]] = {}
+        
+        if zipfile.is_zipfile(path):
+            # ZipFile suporta leituras concorrentes de membros diferentes
+            self._zip = zipfile.ZipFile(path)
+            return
+        
+        tar = tarfile.open(path, mode="r:*")
+        if _is_plain_tar(tar):
+            # TAR não comprimido: índice {membro: (offset, tamanho)} e
+            # leituras com pread, sem lock
+            self._offsets = {
+                info.name: (info.offset_data, info.size) for info in tar if info.isfile()
+            }
+            tar.close()
+            self._fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        else:
+            self._tar = tar
+    
+    def read(self, member: str) -> bytes:
+        if self._zip is not None:
+            return self._zip.read(member)
+        
+        if self._fd is not None:
+            offset, size = self._offsets[member]
+            if hasattr(os, "pread"):
+                return os.pread(self._fd, size, offset)
+            with self._lock:
+                os.lseek(self._fd, offset, os.SEEK_SET)
+                return os.read(self._fd, size)
+        
+        with self._lock:
+            return self._read_compressed_tar(member)
+    
+    def _read_compressed_tar(self, member: str) -> bytes:
+        """
+        Lê um membro de um TAR comprimido avançando no stream.
+        
+        Num stream comprimido, voltar atrás obriga a descomprimir de novo
+        desde o início; os membros devem por isso ser pedidos pela ordem do
+        arquivo (ver `is_compressed_tar`), e só um membro que já ficou para
+        trás faz reabrir o arquivo.
+        """
+        for _ in range(2):
+            while True:
+                info = self._tar.next()
+                if info is None:
+                    break
+                if info.name == member and info.isfile():
+                    return self._tar.extractfile(info).read()
+            
+            # Membro atrás da posição atual (ou inexistente): recomeçar
+            self._tar.close()
+            self._tar = tarfile.open(self._path, mode="r:*")
+        
+        raise KeyError(f"Membro não encontrado no arquivo: {member}")
+
+
+def _is_plain_tar(tar: tarfile.TarFile) -> bool:
+    """Verifica se um TAR aberto com `tarfile.open` não é comprimido."""
+    return tar.fileobj is not None and type(tar.fileobj) is io.BufferedReader
+
+
+def is_compressed_tar(path: Union[str, Path]) -> bool:
+    """
+    Verifica se um arquivo é um TAR comprimido (ex: .tar.gz).
+    
+    Os membros destes arquivos só podem ser lidos de forma eficiente um a
+    um, pela ordem do arquivo, sem threads a pedi-los fora de ordem.
+    """
+    if zipfile.is_zipfile(path):
+        return False
+    with tarfile.open(path, mode="r:*") as tar:
+        return not _is_plain_tar(tar)
+
+
+# Arquivos abertos neste processo (ver `read_input_bytes`)
+_archives: Dict[Path, _ArchiveReader] = {}
+_archives_lock = threading.Lock()
+
+
+def _get_archive(path: Path) -> _ArchiveReader:
+    """Devolve o leitor do arquivo, abrindo-o na primeira utilização."""
+    with _archives_lock:
+        reader = _archives.get(path)
+        if reader is None:
+            reader = _archives[path] = _ArchiveReader(path)
+        return reader
+
+
+class ArchiveMember(io.BytesIO):
+    """
+    Membro de um arquivo carregado na app, em memória.
+    
+    Tem os mesmos atributos usados dos ficheiros uploaded do Streamlit
+    (`name`, `file_id`, `getvalue`), pelo que segue o mesmo caminho.
+    """
+    
+    def __init__(self, data: bytes, name: str, file_id: str):
+        super().__init__(data)
+        self.name = name
+        self.file_id = file_id
+        self.size = len(data)
+
+
+def extract_archive_members(archive: BinaryIO) -> List[ArchiveMember]:
+    """
+    Lê as imagens de um arquivo ZIP/TAR carregado (ex: upload), em memória.
+    
+    Args:
+        archive: Ficheiro do arquivo (com `name` e, opcionalmente, `file_id`)
+    
+    Returns:
+        Imagens do arquivo, com o nome do membro como `name`
+    """
+    archive_id = getattr(archive, "file_id", getattr(archive, "name", ""))
+    archive.seek(0)
+    members = []
+    
+    if zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as zf:
+            for member, name in _filter_members(
+                info.filename for info in zf.infolist() if not info.is_dir()
+            ):
+                members.append(ArchiveMember(zf.read(member), name, f"{archive_id}:{member}"))
+        return members
+    
+    archive.seek(0)
+    with tarfile.open(fileobj=archive, mode="r:*") as tf:
+        for info in tf:
+            if not info.isfile():
+                continue
+            for member, name in _filter_members([info.name]):
+                data = tf.extractfile(info).read()
+                members.append(ArchiveMember(data, name, f"{archive_id}:{member}"))
+    return members
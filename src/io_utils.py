@@ -3,12 +3,31 @@ Utilitários para Input/Output.
 Funções para carregar imagens, criar ZIPs, CSVs, etc.
 """
 
+import importlib.util
 import io
+import math
+from abc import ABC, abstractmethod
+import tempfile
+import threading
 import zipfile
-from typing import Dict, BinaryIO
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Deque, Dict, BinaryIO, Iterable, Optional, Tuple, Union
 import numpy as np
 from PIL import Image
-import pandas as pd
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Lado maior da entrada do modelo (imgsz): a descodificação reduzida
+# (`decode_image`) não desce abaixo disto
+MODEL_INPUT_SIZE = 640
+
+# Modo de descodificação da entrada do modelo, registado na variante das
+# chaves da cache e nos parâmetros do manifesto: deteções obtidas de
+# descodificações diferentes não se misturam
+MODEL_INPUT_DECODE = f"decode:{MODEL_INPUT_SIZE}"
 
 
 def validate_image_file(file: BinaryIO) -> bool:
@@ -17,24 +36,40 @@ def validate_image_file(file: BinaryIO) -> bool:
     
     Args:
         file: Ficheiro uploaded
-        
+    
     Returns:
         True se válido, False caso contrário
     """
+    return sniff_image_file(file) is not None
+
+
+def sniff_image_file(file: BinaryIO) -> Optional[Tuple[str, Tuple[int, int]]]:
+    """
+    Valida um ficheiro uploaded e lê o formato e o tamanho da imagem só
+    pelo cabeçalho (o resultado pode ser passado a `decode_image`).
+    
+    Args:
+        file: Ficheiro uploaded
+    
+    Returns:
+        Tuplo (formato PIL, tamanho (largura, altura)), ou None se o
+        ficheiro não for uma imagem válida
+    """
     valid_extensions = ['.jpg', '.jpeg', '.png']
     
     # Verificar extensão
     file_name = file.name.lower()
     if not any(file_name.endswith(ext) for ext in valid_extensions):
-        return False
+        return None
     
     # Tentar abrir como imagem
     try:
-        Image.open(file)
+        with Image.open(file) as image:
+            header = image.format, image.size
         file.seek(0)  # Reset file pointer
-        return True
+        return header
     except Exception:
-        return False
+        return None
 
 
 def load_image(file: BinaryIO) -> np.ndarray:
@@ -42,21 +77,111 @@ def load_image(file: BinaryIO) -> np.ndarray:
     Carrega uma imagem de um ficheiro uploaded.
     
     Args:
-        file: Ficheiro uploaded do Streamlit
-        
+        file: Ficheiro uploaded do Streamlit (lido a partir da posição atual)
+    
     Returns:
         Imagem em formato numpy array (RGB)
     """
-    image = Image.open(file)
+    image, _ = decode_image(file.read())
+    return image
+
+
+def sniff_image(data: bytes) -> Tuple[str, Tuple[int, int]]:
+    """
+    Lê o formato e o tamanho de uma imagem só pelo cabeçalho, sem
+    descodificar os pixels.
+    
+    Args:
+        data: Conteúdo do ficheiro
+    
+    Returns:
+        Tuplo (formato PIL, ex: 'JPEG', tamanho (largura, altura))
+    
+    Raises:
+        PIL.UnidentifiedImageError: Se os bytes não forem uma imagem
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        return image.format, image.size
+
+
+def decode_image(
+    data: bytes,
+    min_size: Optional[int] = None,
+    header: Optional[Tuple[str, Tuple[int, int]]] = None
+) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """
+    Descodifica uma imagem a partir dos bytes em memória, uma única vez.
+    
+    O cabeçalho é lido uma vez (formato e tamanho) e os pixels são
+    descodificados pelo OpenCV diretamente para o array devolvido, que é
+    convertido para RGB no próprio buffer, sem cópias intermédias. Com
+    `min_size`, os JPEG são descodificados já reduzidos 1/2, 1/4 ou 1/8
+    (escala DCT do libjpeg), pelo que os pixels que o modelo ia descartar
+    no redimensionamento nem chegam a ser descodificados.
+    
+    Args:
+        data: Conteúdo do ficheiro
+        min_size: Lado maior mínimo da imagem devolvida, ex: o tamanho de
+            entrada do modelo (None = resolução original)
+        header: Formato e tamanho já lidos (ex: por `sniff_image_file`);
+            se None, o cabeçalho é lido dos bytes
+    
+    Returns:
+        Tuplo (imagem RGB uint8, tamanho (largura, altura) da imagem
+        original). As deteções na imagem devolvida passam para a original
+        com `Detections.rescale`
+    
+    Raises:
+        PIL.UnidentifiedImageError: Se os bytes não forem uma imagem
+    """
+    import cv2
+    
+    image_format, size = header if header is not None else sniff_image(data)
+    
+    flags = cv2.IMREAD_COLOR
+    if min_size is not None and image_format == 'JPEG':
+        reduced_flags = (
+            (8, cv2.IMREAD_REDUCED_COLOR_8),
+            (4, cv2.IMREAD_REDUCED_COLOR_4),
+            (2, cv2.IMREAD_REDUCED_COLOR_2),
+        )
+        for factor, reduced_flag in reduced_flags:
+            if max(size) / factor >= min_size:
+                flags = reduced_flag
+                break
+    
+    # A orientação EXIF é ignorada, como na leitura com PIL
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags | cv2.IMREAD_IGNORE_ORIENTATION)
+    if image is None:
+        # Formato que o PIL reconhece mas o OpenCV não lê
+        with Image.open(io.BytesIO(data)) as pil_image:
+            return np.array(pil_image.convert('RGB')), size
+    
+    cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=image)
+    return image, size
+
+
+def shrink_image(image: np.ndarray, max_size: int) -> np.ndarray:
+    """
+    Reduz uma imagem para que o lado maior não passe `max_size` (imagens
+    menores são devolvidas sem cópia).
+    
+    Args:
+        image: Imagem em formato numpy array
+        max_size: Lado maior máximo
     
-    # Converter para RGB (caso seja RGBA, grayscale, etc.)
-    if image.mode != 'RGB':
-        image = image.convert('RGB')
+    Returns:
+        Imagem reduzida (INTER_AREA)
+    """
+    height, width = image.shape[:2]
+    if max(height, width) <= max_size:
+        return image
     
-    # Converter para numpy array
-    image_array = np.array(image)
+    import cv2
     
-    return image_array
+    scale = max_size / max(height, width)
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
 
 
 def image_to_bytes(image: np.ndarray, format: str = 'PNG') -> bytes:
@@ -66,7 +191,7 @@ def image_to_bytes(image: np.ndarray, format: str = 'PNG') -> bytes:
     Args:
         image: Imagem em formato numpy array
         format: Formato da imagem ('PNG', 'JPEG')
-        
+    
     Returns:
         Imagem em bytes
     """
@@ -79,44 +204,138 @@ def image_to_bytes(image: np.ndarray, format: str = 'PNG') -> bytes:
     return buf.getvalue()
 
 
-def create_results_csv(df: pd.DataFrame) -> bytes:
+def image_to_thumbnail(image: np.ndarray, max_size: int, quality: int = 85) -> bytes:
+    """
+    Converte numpy array para uma miniatura JPEG (para pré-visualização).
+    
+    Args:
+        image: Imagem em formato numpy array (RGB)
+        max_size: Lado maior máximo da miniatura (imagens menores não são
+            ampliadas)
+        quality: Qualidade JPEG (1-95)
+    
+    Returns:
+        Miniatura em bytes (JPEG)
+    """
+    pil_image = Image.fromarray(image)
+    pil_image.thumbnail((max_size, max_size), Image.BILINEAR)
+    
+    buf = io.BytesIO()
+    pil_image.save(buf, format='JPEG', quality=quality)
+    
+    return buf.getvalue()
+
+
+def create_results_csv(df: "pd.DataFrame") -> bytes:
     """
     Cria um CSV a partir de um DataFrame.
     
     Args:
         df: DataFrame com resultados
-        
+    
     Returns:
         CSV em bytes
     """
     return df.to_csv(index=False).encode('utf-8')
 
 
+# Imagem ou função que a gera sob pedido (ex: anotação lazy)
+ImageOrFactory = Union[np.ndarray, Callable[[], np.ndarray]]
+
+
 def create_results_zip(annotated_images: Dict[str, np.ndarray]) -> bytes:
     """
     Cria um ZIP com as imagens anotadas.
     
     Args:
         annotated_images: Dicionário {filename: image_array}
-        
+    
     Returns:
         ZIP em bytes
     """
     zip_buffer = io.BytesIO()
+    write_results_zip(zip_buffer, annotated_images.items())
+    return zip_buffer.getvalue()
+
+
+def write_results_zip(
+    fileobj: BinaryIO,
+    annotated_images: Iterable[Tuple[str, ImageOrFactory]],
+    max_workers: int = 4
+) -> int:
+    """
+    Escreve um ZIP com as imagens anotadas, em streaming.
     
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        for filename, image_array in annotated_images.items():
-            # Converter imagem para bytes
-            img_bytes = image_to_bytes(image_array, format='PNG')
+    As imagens são geradas (se forem funções) e codificadas em PNG numa
+    thread pool, com no máximo 2 * max_workers imagens em memória de cada
+    vez. O PNG já é comprimido, por isso é guardado no ZIP sem nova
+    compressão (ZIP_STORED).
+    
+    Args:
+        fileobj: Ficheiro de destino (aberto em modo binário)
+        annotated_images: Pares (filename, imagem ou função que a devolve)
+        max_workers: Número de threads de codificação
+    
+    Returns:
+        Número de imagens escritas
+    """
+    def encode(image: ImageOrFactory) -> bytes:
+        if callable(image):
+            image = image()
+        return image_to_bytes(image, format='PNG')
+    
+    items = iter(annotated_images)
+    pending: Deque = deque()
+    count = 0
+    
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_STORED) as zip_file, \
+            ThreadPoolExecutor(max_workers=max_workers) as pool:
+        
+        def submit_next() -> None:
+            for filename, image in items:
+                pending.append((filename, pool.submit(encode, image)))
+                return
+        
+        for _ in range(2 * max_workers):
+            submit_next()
+        
+        while pending:
+            filename, future = pending.popleft()
+            submit_next()
             
             # Adicionar ao ZIP (remover extensão original e adicionar .png)
             base_name = filename.rsplit('.', 1)[0]
             zip_filename = f"{base_name}_annotated.png"
             
-            zip_file.writestr(zip_filename, img_bytes)
+            zip_file.writestr(zip_filename, future.result())
+            count += 1
     
-    zip_buffer.seek(0)
-    return zip_buffer.getvalue()
+    return count
+
+
+def spool_results_zip(
+    annotated_images: Iterable[Tuple[str, ImageOrFactory]],
+    max_memory_mb: float = 64,
+    max_workers: int = 4
+) -> BinaryIO:
+    """
+    Cria o ZIP das imagens anotadas num ficheiro temporário.
+    
+    O ZIP fica em memória até `max_memory_mb` e passa para disco a partir
+    daí, pelo que ZIPs grandes não ocupam RAM.
+    
+    Args:
+        annotated_images: Pares (filename, imagem ou função que a devolve)
+        max_memory_mb: Tamanho a partir do qual o ZIP é escrito em disco
+        max_workers: Número de threads de codificação
+    
+    Returns:
+        Ficheiro temporário com o ZIP, posicionado no início
+    """
+    spooled = tempfile.SpooledTemporaryFile(max_size=int(max_memory_mb * 1024 * 1024))
+    write_results_zip(spooled, annotated_images, max_workers=max_workers)
+    spooled.seek(0)
+    return spooled
 
 
 def save_image_local(image: np.ndarray, path: str, format: str = 'PNG') -> None:
@@ -130,3 +349,277 @@ def save_image_local(image: np.ndarray, path: str, format: str = 'PNG') -> None:
     """
     pil_image = Image.fromarray(image)
     pil_image.save(path, format=format)
+
+
+class ImageSource(ABC):
+    """
+    Imagem lida sob pedido, por regiões.
+    
+    As dimensões ficam disponíveis sem descodificar os pixels, e cada
+    leitura só toca nos pixels da região pedida (quando o formato o
+    permite). Usar com `open_image_source`; as subclasses implementam
+    `read_region` e `to_array`.
+    
+    Attributes:
+        width: Largura da imagem em pixels
+        height: Altura da imagem em pixels
+    """
+    
+    width: int
+    height: int
+    
+    # Altura das faixas lidas por `read_downsampled`
+    band_height = 512
+    
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        """Forma (altura, largura, 3), como um array RGB."""
+        return (self.height, self.width, 3)
+    
+    @abstractmethod
+    def read_region(self, x0: int, y0: int, x1: int, y1: int) -> np.ndarray:
+        """
+        Lê uma região da imagem.
+        
+        Args:
+            x0, y0: Canto superior esquerdo (inclusivo)
+            x1, y1: Canto inferior direito (exclusivo)
+        
+        Returns:
+            Região em formato numpy array (RGB, uint8)
+        """
+    
+    def read_downsampled(self, max_size: int) -> np.ndarray:
+        """
+        Lê a imagem inteira reduzida, com o lado maior <= max_size.
+        
+        A imagem é lida por faixas horizontais, reduzidas uma a uma, pelo
+        que a memória usada não depende do tamanho da imagem original.
+        
+        Args:
+            max_size: Lado maior máximo da imagem devolvida
+        
+        Returns:
+            Imagem reduzida (RGB, uint8)
+        """
+        scale = min(1.0, max_size / max(self.width, self.height))
+        if scale == 1.0:
+            return self.read_region(0, 0, self.width, self.height)
+        
+        out_width = max(1, round(self.width * scale))
+        out_height = max(1, round(self.height * scale))
+        
+        bands = []
+        for y0 in range(0, self.height, self.band_height):
+            y1 = min(y0 + self.band_height, self.height)
+            band_height = max(1, round(y1 * scale) - round(y0 * scale))
+            band = Image.fromarray(self.read_region(0, y0, self.width, y1))
+            bands.append(np.asarray(band.resize((out_width, band_height), Image.BOX)))
+        
+        return np.ascontiguousarray(np.vstack(bands)[:out_height])
+    
+    @abstractmethod
+    def to_array(self) -> np.ndarray:
+        """Lê a imagem inteira (RGB, uint8)."""
+    
+    def close(self) -> None:
+        """Liberta o ficheiro associado."""
+    
+    def __enter__(self) -> "ImageSource":
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class _PILImageSource(ImageSource):
+    """
+    Fonte genérica via PIL (JPEG, PNG, ...).
+    
+    O PIL só lê o cabeçalho ao abrir; os pixels são descodificados uma vez,
+    na primeira leitura.
+    """
+    
+    def __init__(self, file: Union[str, Path, BinaryIO]):
+        self._image = Image.open(file)
+        self.width, self.height = self._image.size
+        self._array: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+    
+    def _load(self) -> np.ndarray:
+        with self._lock:
+            if self._array is None:
+                image = self._image
+                if image.mode != 'RGB':
+                    image = image.convert('RGB')
+                self._array = np.asarray(image)
+        return self._array
+    
+    def read_region(self, x0: int, y0: int, x1: int, y1: int) -> np.ndarray:
+        return self._load()[y0:y1, x0:x1]
+    
+    def to_array(self) -> np.ndarray:
+        return self._load()
+    
+    def close(self) -> None:
+        self._image.close()
+        self._array = None
+
+
+class _TiffImageSource(ImageSource):
+    """
+    Fonte para TIFF/BigTIFF via tifffile, sem descodificar a imagem inteira.
+    
+    Ficheiros não comprimidos são mapeados em memória (memmap). Ficheiros
+    comprimidos em tiles ou strips são descodificados segmento a segmento,
+    apenas os que intersetam a região pedida. Com as amostras em planos
+    separados (planarconfig=separate, arrays (amostras, altura, largura)),
+    cada plano é lido à parte e as amostras passam para o último eixo.
+    Pirâmides (vários níveis) são usadas por `read_downsampled`.
+    """
+    
+    def __init__(self, path: Union[str, Path]):
+        import tifffile
+        
+        self._tiff = tifffile.TiffFile(str(path))
+        self._page = self._tiff.pages[0]
+        self.height = int(self._page.imagelength)
+        self.width = int(self._page.imagewidth)
+        self._lock = threading.Lock()
+        
+        # Planos lidos com amostras separadas (1 em cinzento, 3 em RGB)
+        self._planar = self._page.planarconfig == 2
+        samples = int(self._page.samplesperpixel)
+        self._planes = (3 if samples >= 3 else 1) if self._planar else 1
+        
+        self._memmap = None
+        if self._page.is_memmappable:
+            self._memmap = tifffile.memmap(str(path), page=0, mode='r')
+        
+        if self._page.is_tiled:
+            self._segment_size = (int(self._page.tilelength), int(self._page.tilewidth))
+        else:
+            self._segment_size = (int(self._page.rowsperstrip) or self.height, self.width)
+        self._segments_across = math.ceil(self.width / self._segment_size[1])
+        self._segments_per_plane = math.ceil(self.height / self._segment_size[0]) * self._segments_across
+    
+    def read_region(self, x0: int, y0: int, x1: int, y1: int) -> np.ndarray:
+        if self._memmap is not None:
+            if self._planar:
+                region = self._memmap[:self._planes, y0:y1, x0:x1]
+                return _to_rgb(np.moveaxis(region, 0, -1).copy())
+            return _to_rgb(np.array(self._memmap[y0:y1, x0:x1]))
+        
+        seg_h, seg_w = self._segment_size
+        out = None
+        
+        for plane in range(self._planes):
+            for row in range(y0 // seg_h, math.ceil(y1 / seg_h)):
+                for col in range(x0 // seg_w, math.ceil(x1 / seg_w)):
+                    index = plane * self._segments_per_plane + row * self._segments_across + col
+                    out = self._read_segment(index, plane, out, x0, y0, x1, y1)
+        
+        return _to_rgb(out)
+    
+    def to_array(self) -> np.ndarray:
+        return self.read_region(0, 0, self.width, self.height)
+    
+    def _read_segment(
+        self,
+        index: int,
+        plane: int,
+        out: Optional[np.ndarray],
+        x0: int,
+        y0: int,
+        x1: int,
+        y1: int
+    ) -> np.ndarray:
+        """
+        Descodifica um segmento e copia a interseção com a região pedida
+        para `out` (criado na primeira chamada).
+        
+        Com planos separados, o segmento só tem a amostra `plane`.
+        """
+        with self._lock:
+            handle = self._tiff.filehandle
+            handle.seek(self._page.dataoffsets[index])
+            data = handle.read(self._page.databytecounts[index])
+        
+        segment, indices, _ = self._page.decode(
+            data, index, jpegtables=self._page.jpegtables
+        )
+        segment = segment[0]
+        if segment.ndim == 2:
+            segment = segment[..., None]
+        sy, sx = indices[2], indices[3]
+        
+        if out is None:
+            channels = self._planes if self._planar else segment.shape[-1]
+            out = np.zeros((y1 - y0, x1 - x0, channels), dtype=segment.dtype)
+        channels = slice(plane, plane + 1) if self._planar else slice(None)
+        
+        # Interseção do segmento com a região pedida
+        iy0, iy1 = max(y0, sy), min(y1, sy + segment.shape[0], self.height)
+        ix0, ix1 = max(x0, sx), min(x1, sx + segment.shape[1], self.width)
+        out[iy0 - y0:iy1 - y0, ix0 - x0:ix1 - x0, channels] = segment[iy0 - sy:iy1 - sy, ix0 - sx:ix1 - sx]
+        return out
+    
+    def read_downsampled(self, max_size: int) -> np.ndarray:
+        # Usar o nível mais pequeno da pirâmide que ainda tenha resolução
+        # suficiente (se existir)
+        levels = self._tiff.series[0].levels if self._tiff.series else []
+        for level in reversed(levels[1:]):
+            level_height, level_width = level.shape[-2:] if self._planar else level.shape[:2]
+            if max(level_height, level_width) >= max_size:
+                array = level.asarray()
+                if self._planar:
+                    array = np.moveaxis(array[:self._planes], 0, -1)
+                image = Image.fromarray(_to_rgb(array))
+                image.thumbnail((max_size, max_size), Image.BOX)
+                return np.asarray(image)
+        
+        return super().read_downsampled(max_size)
+    
+    def close(self) -> None:
+        self._memmap = None
+        self._tiff.close()
+
+
+def _to_rgb(array: np.ndarray) -> np.ndarray:
+    """Converte um array de pixels (cinzento, RGBA, 16 bits) para RGB uint8."""
+    if array.dtype != np.uint8:
+        if np.issubdtype(array.dtype, np.integer):
+            shift = np.iinfo(array.dtype).bits - 8
+            array = (array >> shift).astype(np.uint8)
+        else:
+            array = (np.clip(array, 0, 1) * 255).astype(np.uint8)
+    
+    if array.ndim == 2:
+        array = array[..., None]
+    if array.shape[-1] == 1:
+        return np.repeat(array, 3, axis=-1)
+    return array[..., :3]
+
+
+def open_image_source(file: Union[str, Path, BinaryIO]) -> ImageSource:
+    """
+    Abre uma imagem para leitura por regiões, sem a descodificar.
+    
+    TIFF/BigTIFF usam tifffile (memmap ou descodificação por tiles/strips),
+    se estiver instalado; os restantes formatos usam PIL.
+    
+    Args:
+        file: Caminho ou ficheiro (ex: uploaded)
+    
+    Returns:
+        Fonte de imagem (usar como context manager ou chamar `close`)
+    """
+    name = str(file if isinstance(file, (str, Path)) else getattr(file, "name", ""))
+    is_tiff = name.lower().endswith(('.tif', '.tiff'))
+    
+    # O tifffile (opcional) só é importado quando há um TIFF para abrir
+    if is_tiff and isinstance(file, (str, Path)) and importlib.util.find_spec("tifffile"):
+        return _TiffImageSource(file)
+    
+    return _PILImageSource(file)
+
@@ -0,0 +1,629 @@
+"""
+Fila de trabalhos de deteção partilhada pelas sessões da app.
+Os trabalhos (um por clique em "Run Detection") ficam numa base de dados
+SQLite em modo WAL e são servidos por processos worker, cada um com o seu
+modelo carregado. Os workers atendem as sessões à vez (round-robin), um
+batch de imagens de cada vez, pelo que um upload grande não bloqueia os
+outros utilizadores.
+
+Uso (pool de workers separado da app):
+    python -m src.jobs --workers 2 --model models/best.pt
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from src.cache import InferenceCache, decode_detections, encode_detections, file_digest, hash_bytes
+from src.detections import Detections
+from src.profiling import add_timings, timed
+
+
+DEFAULT_DB_PATH = ".cache/jobs/jobs.sqlite"
+
+# Estados de um trabalho (e das imagens que o compõem)
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (DONE, CANCELLED)
+
+# Imagens reservadas por um worker há mais tempo do que isto voltam para a
+# fila (o worker terá morrido a meio do batch)
+LEASE_TIMEOUT_S = 600.0
+
+# Intervalo entre sinais de vida dos workers
+HEARTBEAT_INTERVAL_S = 5.0
+
+# Trabalhos terminados há mais tempo do que isto são apagados
+JOB_RETENTION_S = 3600.0
+
+
+class JobQueue:
+    """
+    Fila de trabalhos de deteção em SQLite.
+    
+    Cada trabalho tem uma imagem por linha na tabela `tasks` (com os bytes
+    até ser processada e as deteções depois). Cada imagem concluída recebe
+    um número de sequência dentro do trabalho (`seq`), para que a app leia
+    só os resultados novos (`results_since`). Vários processos (app e
+    workers) usam a mesma base de dados; cada thread tem a sua ligação.
+    """
+    
+    def __init__(self, db_path: Union[str, Path] = DEFAULT_DB_PATH):
+        """
+        Args:
+            db_path: Ficheiro da base de dados (criado se não existir)
+        """
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        
+        with self._transaction() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    session_id TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    total INTEGER NOT NULL,
+                    done INTEGER NOT NULL DEFAULT 0,
+                    failed INTEGER NOT NULL DEFAULT 0,
+                    created REAL NOT NULL,
+                    started REAL,
+                    finished REAL
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS tasks (
+                    job_id TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    filename TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    data BLOB,
+                    claimed_at REAL,
+                    result BLOB,
+                    timings TEXT,
+                    error TEXT,
+                    seq INTEGER,
+                    PRIMARY KEY (job_id, idx)
+                )
+                """
+            )
+            # Bases de dados criadas antes da coluna `seq`
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(tasks)")}
+            if "seq" not in columns:
+                conn.execute("ALTER TABLE tasks ADD COLUMN seq INTEGER")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status, job_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_seq ON tasks (job_id, seq)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, last_served REAL NOT NULL)"
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS workers (
+                    worker_id TEXT PRIMARY KEY,
+                    pid INTEGER NOT NULL,
+                    heartbeat REAL NOT NULL,
+                    error TEXT
+                )
+                """
+            )
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Devolve a ligação SQLite da thread atual."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Sem transações implícitas: são abertas em `_transaction`
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+    
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Transação com escrita reservada desde o início (BEGIN IMMEDIATE)."""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+    
+    def submit(self, session_id: str, files: List[Tuple[str, bytes]]) -> str:
+        """
+        Cria um trabalho com as imagens indicadas.
+        
+        Args:
+            session_id: Sessão que submete (para a distribuição justa)
+            files: Lista de (nome do ficheiro, bytes da imagem)
+        
+        Returns:
+            ID do trabalho
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        
+        with self._transaction() as conn:
+            self._purge(conn, now - JOB_RETENTION_S)
+            conn.execute(
+                "INSERT INTO jobs (job_id, session_id, status, total, created) VALUES (?, ?, ?, ?, ?)",
+                (job_id, session_id, QUEUED if files else DONE, len(files), now)
+            )
+            conn.executemany(
+                "INSERT INTO tasks (job_id, idx, filename, status, data) VALUES (?, ?, ?, ?, ?)",
+                [(job_id, idx, name, QUEUED, data) for idx, (name, data) in enumerate(files)]
+            )
+        
+        return job_id
+    
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Estado e progresso de um trabalho.
+        
+        Returns:
+            Dicionário {job_id, status, total, done, failed, created,
+            started, finished}, ou None se o trabalho não existir
+        """
+        row = self._connect().execute(
+            "SELECT job_id, status, total, done, failed, created, started, finished "
+            "FROM jobs WHERE job_id = ?",
+            (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        keys = ("job_id", "status", "total", "done", "failed", "created", "started", "finished")
+        return dict(zip(keys, row))
+    
+    def results(self, job_id: str) -> List[Dict[str, Any]]:
+        """
+        Resultados de um trabalho, pela ordem de submissão.
+        
+        Returns:
+            Lista de {filename, detections, timings, error}; `detections`
+            é None nas imagens que falharam (ou ainda por processar)
+        """
+        rows = self._connect().execute(
+            "SELECT filename, result, timings, error FROM tasks WHERE job_id = ? ORDER BY idx",
+            (job_id,)
+        ).fetchall()
+        return [
+            {
+                "filename": filename,
+                "detections": decode_detections(result) if result is not None else None,
+                "timings": json.loads(timings) if timings else {},
+                "error": error,
+            }
+            for filename, result, timings, error in rows
+        ]
+    
+    def results_since(self, job_id: str, cursor: int = 0) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Resultados concluídos depois de `cursor`, pela ordem de conclusão.
+        
+        Só as linhas novas são lidas e descodificadas, pelo que consultar o
+        progresso com frequência custa o número de imagens novas, não o
+        tamanho do trabalho.
+        
+        Args:
+            job_id: ID do trabalho
+            cursor: Valor devolvido pela chamada anterior (0 na primeira)
+        
+        Returns:
+            Tuplo (lista de {index, filename, detections, timings, error},
+            cursor para a chamada seguinte)
+        """
+        rows = self._connect().execute(
+            "SELECT seq, idx, filename, result, timings, error FROM tasks "
+            "WHERE job_id = ? AND seq > ? ORDER BY seq",
+            (job_id, cursor)
+        ).fetchall()
+        results = [
+            {
+                "index": idx,
+                "filename": filename,
+                "detections": decode_detections(result) if result is not None else None,
+                "timings": json.loads(timings) if timings else {},
+                "error": error,
+            }
+            for _, idx, filename, result, timings, error in rows
+        ]
+        return results, rows[-1][0] if rows else cursor
+    
+    def cancel(self, job_id: str) -> None:
+        """Cancela as imagens ainda em fila (as que já estão num worker terminam)."""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE tasks SET status = ?, data = NULL WHERE job_id = ? AND status = ?",
+                (CANCELLED, job_id, QUEUED)
+            )
+            conn.execute(
+                "UPDATE jobs SET status = ?, finished = ? WHERE job_id = ? AND status IN (?, ?)",
+                (CANCELLED, time.time(), job_id, QUEUED, RUNNING)
+            )
+    
+    def claim(self, max_items: int) -> Optional[Tuple[str, List[Tuple[int, str, bytes]]]]:
+        """
+        Reserva o próximo batch de imagens para um worker.
+        
+        As sessões são servidas à vez: o batch vem do trabalho mais antigo
+        da sessão atendida há mais tempo. Imagens reservadas há mais de
+        `LEASE_TIMEOUT_S` voltam para a fila.
+        
+        Args:
+            max_items: Número máximo de imagens
+        
+        Returns:
+            Tuplo (job_id, lista de (índice, nome, bytes)), ou None se a
+            fila estiver vazia
+        """
+        now = time.time()
+        
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE tasks SET status = ?, claimed_at = NULL WHERE status = ? AND claimed_at < ?",
+                (QUEUED, RUNNING, now - LEASE_TIMEOUT_S)
+            )
+            row = conn.execute(
+                """
+                SELECT j.job_id, j.session_id
+                FROM jobs j LEFT JOIN sessions s ON s.session_id = j.session_id
+                WHERE j.status IN (?, ?)
+                  AND EXISTS (SELECT 1 FROM tasks t WHERE t.job_id = j.job_id AND t.status = ?)
+                ORDER BY COALESCE(s.last_served, 0), j.created
+                LIMIT 1
+                """,
+                (QUEUED, RUNNING, QUEUED)
+            ).fetchone()
+            if row is None:
+                return None
+            job_id, session_id = row
+            
+            tasks = conn.execute(
+                "SELECT idx, filename, data FROM tasks WHERE job_id = ? AND status = ? ORDER BY idx LIMIT ?",
+                (job_id, QUEUED, max_items)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE tasks SET status = ?, claimed_at = ? WHERE job_id = ? AND idx = ?",
+                [(RUNNING, now, job_id, idx) for idx, _, _ in tasks]
+            )
+            conn.execute(
+                "UPDATE jobs SET status = ?, started = COALESCE(started, ?) WHERE job_id = ?",
+                (RUNNING, now, job_id)
+            )
+            conn.execute(
+                "INSERT INTO sessions (session_id, last_served) VALUES (?, ?) "
+                "ON CONFLICT (session_id) DO UPDATE SET last_served = excluded.last_served",
+                (session_id, now)
+            )
+        
+        return job_id, tasks
+    
+    def complete(
+        self,
+        job_id: str,
+        outputs: List[Tuple[int, Optional[Detections], Dict[str, float], Optional[str]]]
+    ) -> None:
+        """
+        Guarda os resultados de um batch reservado com `claim`.
+        
+        Args:
+            job_id: ID do trabalho
+            outputs: Lista de (índice, deteções ou None, tempos, erro ou None)
+        """
+        with self._transaction() as conn:
+            # Números de sequência a seguir ao último deste trabalho
+            last_seq = conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM tasks WHERE job_id = ?", (job_id,)
+            ).fetchone()[0]
+            conn.executemany(
+                "UPDATE tasks SET status = ?, data = NULL, result = ?, timings = ?, error = ?, seq = ? "
+                "WHERE job_id = ? AND idx = ? AND status = ?",
+                [
+                    (
+                        FAILED if error else DONE,
+                        encode_detections(detections) if detections is not None else None,
+                        json.dumps(timings),
+                        error,
+                        last_seq + position,
+                        job_id,
+                        idx,
+                        RUNNING,
+                    )
+                    for position, (idx, detections, timings, error) in enumerate(outputs, 1)
+                ]
+            )
+            done, failed, pending = conn.execute(
+                "SELECT SUM(status = ?), SUM(status = ?), SUM(status IN (?, ?)) FROM tasks WHERE job_id = ?",
+                (DONE, FAILED, QUEUED, RUNNING, job_id)
+            ).fetchone()
+            conn.execute(
+                "UPDATE jobs SET done = ?, failed = ? WHERE job_id = ?",
+                (done or 0, failed or 0, job_id)
+            )
+            if not pending:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, finished = ? WHERE job_id = ? AND status = ?",
+                    (DONE, time.time(), job_id, RUNNING)
+                )
+    
+    def heartbeat(self, worker_id: str, error: Optional[str] = None) -> None:
+        """Regista que um worker está vivo (ou o erro com que terminou)."""
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO workers (worker_id, pid, heartbeat, error) VALUES (?, ?, ?, ?)",
+                (worker_id, os.getpid(), time.time(), error)
+            )
+    
+    def workers(self, max_age_s: float = 3 * HEARTBEAT_INTERVAL_S) -> List[Dict[str, Any]]:
+        """
+        Workers com sinal de vida recente.
+        
+        Returns:
+            Lista de {worker_id, pid, heartbeat, error}
+        """
+        rows = self._connect().execute(
+            "SELECT worker_id, pid, heartbeat, error FROM workers WHERE heartbeat >= ?",
+            (time.time() - max_age_s,)
+        ).fetchall()
+        return [dict(zip(("worker_id", "pid", "heartbeat", "error"), row)) for row in rows]
+    
+    @staticmethod
+    def _purge(conn: sqlite3.Connection, before: float) -> None:
+        """Apaga os trabalhos terminados antes de `before`."""
+        conn.execute(
+            "DELETE FROM tasks WHERE job_id IN "
+            "(SELECT job_id FROM jobs WHERE status IN (?, ?) AND finished < ?)",
+            (*FINISHED_STATES, before)
+        )
+        conn.execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND finished < ?",
+            (*FINISHED_STATES, before)
+        )
+
+
+def process_tasks(
+    model: Any,
+    tasks: List[Tuple[int, str, bytes]],
+    cache: Optional[InferenceCache],
+    model_digest: str,
+    variant: str,
+    batch_size: int
+) -> List[Tuple[int, Optional[Detections], Dict[str, float], Optional[str]]]:
+    """
+    Corre o modelo (com limiares permissivos) sobre um batch reservado.
+    
+    Args:
+        model: Modelo carregado
+        tasks: Lista de (índice, nome, bytes da imagem)
+        cache: Cache de resultados (opcional)
+        model_digest: Hash do modelo (para a chave da cache)
+        variant: Variante da inferência (para a chave da cache)
+        batch_size: Imagens por forward pass
+    
+    Returns:
+        Lista de (índice, deteções ou None, tempos, erro ou None), no
+        formato de `JobQueue.complete`
+    """
+    from src.infer import RAW_CONF_THRESHOLD, RAW_IOU_THRESHOLD, RAW_MAX_DET, run_inference_batch
+    from src.io_utils import MODEL_INPUT_SIZE, decode_image
+    
+    outputs: Dict[int, Tuple[Optional[Detections], Dict[str, float], Optional[str]]] = {}
+    pending = []
+    
+    for idx, filename, data in tasks:
+        timings: Dict[str, float] = {}
+        key = None
+        if cache is not None:
+            key = cache.make_key(hash_bytes(data), model_digest, RAW_CONF_THRESHOLD, RAW_IOU_THRESHOLD, variant)
+            detections = cache.get(key)
+            if detections is not None:
+                outputs[idx] = (detections, timings, None)
+                continue
+        try:
+            # Descodificação reduzida ao tamanho de entrada do modelo; as
+            # caixas voltam às coordenadas da imagem original
+            with timed(timings, "decode"):
+                image, original_size = decode_image(data, MODEL_INPUT_SIZE)
+        except Exception:
+            outputs[idx] = (None, timings, f"Imagem inválida: {filename}")
+            continue
+        pending.append((idx, key, image, original_size, timings))
+    
+    if pending:
+        try:
+            inferred = run_inference_batch(
+                model=model,
+                images=[image for _, _, image, _, _ in pending],
+                batch_size=batch_size,
+                conf_threshold=RAW_CONF_THRESHOLD,
+                iou_threshold=RAW_IOU_THRESHOLD,
+                max_det=RAW_MAX_DET
+            )
+        except Exception as e:
+            for idx, _, _, _, timings in pending:
+                outputs[idx] = (None, timings, f"Erro na inferência: {e}")
+        else:
+            for (idx, key, image, original_size, timings), result in zip(pending, inferred):
+                detections = result["detections"].rescale(
+                    (image.shape[1], image.shape[0]), original_size
+                )
+                if cache is not None:
+                    cache.put(key, detections)
+                add_timings(timings, result["timings"])
+                outputs[idx] = (detections, timings, None)
+    
+    return [(idx, *outputs[idx]) for idx, _, _ in tasks]
+
+
+def run_worker(
+    db_path: str,
+    model_path: str,
+    engine: str = "torch",
+    batch_size: int = 4,
+    num_threads: Optional[int] = None,
+    cache_dir: Optional[str] = None,
+    cache_size_mb: float = 512,
+    poll_interval: float = 0.2
+) -> None:
+    """
+    Ciclo de um processo worker: carrega o modelo e serve a fila até o
+    processo pai terminar.
+    
+    Args:
+        db_path: Base de dados da fila
+        model_path: Caminho do modelo
+        engine: Motor de inferência (ver `load_model`)
+        batch_size: Imagens reservadas (e inferidas) de cada vez
+        num_threads: Threads do modelo neste worker (None = todas)
+        cache_dir: Pasta da cache de resultados (None = sem cache)
+        cache_size_mb: Tamanho máximo da cache em MB
+        poll_interval: Espera (s) quando a fila está vazia
+    """
+    from src.infer import load_model
+    from src.io_utils import MODEL_INPUT_DECODE
+    
+    queue = JobQueue(db_path)
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    parent_pid = os.getppid()
+    
+    try:
+        if num_threads:
+            import cv2
+            import torch
+            
+            # Evitar oversubscription: cada worker usa apenas a sua fatia de cores
+            torch.set_num_threads(num_threads)
+            cv2.setNumThreads(1)
+        model = load_model(model_path, engine=engine, num_threads=num_threads)
+    except Exception as e:
+        queue.heartbeat(worker_id, error=f"Erro ao carregar modelo: {e}")
+        raise
+    
+    cache = InferenceCache(cache_dir, cache_size_mb) if cache_dir else None
+    model_digest = file_digest(model_path)
+    variant = MODEL_INPUT_DECODE if engine == "torch" else f"engine:{engine}|{MODEL_INPUT_DECODE}"
+    
+    last_heartbeat = 0.0
+    while os.getppid() == parent_pid:
+        if time.time() - last_heartbeat >= HEARTBEAT_INTERVAL_S:
+            queue.heartbeat(worker_id)
+            last_heartbeat = time.time()
+        
+        claimed = queue.claim(batch_size)
+        if claimed is None:
+            time.sleep(poll_interval)
+            continue
+        
+        job_id, tasks = claimed
+        queue.complete(job_id, process_tasks(model, tasks, cache, model_digest, variant, batch_size))
+
+
+def start_workers(
+    num_workers: int,
+    db_path: str,
+    model_path: str,
+    engine: str = "torch",
+    batch_size: int = 4,
+    cache_dir: Optional[str] = None,
+    cache_size_mb: float = 512
+) -> List[multiprocessing.Process]:
+    """
+    Lança os processos worker (daemon: terminam com o processo atual).
+    
+    Os cores da máquina são divididos pelos workers. Com o motor ONNX, o
+    .onnx é exportado aqui, uma vez, antes de arrancar os workers (que só
+    o carregam), para não o escreverem vários ao mesmo tempo.
+    
+    Returns:
+        Lista de processos
+    
+    Raises:
+        Exception: Se a exportação para ONNX falhar
+    """
+    if engine == "onnx":
+        from src.onnx_engine import export_onnx
+        
+        export_onnx(model_path)
+    
+    context = multiprocessing.get_context("spawn")
+    num_threads = max(1, (os.cpu_count() or 1) // num_workers)
+    
+    processes = []
+    for i in range(num_workers):
+        process = context.Process(
+            target=run_worker,
+            kwargs={
+                "db_path": str(db_path),
+                "model_path": str(model_path),
+                "engine": engine,
+                "batch_size": batch_size,
+                "num_threads": num_threads,
+                "cache_dir": cache_dir,
+                "cache_size_mb": cache_size_mb,
+            },
+            name=f"inference-worker-{i}",
+            daemon=True
+        )
+        process.start()
+        processes.append(process)
+    return processes
+
+
+def parse_args():
+    """Parse argumentos da linha de comandos."""
+    from src.infer import ENGINES
+    
+    parser = argparse.ArgumentParser(
+        description="Pool de workers da fila de deteção (partilhada com a app)"
+    )
+    parser.add_argument("--workers", "-w", type=int, default=2, help="Número de workers (default: 2)")
+    parser.add_argument("--model", "-m", type=str, default="models/best.pt", help="Caminho do modelo")
+    parser.add_argument("--engine", choices=ENGINES, default="torch", help="Motor de inferência")
+    parser.add_argument("--batch-size", "-b", type=int, default=4, help="Imagens por batch (default: 4)")
+    parser.add_argument("--db", type=str, default=DEFAULT_DB_PATH, help=f"Base de dados da fila (default: {DEFAULT_DB_PATH})")
+    parser.add_argument("--cache-dir", type=str, default=None, help="Pasta da cache de resultados")
+    parser.add_argument("--cache-size-mb", type=float, default=512, help="Tamanho máximo da cache em MB")
+    return parser.parse_args()
+
+
+def main():
+    """Lança o pool e espera até Ctrl+C."""
+    args = parse_args()
+    
+    if not Path(args.model).exists():
+        print(f"❌ Erro: Modelo não encontrado: {args.model}")
+        raise SystemExit(1)
+    
+    try:
+        processes = start_workers(
+            args.workers, args.db, args.model, args.engine, args.batch_size, args.cache_dir, args.cache_size_mb
+        )
+    except Exception as e:
+        print(f"❌ Erro ao exportar o modelo: {e}")
+        raise SystemExit(1)
+    print(f"👷 {args.workers} workers a servir a fila {args.db} (Ctrl+C para terminar)")
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        print("\n⏹️  A terminar...")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Manifesto de execução do processamento batch.
+Regista, na pasta de resultados, cada imagem já processada (tamanho, data
+de modificação e contagens), para que uma execução interrompida possa ser
+retomada sem repetir as imagens concluídas.
+"""
+
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+
+# Nome do ficheiro na pasta de resultados
+MANIFEST_FILENAME = "manifest.jsonl"
+
+
+class ManifestMismatchError(ValueError):
+    """O manifesto existente foi criado com outro modelo ou outros parâmetros."""
+
+
+def file_signature(path: Union[str, Path]) -> Dict[str, int]:
+    """
+    Identifica uma versão de um ficheiro pelo tamanho e data de modificação.
+    
+    Args:
+        path: Caminho do ficheiro
+    
+    Returns:
+        Dicionário {"size", "mtime_ns"}
+    """
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+class RunManifest:
+    """
+    Manifesto JSON Lines de uma execução batch.
+    
+    A primeira linha é o cabeçalho, com os parâmetros que determinam as
+    deteções (hash do modelo, limiares, modo tiled). Cada linha seguinte
+    regista uma imagem concluída. As linhas são acrescentadas com uma única
+    escrita em modo append, pelo que vários processos worker podem
+    escrever no mesmo manifesto.
+    """
+    
+    def __init__(self, output_dir: Union[str, Path], params: Dict[str, Any]):
+        """
+        Args:
+            output_dir: Pasta de resultados
+            params: Parâmetros da execução (guardados no cabeçalho)
+        """
+        self.path = Path(output_dir) / MANIFEST_FILENAME
+        self.params = params
+    
+    def start(self, resume: bool = False) -> Dict[str, Dict[str, Any]]:
+        """
+        Prepara o manifesto para uma nova execução.
+        
+        Sem `resume`, o manifesto é recriado. Com `resume`, as entradas
+        existentes são lidas e mantidas.
+        
+        Args:
+            resume: Se True, retoma a execução registada no manifesto
+        
+        Returns:
+            Entradas já concluídas {filename: entrada} (vazio sem `resume`)
+        
+        Raises:
+            ManifestMismatchError: Se o manifesto tiver outros parâmetros
+        """
+        if resume and self.path.exists():
+            header, entries = self.read()
+            if header is not None:
+                if header["params"] != self.params:
+                    raise ManifestMismatchError(
+                        f"{self.path} foi criado com outros parâmetros: {header['params']}"
+                    )
+                # Terminar uma última linha incompleta (execução interrompida),
+                # para que não absorva a primeira entrada desta execução
+                with open(self.path, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        append_line(self.path, "\n")
+                return entries
+        
+        header = {"type": "header", "created": time.time(), "params": self.params}
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(header) + "\n")
+        return {}
+    
+    def read(self) -> Tuple[Optional[Dict[str, Any]], Dict[str, Dict[str, Any]]]:
+        """
+        Lê o manifesto.
+        
+        Se a mesma imagem aparecer várias vezes, fica a última entrada. Uma
+        última linha incompleta (execução interrompida a meio da escrita) é
+        ignorada.
+        
+        Returns:
+            Tuplo (cabeçalho ou None, entradas {filename: entrada})
+        """
+        header = None
+        entries = {}
+        
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record.get("type") == "header":
+                    header = record
+                elif record.get("type") == "file":
+                    entries[record["filename"]] = record
+        
+        return header, entries
+    
+    def append(self, result: Dict[str, Any], path: Union[str, Path]) -> None:
+        """
+        Regista uma imagem concluída.
+        
+        Args:
+            result: Resultado da imagem (filename, counts, percentages)
+            path: Caminho do ficheiro da imagem
+        """
+        record = {
+            "type": "file",
+            "filename": result["filename"],
+            **file_signature(path),
+            "counts": result["counts"],
+            "percentages": result["percentages"],
+        }
+        append_line(self.path, json.dumps(record) + "\n")
+
+
+def is_done(entry: Optional[Dict[str, Any]], path: Union[str, Path]) -> bool:
+    """
+    Verifica se uma imagem já foi processada e não mudou desde então.
+    
+    Args:
+        entry: Entrada do manifesto para a imagem (ou None)
+        path: Caminho do ficheiro da imagem
+    
+    Returns:
+        True se a imagem pode ser saltada
+    """
+    if entry is None:
+        return False
+    try:
+        signature = file_signature(path)
+    except OSError:
+        return False
+    return entry["size"] == signature["size"] and entry["mtime_ns"] == signature["mtime_ns"]
+
+
+def append_line(path: Path, text: str) -> None:
+    """Acrescenta texto a um ficheiro com uma única escrita (O_APPEND)."""
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, text.encode("utf-8"))
+    finally:
+        os.close(fd)
+
+
+def entries_to_results(
+    entries: Dict[str, Dict[str, Any]],
+    filenames: Optional[Iterable[str]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Converte entradas do manifesto em resultados (para `calculate_metrics`).
+    
+    Args:
+        entries: Entradas do manifesto {filename: entrada}
+        filenames: Se definido, só as entradas destas imagens, por esta ordem
+    
+    Returns:
+        Lista de resultados {filename, counts, percentages}
+    """
+    if filenames is None:
+        filenames = entries.keys()
+    return [
+        {
+            "filename": entries[name]["filename"],
+            "counts": entries[name]["counts"],
+            "percentages": entries[name]["percentages"],
+        }
+        for name in filenames
+        if name in entries
+    ]
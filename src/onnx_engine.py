@@ -0,0 +1,302 @@
+"""
+Motor de inferência ONNX Runtime (CPU).
+Exporta o modelo YOLO para ONNX uma única vez (o ficheiro .onnx fica ao lado
+dos pesos .pt) e executa-o com ONNX Runtime, com o mesmo pré- e
+pós-processamento do Ultralytics, pelo que as deteções são equivalentes às
+do motor PyTorch.
+"""
+
+import ast
+import json
+import os
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple, Union
+import numpy as np
+
+from src.detections import Detections, build_class_lut, nms
+from src.profiling import add_timings, timed
+
+
+# Parâmetros do NMS do Ultralytics (ver ultralytics.utils.nms)
+MAX_NMS = 30000
+PADDING_VALUE = 114
+
+# Modelo quantizado em INT8 e relatório de precisão (ao lado dos pesos .pt)
+INT8_SUFFIX = ".int8.onnx"
+INT8_REPORT_SUFFIX = ".int8.json"
+
+
+def export_onnx(model_path: Union[str, Path], force: bool = False) -> Path:
+    """
+    Exporta o modelo .pt para ONNX, se ainda não tiver sido exportado.
+    
+    O ficheiro é guardado ao lado dos pesos (ex: models/best.onnx) e só é
+    recriado se os pesos forem mais recentes. A exportação usa eixos
+    dinâmicos (batch e tamanho), para aceitar os mesmos tamanhos de input
+    que o motor PyTorch.
+    
+    Args:
+        model_path: Caminho para o ficheiro .pt do modelo
+        force: Se True, exporta mesmo que o ficheiro .onnx já exista
+    
+    Returns:
+        Caminho do ficheiro .onnx
+    """
+    model_path = Path(model_path)
+    onnx_path = model_path.with_suffix(".onnx")
+    
+    if (
+        not force
+        and onnx_path.exists()
+        and onnx_path.stat().st_mtime >= model_path.stat().st_mtime
+    ):
+        return onnx_path
+    
+    from ultralytics import YOLO
+    
+    exported = YOLO(str(model_path)).export(
+        format="onnx", dynamic=True, simplify=False, verbose=False
+    )
+    return Path(exported)
+
+
+def int8_paths(model_path: Union[str, Path]) -> Tuple[Path, Path]:
+    """
+    Caminhos do modelo INT8 e do seu relatório (ex: models/best.int8.onnx e
+    models/best.int8.json).
+    """
+    model_path = Path(model_path)
+    return (
+        model_path.with_name(model_path.stem + INT8_SUFFIX),
+        model_path.with_name(model_path.stem + INT8_REPORT_SUFFIX),
+    )
+
+
+def find_int8_onnx(model_path: Union[str, Path]) -> Path:
+    """
+    Devolve o modelo INT8 criado por `src.quantize`, se tiver passado a
+    verificação de precisão.
+    
+    Args:
+        model_path: Caminho para o ficheiro .pt do modelo
+    
+    Returns:
+        Caminho do ficheiro .int8.onnx
+    
+    Raises:
+        FileNotFoundError: Se o modelo INT8 ou o relatório não existirem
+        ValueError: Se o relatório indicar que a perda de precisão excede
+            a tolerância, ou se os pesos .pt forem mais recentes
+    """
+    onnx_path, report_path = int8_paths(model_path)
+    if not onnx_path.exists() or not report_path.exists():
+        raise FileNotFoundError(
+            f"Modelo INT8 não encontrado: {onnx_path} "
+            f"(criar com: python -m src.quantize --calibration <pasta ou dataset.yaml>)"
+        )
+    if onnx_path.stat().st_mtime < Path(model_path).stat().st_mtime:
+        raise ValueError(f"{onnx_path} é anterior a {model_path}; volta a quantizar o modelo")
+    
+    with open(report_path, "r", encoding="utf-8") as f:
+        report = json.load(f)
+    if not report.get("passed", False):
+        raise ValueError(
+            f"O modelo INT8 falhou a verificação de precisão "
+            f"(verificações: {report.get('checks', {})}); ver {report_path}"
+        )
+    return onnx_path
+
+
+class OnnxEngine:
+    """
+    Modelo YOLOv8 exportado para ONNX, executado com ONNX Runtime.
+    
+    Tem o atributo `names` ({id: nome}) como o modelo do Ultralytics e o
+    método `predict_detections`, usado por `src.infer` em vez de
+    `model.predict`.
+    """
+    
+    def __init__(self, onnx_path: Union[str, Path], num_threads: Optional[int] = None):
+        """
+        Args:
+            onnx_path: Caminho do ficheiro .onnx
+            num_threads: Threads do ONNX Runtime (default: nº de cores)
+        """
+        try:
+            import onnxruntime as ort
+        except ImportError:  # Opcional: só necessário com os motores ONNX
+            raise ImportError(
+                "O motor ONNX requer o onnxruntime (pip install onnxruntime)"
+            )
+        
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = num_threads or os.cpu_count() or 1
+        options.inter_op_num_threads = 1
+        
+        self.path = Path(onnx_path)
+        self.session = ort.InferenceSession(
+            str(onnx_path), sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+        
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names: Dict[int, str] = ast.literal_eval(metadata["names"])
+        self.stride = int(metadata.get("stride", 32))
+        imgsz = ast.literal_eval(metadata.get("imgsz", "[640, 640]"))
+        self.imgsz: Tuple[int, int] = tuple(imgsz) if isinstance(imgsz, list) else (imgsz, imgsz)
+        self.dynamic = not isinstance(self.session.get_inputs()[0].shape[2], int)
+        self.type = "onnx"
+        self.task = metadata.get("task", "detect")
+    
+    def predict_detections(
+        self,
+        images: List[np.ndarray],
+        conf_threshold: float,
+        iou_threshold: float,
+        max_det: int,
+        map_name: Optional[Callable[[str], str]] = None,
+        speed: Optional[Dict[str, float]] = None
+    ) -> List[Detections]:
+        """
+        Executa a deteção num batch de imagens (um único `session.run`).
+        
+        Args:
+            images: Lista de imagens em formato numpy array
+            conf_threshold: Limiar de confiança
+            iou_threshold: Limiar de IOU para NMS
+            max_det: Número máximo de deteções por imagem
+            map_name: Função que mapeia nomes do modelo para nomes standard
+            speed: Se definido, recebe os tempos por imagem (ms) de
+                preprocess, inference e postprocess, como `results.speed`
+                do Ultralytics
+        
+        Returns:
+            Deteções de cada imagem, pela mesma ordem
+        """
+        names, lut = build_class_lut(self.names, map_name)
+        timings: Dict[str, float] = {}
+        
+        with timed(timings, "preprocess"):
+            # Como o Ultralytics: retângulo mínimo se as imagens forem do
+            # mesmo tamanho e o modelo tiver eixos dinâmicos; senão, imgsz
+            same_shapes = len({image.shape for image in images}) == 1
+            batch = self.preprocess(images, auto=same_shapes and self.dynamic)
+        
+        with timed(timings, "inference"):
+            (predictions,) = self.session.run(None, {self.input_name: batch})
+        
+        with timed(timings, "postprocess"):
+            detections = [
+                self._postprocess(
+                    prediction, batch.shape[2:], image.shape[:2],
+                    conf_threshold, iou_threshold, max_det, names, lut
+                )
+                for prediction, image in zip(predictions, images)
+            ]
+        
+        if speed is not None:
+            add_timings(speed, timings, scale=1 / len(images))
+        return detections
+    
+    def preprocess(self, images: List[np.ndarray], auto: bool = False) -> np.ndarray:
+        """
+        Converte imagens no tensor de input do modelo (como o Ultralytics).
+        
+        Args:
+            images: Lista de imagens em formato numpy array
+            auto: Se True, preenche só até ao múltiplo do stride seguinte
+                (retângulo mínimo); senão, até ao imgsz completo
+        
+        Returns:
+            Tensor float32 (batch, 3, altura, largura) com valores em [0, 1]
+        """
+        batch = np.stack([self._letterbox(image, auto) for image in images])
+        # As imagens já estão em RGB (a ordem do modelo); HWC -> CHW
+        batch = np.ascontiguousarray(batch.transpose(0, 3, 1, 2))
+        return batch.astype(np.float32) / 255.0
+    
+    def _letterbox(self, image: np.ndarray, auto: bool) -> np.ndarray:
+        """Redimensiona e preenche a imagem como o LetterBox do Ultralytics."""
+        import cv2
+        
+        shape = image.shape[:2]
+        new_h, new_w = self.imgsz
+        r = min(new_h / shape[0], new_w / shape[1])
+        
+        new_unpad = round(shape[1] * r), round(shape[0] * r)
+        dw, dh = new_w - new_unpad[0], new_h - new_unpad[1]
+        if auto:
+            dw, dh = np.mod(dw, self.stride), np.mod(dh, self.stride)
+        dw /= 2
+        dh /= 2
+        
+        if shape[::-1] != new_unpad:
+            image = cv2.resize(image, new_unpad, interpolation=cv2.INTER_LINEAR)
+        
+        top, bottom = round(dh - 0.1), round(dh + 0.1)
+        left, right = round(dw - 0.1), round(dw + 0.1)
+        return cv2.copyMakeBorder(
+            image, top, bottom, left, right, cv2.BORDER_CONSTANT,
+            value=(PADDING_VALUE,) * 3
+        )
+    
+    def _postprocess(
+        self,
+        prediction: np.ndarray,
+        input_shape: Tuple[int, int],
+        image_shape: Tuple[int, int],
+        conf_threshold: float,
+        iou_threshold: float,
+        max_det: int,
+        names: Tuple[str, ...],
+        lut: np.ndarray
+    ) -> Detections:
+        """
+        Descodifica o output YOLOv8 de uma imagem: (4 + nc, N) com caixas
+        (cx, cy, w, h) e scores por classe, seguido de NMS por classe e
+        conversão para coordenadas da imagem original.
+        """
+        scores_all = prediction[4:]
+        conf = scores_all.max(axis=0)
+        keep = conf > conf_threshold
+        if not keep.any():
+            return Detections.empty(names)
+        
+        conf = conf[keep]
+        cls = scores_all[:, keep].argmax(axis=0)
+        cx, cy, w, h = prediction[:4, keep]
+        xyxy = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+        
+        if len(conf) > MAX_NMS:
+            top = np.argsort(-conf, kind="stable")[:MAX_NMS]
+            xyxy, conf, cls = xyxy[top], conf[top], cls[top]
+        
+        kept = nms(xyxy, conf, iou_threshold, cls)[:max_det]
+        xyxy, conf, cls = xyxy[kept], conf[kept], cls[kept]
+        
+        return Detections(
+            xyxy=_scale_boxes(input_shape, xyxy, image_shape),
+            conf=conf,
+            cls=lut[cls],
+            names=names
+        )
+
+
+def _scale_boxes(
+    input_shape: Tuple[int, int],
+    xyxy: np.ndarray,
+    image_shape: Tuple[int, int]
+) -> np.ndarray:
+    """Converte caixas do input do modelo para a imagem original (como o Ultralytics)."""
+    gain = min(input_shape[0] / image_shape[0], input_shape[1] / image_shape[1])
+    new_h, new_w = round(image_shape[0] * gain), round(image_shape[1] * gain)
+    gain_y, gain_x = new_h / image_shape[0], new_w / image_shape[1]
+    pad_x = round((input_shape[1] - new_w) / 2 - 0.1)
+    pad_y = round((input_shape[0] - new_h) / 2 - 0.1)
+    
+    xyxy = xyxy.copy()
+    xyxy[:, [0, 2]] = ((xyxy[:, [0, 2]] - pad_x) / gain_x).clip(0, image_shape[1])
+    xyxy[:, [1, 3]] = ((xyxy[:, [1, 3]] - pad_y) / gain_y).clip(0, image_shape[0])
+    return xyxy
@@ -0,0 +1,133 @@
+"""
+Medição de tempos por fase do pipeline de deteção.
+Cada imagem tem um dicionário {fase: ms} (ver `STAGES`); o `Profiler`
+junta os tempos de muitas imagens e calcula percentis por fase.
+"""
+
+import json
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Union
+import numpy as np
+
+
+# Fases do pipeline, pela ordem em que acontecem
+STAGES = (
+    "read",         # leitura do ficheiro (disco ou arquivo)
+    "decode",       # descodificação da imagem (PIL / tifffile)
+    "preprocess",   # letterbox e conversão para tensor
+    "inference",    # forward pass do modelo
+    "postprocess",  # NMS e conversão das caixas
+    "extract",      # cópia das caixas para arrays numpy
+    "annotate",     # desenho das deteções
+    "encode",       # codificação e escrita da imagem anotada (PNG)
+)
+
+
+@contextmanager
+def timed(timings: Dict[str, float], stage: str) -> Iterator[None]:
+    """
+    Soma a `timings[stage]` o tempo (em ms) do bloco `with`.
+    
+    Args:
+        timings: Dicionário {fase: ms} a atualizar
+        stage: Nome da fase
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + (time.perf_counter() - start) * 1000
+
+
+def add_timings(total: Dict[str, float], timings: Dict[str, float], scale: float = 1.0) -> Dict[str, float]:
+    """
+    Soma os tempos de `timings` (multiplicados por `scale`) a `total`.
+    
+    Returns:
+        O próprio `total` (atualizado)
+    """
+    for stage, ms in timings.items():
+        total[stage] = total.get(stage, 0.0) + ms * scale
+    return total
+
+
+class Profiler:
+    """
+    Junta os tempos por fase de várias imagens.
+    
+    Cada imagem contribui com um dicionário {fase: ms}; `summary` devolve
+    contagem, total, média, p50/p95/p99 e máximo de cada fase, e da soma
+    das fases por imagem ("total"). Pode ser juntado com outro `Profiler`
+    (ex: de processos worker).
+    """
+    
+    def __init__(self):
+        self.images: List[Dict[str, Any]] = []
+    
+    def add(self, timings: Dict[str, float], filename: Optional[str] = None) -> None:
+        """
+        Regista os tempos de uma imagem.
+        
+        Args:
+            timings: Dicionário {fase: ms}
+            filename: Nome da imagem (para o trace)
+        """
+        self.images.append({"filename": filename, "timings": dict(timings)})
+    
+    def merge(self, other: "Profiler") -> None:
+        """Junta os tempos de outro `Profiler`."""
+        self.images.extend(other.images)
+    
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        Estatísticas por fase (em ms), pela ordem de `STAGES`.
+        
+        Returns:
+            Dicionário {fase: {count, total_ms, mean_ms, p50_ms, p95_ms,
+            p99_ms, max_ms}}, com a entrada "total" no fim
+        """
+        samples: Dict[str, List[float]] = {}
+        totals = []
+        for image in self.images:
+            for stage, ms in image["timings"].items():
+                samples.setdefault(stage, []).append(ms)
+            totals.append(sum(image["timings"].values()))
+        
+        order = [s for s in STAGES if s in samples] + sorted(set(samples) - set(STAGES))
+        summary = {stage: _stats(samples[stage]) for stage in order}
+        if totals:
+            summary["total"] = _stats(totals)
+        return summary
+    
+    def write_trace(self, path: Union[str, Path], meta: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Guarda o resumo e os tempos de cada imagem em JSON.
+        
+        Args:
+            path: Ficheiro de destino
+            meta: Informação adicional (parâmetros da execução)
+        """
+        trace = {
+            "meta": meta or {},
+            "summary": self.summary(),
+            "images": self.images,
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(trace, f, indent=2)
+
+
+def _stats(values: List[float]) -> Dict[str, float]:
+    """Contagem, total, média, percentis e máximo de uma lista de tempos."""
+    array = np.asarray(values, dtype=np.float64)
+    p50, p95, p99 = np.percentile(array, [50, 95, 99])
+    return {
+        "count": int(array.size),
+        "total_ms": float(array.sum()),
+        "mean_ms": float(array.mean()),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "max_ms": float(array.max()),
+    }
@@ -0,0 +1,464 @@
+"""
+Quantização pós-treino do modelo para INT8 (ONNX Runtime, CPU).
+Cria models/best.int8.onnx a partir de models/best.pt, calibrado com
+imagens reais, e um relatório que compara as contagens por classe do
+modelo quantizado com as do modelo original. O motor "onnx-int8" só usa o
+modelo se o relatório estiver dentro da tolerância.
+
+Uso:
+    python -m src.quantize --calibration dataset.yaml
+    python -m src.quantize --calibration pasta_imagens --eval pasta_validacao
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+import numpy as np
+
+from src.infer import compare_engines, load_model
+from src.inputs import InputFile, read_input_bytes, scan_image_files
+from src.io_utils import decode_image
+from src.onnx_engine import OnnxEngine, export_onnx, int8_paths
+
+try:
+    from onnxruntime import quantization
+except ImportError:  # Opcional: só necessário para criar o modelo INT8
+    quantization = None
+
+
+# Tolerância por omissão: diferença máxima na contagem total de cada classe
+DEFAULT_TOLERANCE_PCT = 2.0
+
+# Erros por imagem admitidos por omissão (os totais podem compensar-se
+# entre imagens): diferença máxima de contagem de uma classe numa imagem e
+# percentagem máxima de imagens com contagens diferentes
+DEFAULT_MAX_IMAGE_ERROR = 3
+DEFAULT_MAX_MISMATCH_PCT = 25.0
+
+# Classes comparadas no relatório
+REPORT_CLASSES = ("RBC", "WBC", "Platelets")
+
+
+def resolve_image_dir(source: Union[str, Path], split: str = "train") -> Path:
+    """
+    Pasta de imagens de calibração ou avaliação.
+    
+    Args:
+        source: Pasta de imagens ou ficheiro de configuração do dataset
+            (formato de dataset_example.yaml: `path` + `train`/`val`/`test`)
+        split: Divisão do dataset a usar, se `source` for um .yaml
+    
+    Returns:
+        Caminho da pasta de imagens
+    """
+    source = Path(source)
+    if source.suffix.lower() not in (".yaml", ".yml"):
+        return source
+    
+    import yaml
+    
+    with open(source, "r", encoding="utf-8") as f:
+        # O exemplo tem um segundo documento só com comentários
+        config = next(yaml.safe_load_all(f))
+    if split not in config:
+        raise ValueError(f"{source} não define a divisão '{split}'")
+    
+    root = Path(config.get("path", source.parent))
+    if not root.is_absolute():
+        root = source.parent / root
+    return root / config[split]
+
+
+def sample_images(directory: Path, num_images: int) -> List[np.ndarray]:
+    """
+    Carrega até `num_images` imagens distribuídas por toda a pasta.
+    
+    Args:
+        directory: Pasta de imagens (pesquisada recursivamente)
+        num_images: Número máximo de imagens
+    
+    Returns:
+        Lista de imagens em formato numpy array
+    """
+    files: List[InputFile] = list(scan_image_files(directory, recursive=True))
+    if not files:
+        raise ValueError(f"Nenhuma imagem encontrada em: {directory}")
+    
+    # Amostra espaçada, para não calibrar só com as primeiras imagens
+    step = max(1, len(files) // num_images)
+    return [
+        decode_image(read_input_bytes(f))[0]
+        for f in files[::step][:num_images]
+    ]
+
+
+class CalibrationReader:
+    """
+    Fornece as imagens de calibração ao `quantize_static` do ONNX Runtime
+    (interface `CalibrationDataReader`), com o mesmo pré-processamento da
+    inferência.
+    """
+    
+    def __init__(self, engine: OnnxEngine, images: List[np.ndarray]):
+        """
+        Args:
+            engine: Modelo ONNX original (define o pré-processamento)
+            images: Imagens de calibração
+        """
+        self.engine = engine
+        self.images = images
+        self._index = 0
+    
+    def get_next(self) -> Optional[Dict[str, np.ndarray]]:
+        """Input da imagem seguinte, ou None no fim."""
+        if self._index >= len(self.images):
+            return None
+        image = self.images[self._index]
+        self._index += 1
+        return {self.engine.input_name: self.engine.preprocess([image])}
+    
+    def rewind(self) -> None:
+        """Recomeça do início."""
+        self._index = 0
+
+
+def head_nodes_to_exclude(onnx_path: Path) -> List[str]:
+    """
+    Nós da descodificação das caixas (cabeça Detect) a manter em float.
+    
+    As convoluções da cabeça são quantizadas, mas a DFL, a conversão para
+    coordenadas e o sigmoid das classes ficam em float: quantizar estas
+    operações desloca as caixas e altera os scores perto do limiar.
+    """
+    import onnx
+    
+    graph = onnx.load(str(onnx_path), load_external_data=False).graph
+    output = graph.output[0].name
+    producer = next(node for node in graph.node if output in node.output)
+    head = producer.name.rsplit("/", 1)[0] + "/"
+    
+    return [
+        node.name
+        for node in graph.node
+        if node.name.startswith(head)
+        and (node.op_type != "Conv" or "/dfl/" in node.name)
+    ]
+
+
+def quantize_model(
+    model_path: Union[str, Path],
+    calibration_images: List[np.ndarray]
+) -> Path:
+    """
+    Cria o modelo INT8 (quantização estática, formato QDQ) a partir do .pt.
+    
+    Os pesos são quantizados por canal (int8) e as ativações (uint8) com os
+    intervalos observados nas imagens de calibração. Os metadados do modelo
+    (nomes das classes, stride, imgsz) são copiados do modelo original.
+    
+    Args:
+        model_path: Caminho para o ficheiro .pt do modelo
+        calibration_images: Imagens de calibração
+    
+    Returns:
+        Caminho do ficheiro .int8.onnx
+    """
+    if quantization is None:
+        raise ImportError("A quantização requer o onnxruntime (pip install onnxruntime onnx)")
+    import onnx
+    
+    onnx_path = export_onnx(model_path)
+    int8_path, _ = int8_paths(model_path)
+    engine = OnnxEngine(onnx_path)
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Inferência de formas e otimizações recomendadas antes de quantizar
+        # (a inferência simbólica não suporta os eixos dinâmicos do YOLO)
+        prepared = Path(tmp_dir) / "prepared.onnx"
+        quantization.quant_pre_process(
+            str(onnx_path), str(prepared), skip_symbolic_shape=True
+        )
+        
+        quantization.quantize_static(
+            str(prepared),
+            str(int8_path),
+            CalibrationReader(engine, calibration_images),
+            quant_format=quantization.QuantFormat.QDQ,
+            per_channel=True,
+            activation_type=quantization.QuantType.QUInt8,
+            weight_type=quantization.QuantType.QInt8,
+            nodes_to_exclude=head_nodes_to_exclude(prepared),
+            calibrate_method=quantization.CalibrationMethod.MinMax
+        )
+    
+    original = onnx.load(str(onnx_path), load_external_data=False)
+    quantized = onnx.load(str(int8_path))
+    onnx.helper.set_model_props(
+        quantized, {prop.key: prop.value for prop in original.metadata_props}
+    )
+    onnx.save(quantized, str(int8_path))
+    return int8_path
+
+
+def count_report(
+    comparison: Dict[str, Any],
+    tolerance_pct: float = DEFAULT_TOLERANCE_PCT,
+    max_image_error: int = DEFAULT_MAX_IMAGE_ERROR,
+    max_mismatch_pct: float = DEFAULT_MAX_MISMATCH_PCT
+) -> Dict[str, Any]:
+    """
+    Resume a comparação de contagens por classe (RBC, WBC, Platelets).
+    
+    Os totais por classe não chegam: contagens a mais numa imagem e a menos
+    noutra anulam-se. Por isso o relatório também verifica o maior erro
+    numa só imagem e a fração de imagens com contagens diferentes.
+    
+    Args:
+        comparison: Resultado de `compare_engines` (referência = modelo
+            original, candidato = modelo INT8)
+        tolerance_pct: Diferença máxima admitida na contagem total de cada
+            classe, em percentagem
+        max_image_error: Diferença máxima admitida na contagem de uma
+            classe numa só imagem
+        max_mismatch_pct: Percentagem máxima de imagens com contagens
+            diferentes
+    
+    Returns:
+        Dicionário com, por classe, as contagens totais de cada modelo, a
+        diferença percentual e os erros absolutos (médio e máximo) por
+        imagem; `checks`, o resultado de cada verificação; e `passed`, se
+        todas as verificações passam
+    """
+    classes = {}
+    for class_name in REPORT_CLASSES:
+        reference = np.array([c["reference"][class_name] for c in comparison["per_image"]])
+        quantized = np.array([c["candidate"][class_name] for c in comparison["per_image"]])
+        ref_total, q_total = int(reference.sum()), int(quantized.sum())
+        classes[class_name] = {
+            "reference": ref_total,
+            "quantized": q_total,
+            "diff_pct": round(100.0 * (q_total - ref_total) / max(ref_total, 1), 2),
+            "mean_abs_error": round(float(np.abs(quantized - reference).mean()), 3),
+            "max_abs_error": int(np.abs(quantized - reference).max()),
+        }
+    
+    num_images = comparison["num_images"]
+    mismatch_pct = 100.0 * comparison["count_mismatches"] / max(num_images, 1)
+    checks = {
+        "total_diff": all(abs(c["diff_pct"]) <= tolerance_pct for c in classes.values()),
+        "image_error": all(c["max_abs_error"] <= max_image_error for c in classes.values()),
+        "mismatched_images": mismatch_pct <= max_mismatch_pct,
+    }
+    
+    return {
+        "num_images": num_images,
+        "images_with_different_counts": comparison["count_mismatches"],
+        "min_iou": round(comparison["min_iou"], 4),
+        "max_conf_diff": round(comparison["max_conf_diff"], 4),
+        "classes": classes,
+        "tolerance_pct": tolerance_pct,
+        "max_image_error": max_image_error,
+        "max_mismatch_pct": max_mismatch_pct,
+        "checks": checks,
+        "passed": all(checks.values()),
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    """Mostra o relatório de precisão no terminal."""
+    print(f"\n📊 Contagens por classe ({report['num_images']} imagens):")
+    print(
+        f"   {'Classe':>10}  {'original':>9}  {'INT8':>9}  {'dif.':>8}  "
+        f"{'EAM/img':>8}  {'máx/img':>8}"
+    )
+    for class_name, c in report["classes"].items():
+        print(
+            f"   {class_name:>10}  {c['reference']:>9}  {c['quantized']:>9}  "
+            f"{c['diff_pct']:>7.2f}%  {c['mean_abs_error']:>8.3f}  {c['max_abs_error']:>8}"
+        )
+    print(
+        f"   Imagens com contagens diferentes: "
+        f"{report['images_with_different_counts']}/{report['num_images']}"
+    )
+    sizes = report.get("size_mb")
+    if sizes:
+        print(f"   Tamanho: {sizes['reference']:.1f} MB → {sizes['quantized']:.1f} MB")
+    
+    print("\n🔎 Verificações:")
+    for check, message in (
+        ("total_diff", f"diferença no total de cada classe <= {report['tolerance_pct']}%"),
+        ("image_error", f"erro numa só imagem <= {report['max_image_error']} células por classe"),
+        ("mismatched_images", f"imagens com contagens diferentes <= {report['max_mismatch_pct']}%"),
+    ):
+        print(f"   {'✅' if report['checks'][check] else '❌'} {message}")
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse argumentos da linha de comandos."""
+    parser = argparse.ArgumentParser(
+        description="Quantização INT8 do modelo YOLO para inferência em CPU",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Exemplos:
+  python -m src.quantize --calibration dataset.yaml
+  python -m src.quantize --calibration imagens/ --eval validacao/ --tolerance 5
+        """
+    )
+    
+    parser.add_argument(
+        "--model", "-m",
+        type=str,
+        default="models/best.pt",
+        help="Caminho para o modelo YOLO (default: models/best.pt)"
+    )
+    
+    parser.add_argument(
+        "--calibration", "-c",
+        type=str,
+        required=True,
+        help="Pasta de imagens ou dataset .yaml (usa a divisão 'train')"
+    )
+    
+    parser.add_argument(
+        "--eval",
+        type=str,
+        default=None,
+        help="Pasta de imagens ou dataset .yaml para o relatório (default: divisão 'val' do .yaml, ou as imagens de calibração)"
+    )
+    
+    parser.add_argument(
+        "--num-calibration",
+        type=int,
+        default=100,
+        help="Número de imagens de calibração (default: 100)"
+    )
+    
+    parser.add_argument(
+        "--num-eval",
+        type=int,
+        default=200,
+        help="Número de imagens para o relatório (default: 200)"
+    )
+    
+    parser.add_argument(
+        "--conf",
+        type=float,
+        default=0.25,
+        help="Limiar de confiança para o relatório (default: 0.25)"
+    )
+    
+    parser.add_argument(
+        "--iou",
+        type=float,
+        default=0.45,
+        help="Limiar de IOU para NMS no relatório (default: 0.45)"
+    )
+    
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE_PCT,
+        help=f"Diferença máxima (%%) na contagem total de cada classe (default: {DEFAULT_TOLERANCE_PCT})"
+    )
+    
+    parser.add_argument(
+        "--max-image-error",
+        type=int,
+        default=DEFAULT_MAX_IMAGE_ERROR,
+        help=f"Diferença máxima na contagem de uma classe numa só imagem (default: {DEFAULT_MAX_IMAGE_ERROR})"
+    )
+    
+    parser.add_argument(
+        "--max-mismatch",
+        type=float,
+        default=DEFAULT_MAX_MISMATCH_PCT,
+        help=f"Percentagem máxima de imagens com contagens diferentes (default: {DEFAULT_MAX_MISMATCH_PCT})"
+    )
+    
+    return parser.parse_args()
+
+
+def _eval_source(args: argparse.Namespace) -> Tuple[Path, str]:
+    """Pasta de imagens do relatório e a sua descrição."""
+    if args.eval is not None:
+        return resolve_image_dir(args.eval, split="val"), args.eval
+    if Path(args.calibration).suffix.lower() in (".yaml", ".yml"):
+        try:
+            return resolve_image_dir(args.calibration, split="val"), f"{args.calibration} (val)"
+        except ValueError:
+            pass
+    return resolve_image_dir(args.calibration), args.calibration
+
+
+def main():
+    """Função principal."""
+    args = parse_args()
+    
+    model_path = Path(args.model)
+    if not model_path.exists():
+        print(f"❌ Erro: Modelo não encontrado: {model_path}")
+        sys.exit(1)
+    if quantization is None:
+        print("❌ Erro: A quantização requer o onnxruntime (pip install onnxruntime onnx)")
+        sys.exit(1)
+    
+    try:
+        calibration_dir = resolve_image_dir(args.calibration, split="train")
+        print(f"📁 Imagens de calibração: {calibration_dir}")
+        calibration_images = sample_images(calibration_dir, args.num_calibration)
+        eval_dir, eval_name = _eval_source(args)
+        eval_images = sample_images(eval_dir, args.num_eval)
+    except (OSError, ValueError) as e:
+        print(f"❌ Erro: {e}")
+        sys.exit(1)
+    
+    print(f"⚙️  A quantizar {model_path} com {len(calibration_images)} imagens de calibração...")
+    start_time = time.time()
+    int8_path = quantize_model(model_path, calibration_images)
+    print(f"✅ Modelo INT8 criado: {int8_path} ({time.time() - start_time:.1f}s)")
+    
+    print(f"🔬 A comparar com o modelo original em {len(eval_images)} imagens ({eval_name})...")
+    comparison = compare_engines(
+        load_model(str(model_path)),
+        OnnxEngine(int8_path),
+        eval_images,
+        conf_threshold=args.conf,
+        iou_threshold=args.iou
+    )
+    report = count_report(
+        comparison,
+        tolerance_pct=args.tolerance,
+        max_image_error=args.max_image_error,
+        max_mismatch_pct=args.max_mismatch
+    )
+    report.update({
+        "model": str(model_path),
+        "quantized": str(int8_path),
+        "created": time.time(),
+        "calibration": {"source": args.calibration, "num_images": len(calibration_images)},
+        "evaluation": {"source": eval_name, "conf": args.conf, "iou": args.iou},
+        "size_mb": {
+            "reference": export_onnx(model_path).stat().st_size / 1e6,
+            "quantized": int8_path.stat().st_size / 1e6,
+        },
+    })
+    
+    _, report_path = int8_paths(model_path)
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    
+    print_report(report)
+    print(f"\n💾 Relatório: {report_path}")
+    
+    if not report["passed"]:
+        print("❌ As contagens excedem a tolerância: o motor onnx-int8 não vai usar este modelo")
+        sys.exit(1)
+    print("✅ Dentro da tolerância: usar com --engine onnx-int8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+"""
+Escrita incremental de resultados do processamento batch.
+As linhas por imagem e por deteção são escritas em CSV ou Parquet à medida
+que as imagens são concluídas, pelo que a memória usada não depende do
+número de imagens.
+"""
+
+import csv
+import io
+import os
+from pathlib import Path
+from typing import Any, Collection, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from src.detections import Detections
+from src.manifest import RunManifest, append_line
+
+
+# Formatos de output suportados
+OUTPUT_FORMATS = ("csv", "parquet")
+
+# Colunas da tabela por imagem
+RESULT_FIELDS = [
+    "filename", "RBC", "WBC", "Platelets", "Total",
+    "RBC_pct", "WBC_pct", "Platelets_pct"
+]
+
+# Colunas da tabela por deteção
+DETECTION_FIELDS = ["filename", "class", "confidence", "x1", "y1", "x2", "y2"]
+
+
+def result_to_row(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Converte um resultado numa linha do CSV."""
+    return {
+        "filename": result["filename"],
+        "RBC": result["counts"]["RBC"],
+        "WBC": result["counts"]["WBC"],
+        "Platelets": result["counts"]["Platelets"],
+        "Total": sum(result["counts"].values()),
+        "RBC_pct": result["percentages"]["RBC"],
+        "WBC_pct": result["percentages"]["WBC"],
+        "Platelets_pct": result["percentages"]["Platelets"],
+    }
+
+
+def detections_to_columns(filename: str, detections: Detections) -> Dict[str, List[Any]]:
+    """
+    Converte as deteções de uma imagem em colunas da tabela por deteção.
+    
+    Args:
+        filename: Nome da imagem
+        detections: Deteções da imagem
+    
+    Returns:
+        Dicionário {coluna: valores}
+    """
+    x1, y1, x2, y2 = detections.xyxy.T.tolist() if len(detections) else ([], [], [], [])
+    return {
+        "filename": [filename] * len(detections),
+        "class": detections.class_names(),
+        "confidence": detections.conf.tolist(),
+        "x1": x1,
+        "y1": y1,
+        "x2": x2,
+        "y2": y2,
+    }
+
+
+class TableWriter:
+    """
+    Tabela escrita de forma incremental, em CSV ou Parquet.
+    
+    Em CSV, cada bloco de linhas é acrescentado com uma única escrita em
+    modo append. Em Parquet, cada bloco é escrito como um ficheiro
+    `part-NNNNNNNN.parquet` numa pasta com o nome da tabela, que se lê de
+    uma vez com `pandas.read_parquet(pasta)`. Os parts são numerados pela
+    ordem de escrita (continuando a numeração ao retomar), pelo que a
+    ordem dos nomes é a ordem das linhas.
+    
+    As linhas ficam pela ordem em que os blocos são escritos: a ordem do
+    input (ver `ResultSink`). Numa execução retomada (--resume), as linhas
+    novas vêm depois das já escritas; uma imagem que falhou antes e é
+    processada ao retomar fica, por isso, no fim da tabela.
+    """
+    
+    def __init__(
+        self,
+        output_dir: Union[str, Path],
+        name: str,
+        fields: List[str],
+        output_format: str = "csv"
+    ):
+        """
+        Args:
+            output_dir: Pasta de resultados
+            name: Nome da tabela (ex: "results")
+            fields: Colunas da tabela
+            output_format: "csv" ou "parquet"
+        """
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Formato inválido: {output_format} (opções: {OUTPUT_FORMATS})")
+        if output_format == "parquet":
+            # Importado só com --format parquet (o pyarrow é pesado)
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:  # Opcional: resultados em Parquet
+                raise ImportError("O formato parquet requer o pyarrow (pip install pyarrow)")
+        
+        self.fields = fields
+        self.output_format = output_format
+        if output_format == "csv":
+            self.path = Path(output_dir) / f"{name}.csv"
+        else:
+            self.path = Path(output_dir) / name
+        self._next_part: Optional[int] = None
+    
+    def start(self, resume: bool = False, committed: Optional[Collection[str]] = None) -> bool:
+        """
+        Cria a tabela vazia (ou mantém a existente, com `resume`).
+        
+        As linhas são escritas antes de as imagens serem registadas no
+        manifesto (ver `ResultSink`): se a execução foi interrompida entre
+        as duas escritas, ficam linhas de imagens que vão ser processadas
+        de novo. Com `committed`, essas linhas são removidas ao retomar,
+        para não ficarem repetidas.
+        
+        Args:
+            resume: Se True, mantém as linhas já escritas
+            committed: Imagens registadas no manifesto (só com `resume`):
+                as linhas das outras imagens são removidas
+        
+        Returns:
+            True se a tabela foi criada de novo (sem linhas)
+        """
+        if self.output_format == "parquet":
+            self.path.mkdir(parents=True, exist_ok=True)
+            parts = sorted(self.path.glob("part-*.parquet"))
+            if resume and committed is not None:
+                parts = self._drop_uncommitted_parts(parts, set(committed))
+            if resume and parts:
+                return False
+            for part in parts:
+                part.unlink()
+            return True
+        
+        # Uma última linha incompleta (execução interrompida a meio da
+        # escrita) é cortada: essas imagens não chegaram ao manifesto e são
+        # processadas de novo
+        if resume and self.path.exists() and _drop_partial_line(self.path) > 0:
+            if committed is None or self._drop_uncommitted_rows(set(committed)) > 0:
+                return False
+            return True
+        with open(self.path, "w", encoding="utf-8", newline="") as f:
+            csv.DictWriter(f, fieldnames=self.fields, lineterminator="\n").writeheader()
+        return True
+    
+    def _drop_uncommitted_rows(self, committed: Set[str]) -> int:
+        """
+        Remove do CSV as linhas de imagens fora de `committed`.
+        
+        O ficheiro só é reescrito (num temporário, depois renomeado) se
+        houver linhas a remover.
+        
+        Returns:
+            Número de linhas que ficam na tabela
+        """
+        with open(self.path, "r", encoding="utf-8", newline="") as f:
+            reader = csv.reader(f)
+            column = next(reader).index("filename")
+            num_rows = num_kept = 0
+            for row in reader:
+                num_rows += 1
+                num_kept += row[column] in committed
+        if num_kept == num_rows:
+            return num_kept
+        
+        tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        with open(self.path, "r", encoding="utf-8", newline="") as src, \
+                open(tmp_path, "w", encoding="utf-8", newline="") as dst:
+            reader = csv.reader(src)
+            writer = csv.writer(dst, lineterminator="\n")
+            writer.writerow(next(reader))
+            writer.writerows(row for row in reader if row[column] in committed)
+        os.replace(tmp_path, self.path)
+        return num_kept
+    
+    def _drop_uncommitted_parts(self, parts: List[Path], committed: Set[str]) -> List[Path]:
+        """
+        Remove dos parts Parquet as linhas de imagens fora de `committed`.
+        
+        Os blocos são registados no manifesto pela ordem de escrita, por
+        isso só os últimos parts podem ter essas linhas: os parts são
+        verificados do fim para o início, até ao primeiro sem linhas a
+        remover.
+        
+        Returns:
+            Parts que ficam na tabela, por ordem
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        
+        kept = list(parts)
+        for part in reversed(parts):
+            filenames = pq.read_table(part, columns=["filename"]).column("filename").to_pylist()
+            mask = [filename in committed for filename in filenames]
+            if all(mask):
+                break
+            if any(mask):
+                tmp_path = part.with_name(f".{part.name}.tmp")
+                pq.write_table(pq.read_table(part).filter(pa.array(mask)), tmp_path)
+                os.replace(tmp_path, part)
+            else:
+                part.unlink()
+                kept.remove(part)
+        return kept
+    
+    def write(self, columns: Dict[str, List[Any]]) -> None:
+        """
+        Acrescenta um bloco de linhas.
+        
+        Args:
+            columns: Dicionário {coluna: valores}, com todas as colunas
+        """
+        num_rows = len(columns[self.fields[0]])
+        if num_rows == 0:
+            return
+        
+        if self.output_format == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            
+            if self._next_part is None:
+                # Continuar a numeração dos parts já escritos (--resume)
+                numbers = [
+                    int(part.stem[len("part-"):]) for part in self.path.glob("part-*.parquet")
+                    if part.stem[len("part-"):].isdigit()
+                ]
+                self._next_part = max(numbers, default=-1) + 1
+            
+            # Escrever com outro nome e renomear: um ficheiro part-* está
+            # sempre completo, mesmo que o processo seja interrompido
+            name = f"part-{self._next_part:08d}.parquet"
+            tmp_path = self.path / f".{name}.tmp"
+            pq.write_table(pa.table({field: columns[field] for field in self.fields}), tmp_path)
+            os.replace(tmp_path, self.path / name)
+            self._next_part += 1
+            return
+        
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator="\n")
+        writer.writerows(zip(*(columns[field] for field in self.fields)))
+        append_line(self.path, buf.getvalue())
+
+
+def _drop_partial_line(path: Path, chunk_size: int = 1 << 16) -> int:
+    """
+    Corta o fim de um ficheiro de texto depois da última quebra de linha.
+    
+    Só o fim do ficheiro é lido.
+    
+    Returns:
+        Tamanho do ficheiro depois do corte
+    """
+    with open(path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        if end == 0:
+            return 0
+        f.seek(end - 1)
+        if f.read(1) == b"\n":
+            return end
+        
+        position = end
+        while position > 0:
+            start = max(0, position - chunk_size)
+            f.seek(start)
+            newline = f.read(position - start).rfind(b"\n")
+            if newline >= 0:
+                f.truncate(start + newline + 1)
+                return start + newline + 1
+            position = start
+        f.truncate(0)
+        return 0
+
+
+def rows_to_columns(rows: Iterable[Dict[str, Any]], fields: List[str]) -> Dict[str, List[Any]]:
+    """Converte linhas (dicionários) em colunas."""
+    columns = {field: [] for field in fields}
+    for row in rows:
+        for field in fields:
+            columns[field].append(row[field])
+    return columns
+
+
+class ResultBuffer:
+    """
+    Guarda em memória os resultados de um shard processado num worker.
+    
+    Os workers não escrevem nas tabelas: o processo principal recebe os
+    resultados de cada shard, pela ordem em que os shards foram enviados,
+    e escreve-os num `ResultSink`, pelo que as tabelas ficam pela ordem do
+    input qualquer que seja o número de workers.
+    """
+    
+    def __init__(self, keep_detections: bool = False):
+        """
+        Args:
+            keep_detections: Se True, guarda também as deteções (para a
+                tabela por deteção)
+        """
+        self.keys = ("filename", "counts", "percentages")
+        if keep_detections:
+            self.keys += ("detections",)
+        self.items: List[Tuple[Dict[str, Any], Union[str, Path]]] = []
+    
+    def add(self, result: Dict[str, Any], path: Union[str, Path]) -> None:
+        """Guarda o resultado de uma imagem concluída (ver `ResultSink.add`)."""
+        self.items.append(({key: result[key] for key in self.keys}, path))
+    
+    def flush(self) -> None:
+        """Nada a escrever: os resultados seguem para o processo principal."""
+
+
+class ResultSink:
+    """
+    Destino dos resultados das imagens concluídas.
+    
+    Só o processo principal escreve num `ResultSink` (os workers usam um
+    `ResultBuffer`), por isso as linhas ficam pela ordem em que as imagens
+    são entregues, que é a ordem do input.
+    
+    Junta as linhas por imagem e por deteção em memória e escreve-as em
+    blocos de `flush_every` imagens. Só depois de um bloco estar escrito é
+    que as suas imagens são registadas no manifesto, pelo que uma imagem
+    marcada como concluída tem sempre as suas linhas nas tabelas; linhas
+    de imagens que não chegaram ao manifesto são removidas ao retomar
+    (ver `TableWriter.start`).
+    """
+    
+    def __init__(
+        self,
+        manifest: RunManifest,
+        results_table: Optional[TableWriter] = None,
+        detections_table: Optional[TableWriter] = None,
+        flush_every: int = 1
+    ):
+        """
+        Args:
+            manifest: Manifesto da execução
+            results_table: Tabela por imagem (opcional)
+            detections_table: Tabela por deteção (opcional)
+            flush_every: Número de imagens por bloco escrito
+        """
+        self.manifest = manifest
+        self.results_table = results_table
+        self.detections_table = detections_table
+        self.flush_every = max(1, flush_every)
+        self._pending = []
+        self._detections = {field: [] for field in DETECTION_FIELDS}
+    
+    def add(self, result: Dict[str, Any], path: Union[str, Path]) -> None:
+        """
+        Regista uma imagem concluída.
+        
+        Args:
+            result: Resultado da imagem (filename, counts, percentages e,
+                se houver tabela por deteção, detections)
+            path: Caminho do ficheiro da imagem
+        """
+        if self.detections_table is not None:
+            columns = detections_to_columns(result["filename"], result["detections"])
+            for field, values in columns.items():
+                self._detections[field].extend(values)
+        
+        self._pending.append((
+            {key: result[key] for key in ("filename", "counts", "percentages")},
+            path
+        ))
+        if len(self._pending) >= self.flush_every:
+            self.flush()
+    
+    def flush(self) -> None:
+        """Escreve as linhas em memória e regista as imagens no manifesto."""
+        if not self._pending:
+            return
+        
+        if self.results_table is not None:
+            self.results_table.write(rows_to_columns(
+                (result_to_row(result) for result, _ in self._pending), RESULT_FIELDS
+            ))
+        if self.detections_table is not None:
+            self.detections_table.write(self._detections)
+            self._detections = {field: [] for field in DETECTION_FIELDS}
+        
+        for result, path in self._pending:
+            self.manifest.append(result, path)
+        self._pending = []
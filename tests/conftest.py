@@ -0,0 +1,10 @@
+"""
+Configuração comum dos testes (pytest).
+Execute: python -m pytest tests
+"""
+
+import sys
+from pathlib import Path
+
+# Permitir `import src...` a partir da raiz do projeto
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
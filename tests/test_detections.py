@@ -0,0 +1,150 @@
+"""
+Testes do NMS e da refiltragem de deteções (`src.detections`).
+"""
+
+import numpy as np
+import pytest
+
+from src import detections as detections_module
+from src.detections import Detections, apply_thresholds, nms
+from src.infer import RAW_CONF_THRESHOLD, RAW_IOU_THRESHOLD
+
+
+def random_boxes(n: int, seed: int, num_classes: int = 3):
+    """Caixas aleatórias com muitas sobreposições (células e duplicados)."""
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(0, 600, (n, 2))
+    sizes = rng.uniform(8, 60, (n, 2))
+    xyxy = np.concatenate([centers - sizes / 2, centers + sizes / 2], axis=1).astype(np.float32)
+    scores = rng.permutation(n).astype(np.float32) / n + 0.5 / n
+    classes = rng.integers(0, num_classes, n)
+    return xyxy, scores, classes
+
+
+def reference_nms(xyxy, scores, iou_threshold, classes=None):
+    """NMS greedy direto (O(n²)), como referência."""
+    order = np.argsort(-scores, kind="stable")
+    keep = []
+    for i in order:
+        suppressed = False
+        for j in keep:
+            if classes is not None and classes[i] != classes[j]:
+                continue
+            x1 = max(xyxy[i, 0], xyxy[j, 0])
+            y1 = max(xyxy[i, 1], xyxy[j, 1])
+            x2 = min(xyxy[i, 2], xyxy[j, 2])
+            y2 = min(xyxy[i, 3], xyxy[j, 3])
+            inter = max(x2 - x1, 0) * max(y2 - y1, 0)
+            area_i = (xyxy[i, 2] - xyxy[i, 0]) * (xyxy[i, 3] - xyxy[i, 1])
+            area_j = (xyxy[j, 2] - xyxy[j, 0]) * (xyxy[j, 3] - xyxy[j, 1])
+            if inter / (area_i + area_j - inter) > iou_threshold:
+                suppressed = True
+                break
+        if not suppressed:
+            keep.append(i)
+    return np.array(keep, dtype=np.int64)
+
+
+@pytest.mark.parametrize("iou_threshold", [0.1, 0.45, 0.9])
+@pytest.mark.parametrize("per_class", [False, True])
+def test_nms_matches_reference(iou_threshold, per_class):
+    xyxy, scores, classes = random_boxes(400, seed=1)
+    classes = classes if per_class else None
+    np.testing.assert_array_equal(
+        nms(xyxy, scores, iou_threshold, classes),
+        reference_nms(xyxy, scores, iou_threshold, classes)
+    )
+
+
+def test_nms_is_independent_of_chunk_size(monkeypatch):
+    """Os pares avaliados em blocos pequenos dão o mesmo resultado."""
+    xyxy, scores, classes = random_boxes(500, seed=2)
+    expected = nms(xyxy, scores, 0.45, classes)
+    monkeypatch.setattr(detections_module, "NMS_CHUNK_PAIRS", 7)
+    np.testing.assert_array_equal(nms(xyxy, scores, 0.45, classes), expected)
+
+
+@pytest.mark.parametrize("iou_threshold", [0.1, 0.45, 0.9])
+def test_nms_matches_torchvision(iou_threshold):
+    torch = pytest.importorskip("torch")
+    ops = pytest.importorskip("torchvision.ops")
+    xyxy, scores, classes = random_boxes(3000, seed=3)
+    boxes, confidences = torch.from_numpy(xyxy), torch.from_numpy(scores)
+    
+    np.testing.assert_array_equal(
+        nms(xyxy, scores, iou_threshold),
+        ops.nms(boxes, confidences, iou_threshold).numpy()
+    )
+    np.testing.assert_array_equal(
+        nms(xyxy, scores, iou_threshold, classes),
+        ops.batched_nms(boxes, confidences, torch.from_numpy(classes), iou_threshold).numpy()
+    )
+
+
+def test_nms_edge_cases():
+    empty = np.zeros((0, 4), dtype=np.float32)
+    assert len(nms(empty, np.zeros(0, dtype=np.float32), 0.5)) == 0
+    
+    # Sem sobreposições: ficam todas, por ordem de confiança
+    xyxy = np.array([[0, 0, 10, 10], [20, 0, 30, 10], [40, 0, 50, 10]], dtype=np.float32)
+    scores = np.array([0.2, 0.9, 0.5], dtype=np.float32)
+    np.testing.assert_array_equal(nms(xyxy, scores, 0.5), [1, 2, 0])
+    
+    # Caixas iguais: fica a mais confiante (de cada classe, com `classes`)
+    xyxy = np.array([[0, 0, 10, 10]] * 3, dtype=np.float32)
+    np.testing.assert_array_equal(nms(xyxy, scores, 0.5), [1])
+    np.testing.assert_array_equal(nms(xyxy, scores, 0.5, np.array([0, 1, 0])), [1, 2])
+
+
+def clustered_detections(seed: int) -> Detections:
+    """
+    Candidatos como os de um modelo: várias caixas quase iguais por célula
+    (IOU acima de 0.45 entre si), de uma ou duas classes, e células
+    separadas umas das outras.
+    """
+    rng = np.random.default_rng(seed)
+    xyxy, conf, cls = [], [], []
+    for row in range(8):
+        for col in range(8):
+            x0, y0 = col * 100 + 20, row * 100 + 20
+            for label in rng.choice(3, rng.integers(1, 3), replace=False):
+                for _ in range(rng.integers(1, 6)):
+                    jitter = rng.uniform(-2, 2, 4)
+                    xyxy.append([x0, y0, x0 + 40, y0 + 40] + jitter)
+                    conf.append(rng.uniform(0.01, 1.0))
+                    cls.append(label)
+    return Detections(np.array(xyxy), np.array(conf), np.array(cls))
+
+
+@pytest.mark.parametrize("conf_threshold,iou_threshold", [(0.25, 0.45), (0.5, 0.3), (0.05, 0.9)])
+def test_refilter_raw_candidates_matches_direct_thresholds(conf_threshold, iou_threshold):
+    """
+    Guardar candidatos com os limiares permissivos (RAW_*) e refiltrar dá o
+    mesmo que aplicar os limiares finais diretamente.
+    """
+    candidates = clustered_detections(seed=4)
+    raw = apply_thresholds(candidates, RAW_CONF_THRESHOLD, RAW_IOU_THRESHOLD)
+    direct = apply_thresholds(candidates, conf_threshold, iou_threshold)
+    refiltered = apply_thresholds(raw, conf_threshold, iou_threshold)
+    
+    np.testing.assert_array_equal(refiltered.xyxy, direct.xyxy)
+    np.testing.assert_array_equal(refiltered.conf, direct.conf)
+    np.testing.assert_array_equal(refiltered.cls, direct.cls)
+    assert refiltered.counts() == direct.counts()
+
+
+def test_apply_thresholds_filters_and_is_idempotent():
+    xyxy, scores, classes = random_boxes(300, seed=5)
+    detections = Detections(xyxy, scores, classes)
+    
+    filtered = apply_thresholds(detections, 0.25, 0.45)
+    assert (filtered.conf > 0.25).all()
+    assert (np.diff(filtered.conf) <= 0).all()
+    
+    again = apply_thresholds(filtered, 0.25, 0.45)
+    np.testing.assert_array_equal(again.xyxy, filtered.xyxy)
+    np.testing.assert_array_equal(again.cls, filtered.cls)
+    
+    # Uma deteção com confiança igual ao limiar não passa (como no Ultralytics)
+    at_threshold = Detections(np.array([[0, 0, 10, 10]]), np.array([0.25]), np.array([0]))
+    assert len(apply_thresholds(at_threshold, 0.25, 0.45)) == 0
@@ -0,0 +1,84 @@
+"""
+Testes da grelha de tiles e da inferência por tiles (`src.infer`).
+"""
+
+import numpy as np
+import pytest
+
+from src import infer
+from src.detections import Detections
+from src.infer import make_tile_grid, min_tile_overlap, run_inference_tiled, tile_stride
+
+
+@pytest.mark.parametrize("width,height,tile_size,overlap", [
+    (1000, 700, 256, 0.5),
+    (2000, 1500, 640, 0.2),
+    (640, 640, 640, 0.2),
+    (641, 300, 640, 0.2),
+    (300, 200, 640, 0.2),
+])
+def test_tile_grid_covers_image(width, height, tile_size, overlap):
+    tiles = make_tile_grid(width, height, tile_size, overlap)
+    covered = np.zeros((height, width), dtype=bool)
+    for x0, y0, x1, y1 in tiles:
+        assert 0 <= x0 < x1 <= width and 0 <= y0 < y1 <= height
+        # Todos os tiles têm o lado completo (exceto em imagens menores)
+        assert x1 - x0 == min(tile_size, width)
+        assert y1 - y0 == min(tile_size, height)
+        covered[y0:y1, x0:x1] = True
+    assert covered.all()
+    assert len(set(tiles)) == len(tiles)
+
+
+def test_tile_grid_overlap_between_neighbours():
+    """Tiles vizinhos sobrepõem-se pelo menos tile_size - stride pixels."""
+    tile_size, overlap = 256, 0.3
+    min_overlap = tile_size - tile_stride(tile_size, overlap)
+    starts = sorted({x0 for x0, _, _, _ in make_tile_grid(1500, 256, tile_size, overlap)})
+    assert starts[0] == 0 and starts[-1] == 1500 - tile_size
+    for previous, current in zip(starts, starts[1:]):
+        assert 0 < current - previous <= tile_size - min_overlap
+
+
+def test_tiled_inference_rejects_small_overlap():
+    """Sem sobreposição suficiente, objetos nas fronteiras não seriam contados."""
+    image = np.zeros((1000, 1000, 3), dtype=np.uint8)
+    with pytest.raises(ValueError, match="sobreposição"):
+        run_inference_tiled(None, image, tile_size=640, overlap=0.0)
+    with pytest.raises(ValueError, match="sobreposição"):
+        run_inference_tiled(None, image, tile_size=256, overlap=0.2, max_object_size=60)
+    assert 256 - tile_stride(256, 0.25) >= min_tile_overlap(60)
+
+
+def fake_predict(model, images, conf_threshold, iou_threshold, max_det, timings=None):
+    """Modelo falso: deteta cada quadrado branco do crop (cortado pela borda do crop)."""
+    import cv2
+    
+    results = []
+    for image in images:
+        _, _, stats, _ = cv2.connectedComponentsWithStats((image[..., 0] > 0).astype(np.uint8))
+        x, y, w, h = stats[1:, :4].T.astype(np.float32)
+        xyxy = np.stack([x, y, x + w, y + h], axis=1)
+        results.append(Detections(xyxy, np.full(len(xyxy), 0.9), np.zeros(len(xyxy))))
+    return results
+
+
+def test_tiled_inference_counts_cells_on_seams_once(monkeypatch):
+    """Células sobre as fronteiras entre tiles são contadas uma única vez."""
+    pytest.importorskip("cv2")
+    monkeypatch.setattr(infer, "_predict_arrays", fake_predict)
+    
+    image = np.zeros((800, 1000, 3), dtype=np.uint8)
+    expected = []
+    for y0 in range(10, 800 - 40, 70):
+        for x0 in range(10, 1000 - 40, 70):
+            image[y0:y0 + 40, x0:x0 + 40] = 255
+            expected.append([x0, y0, x0 + 40, y0 + 40])
+    
+    result = run_inference_tiled(
+        None, image, tile_size=256, overlap=0.25, batch_size=4, max_object_size=40
+    )
+    found = result["detections"].xyxy
+    assert len(found) == len(expected)
+    order = np.lexsort((found[:, 0], found[:, 1]))
+    np.testing.assert_array_equal(found[order], np.array(expected, dtype=np.float32))
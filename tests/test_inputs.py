@@ -0,0 +1,93 @@
+"""
+Testes dos nomes e da leitura de membros de arquivos (`src.inputs`).
+"""
+
+import io
+import tarfile
+import zipfile
+
+import pytest
+
+from src import inputs
+from src.inputs import is_compressed_tar, iter_archive_members, read_input_bytes, safe_member_name
+
+
+@pytest.mark.parametrize("member,expected", [
+    ("a.jpg", "a.jpg"),
+    ("pasta/sub/a.jpg", "pasta/sub/a.jpg"),
+    ("./pasta/./a.jpg", "pasta/a.jpg"),
+    ("/etc/a.jpg", "etc/a.jpg"),
+    ("../../a.jpg", "a.jpg"),
+    ("pasta/../../a.jpg", "pasta/a.jpg"),
+    ("pasta\\sub\\a.jpg", "pasta/sub/a.jpg"),
+    ("C:\\..\\a.jpg", "C:/a.jpg"),
+    ("pasta//a.jpg", "pasta/a.jpg"),
+    ("__MACOSX/pasta/._a.jpg", ""),
+    ("pasta/.DS_Store", ""),
+    (".oculta/a.jpg", ""),
+    ("..", ""),
+])
+def test_safe_member_name(member, expected):
+    assert safe_member_name(member) == expected
+
+
+def test_safe_member_name_never_leaves_output_dir():
+    for member in ("../x.jpg", "/../../x.jpg", "a/../../../x.jpg", "..\\..\\x.jpg"):
+        name = safe_member_name(member)
+        assert not name.startswith("/")
+        assert ".." not in name.split("/")
+
+
+@pytest.mark.parametrize("archive_format", ["zip", "tar"])
+def test_archive_members_are_normalized(tmp_path, archive_format):
+    members = ["../fora.jpg", "/abs/b.png", "pasta/c.jpeg", "__MACOSX/pasta/._c.jpeg", "notas.txt"]
+    path = tmp_path / f"imagens.{archive_format}"
+    if archive_format == "zip":
+        with zipfile.ZipFile(path, "w") as zf:
+            for member in members:
+                zf.writestr(member, b"x")
+    else:
+        with tarfile.open(path, "w") as tf:
+            for member in members:
+                info = tarfile.TarInfo(member)
+                info.size = 1
+                tf.addfile(info, io.BytesIO(b"x"))
+    
+    found = [(f.member, f.name) for f in iter_archive_members(path)]
+    assert found == [
+        ("../fora.jpg", "fora.jpg"),
+        ("/abs/b.png", "abs/b.png"),
+        ("pasta/c.jpeg", "pasta/c.jpeg"),
+    ]
+
+
+def test_compressed_tar_is_read_forward(tmp_path, monkeypatch):
+    """Pela ordem do arquivo, um TAR comprimido é aberto (e descomprimido) uma vez."""
+    path = tmp_path / "imagens.tar.gz"
+    with tarfile.open(path, "w:gz") as tf:
+        for i in range(5):
+            info = tarfile.TarInfo(f"img{i}.jpg")
+            info.size = 3
+            tf.addfile(info, io.BytesIO(f"im{i}".encode()))
+    plain = tmp_path / "imagens.tar"
+    with tarfile.open(plain, "w"):
+        pass
+    assert is_compressed_tar(path) and not is_compressed_tar(plain)
+    
+    opened = []
+    real_open = tarfile.open
+    
+    def counting_open(*args, **kwargs):
+        opened.append(args[0])
+        return real_open(*args, **kwargs)
+    
+    monkeypatch.setattr(inputs.tarfile, "open", counting_open)
+    files = list(iter_archive_members(path))
+    opened.clear()
+    
+    assert [read_input_bytes(f) for f in files] == [f"im{i}".encode() for i in range(5)]
+    assert len(opened) == 1
+    
+    # Um membro que já ficou para trás obriga a recomeçar
+    assert read_input_bytes(files[1]) == b"im1"
+    assert len(opened) == 2
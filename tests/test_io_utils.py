@@ -0,0 +1,44 @@
+"""
+Testes das fontes de imagem lidas por regiões (`src.io_utils`).
+"""
+
+import numpy as np
+import pytest
+
+from src.io_utils import open_image_source
+
+tifffile = pytest.importorskip("tifffile")
+
+
+@pytest.fixture
+def rgb_image() -> np.ndarray:
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, (300, 400, 3), dtype=np.uint8)
+
+
+@pytest.mark.parametrize("options", [
+    {},
+    {"compression": "zlib", "rowsperstrip": 32},
+    {"compression": "zlib", "tile": (128, 128)},
+], ids=["memmap", "strips", "tiles"])
+@pytest.mark.parametrize("planarconfig", ["contig", "separate"])
+def test_tiff_source_reads_regions(tmp_path, rgb_image, options, planarconfig):
+    """Regiões e imagem inteira saem (altura, largura, 3) em qualquer layout."""
+    data = rgb_image if planarconfig == "contig" else rgb_image.transpose(2, 0, 1)
+    path = tmp_path / "image.tif"
+    tifffile.imwrite(path, data, photometric="rgb", planarconfig=planarconfig, **options)
+    
+    with open_image_source(path) as source:
+        assert (source.width, source.height) == (400, 300)
+        np.testing.assert_array_equal(source.read_region(10, 20, 310, 220), rgb_image[20:220, 10:310])
+        np.testing.assert_array_equal(source.to_array(), rgb_image)
+        assert source.read_downsampled(100).shape == (75, 100, 3)
+
+
+def test_tiff_source_reads_grayscale(tmp_path, rgb_image):
+    gray = rgb_image[..., 0]
+    path = tmp_path / "gray.tif"
+    tifffile.imwrite(path, gray, compression="zlib", rowsperstrip=32)
+    
+    with open_image_source(path) as source:
+        np.testing.assert_array_equal(source.to_array(), np.repeat(gray[..., None], 3, axis=-1))
@@ -0,0 +1,132 @@
+"""
+Testes da fila de trabalhos em SQLite (`src.jobs`).
+"""
+
+import sqlite3
+
+import numpy as np
+import pytest
+
+from src import jobs
+from src.detections import Detections
+from src.jobs import CANCELLED, DONE, QUEUED, RUNNING, JobQueue
+
+
+@pytest.fixture
+def queue(tmp_path) -> JobQueue:
+    return JobQueue(tmp_path / "jobs.sqlite")
+
+
+def make_files(prefix: str, n: int):
+    return [(f"{prefix}{i}.jpg", f"{prefix}{i}".encode()) for i in range(n)]
+
+
+def make_detections(n: int) -> Detections:
+    return Detections(np.tile([[0, 0, 10, 10]], (n, 1)), np.full(n, 0.9), np.zeros(n))
+
+
+def test_claim_serves_sessions_in_turn(queue):
+    """Uma sessão com muitas imagens não atrasa as outras sessões."""
+    job_a1 = queue.submit("a", make_files("a", 4))
+    job_a2 = queue.submit("a", make_files("x", 2))
+    job_b = queue.submit("b", make_files("b", 2))
+    
+    claimed = [queue.claim(2)[0] for _ in range(4)]
+    assert claimed == [job_a1, job_b, job_a1, job_a2]
+    assert queue.claim(2) is None
+
+
+def test_claim_returns_tasks_in_order(queue):
+    job_id = queue.submit("a", make_files("a", 5))
+    
+    claimed_job, tasks = queue.claim(3)
+    assert claimed_job == job_id
+    assert tasks == [(0, "a0.jpg", b"a0"), (1, "a1.jpg", b"a1"), (2, "a2.jpg", b"a2")]
+    assert queue.status(job_id)["status"] == RUNNING
+    
+    # As imagens reservadas não voltam a ser entregues
+    assert [idx for idx, _, _ in queue.claim(3)[1]] == [3, 4]
+    assert queue.claim(3) is None
+
+
+def test_expired_lease_is_claimed_again(queue, monkeypatch):
+    """Imagens de um worker que morreu voltam à fila ao fim do lease."""
+    job_id = queue.submit("a", make_files("a", 2))
+    assert len(queue.claim(2)[1]) == 2
+    assert queue.claim(2) is None
+    
+    monkeypatch.setattr(jobs, "LEASE_TIMEOUT_S", -1.0)
+    claimed_job, tasks = queue.claim(2)
+    assert claimed_job == job_id
+    assert [idx for idx, _, _ in tasks] == [0, 1]
+
+
+def test_complete_and_results_since(queue):
+    job_id = queue.submit("a", make_files("a", 3))
+    queue.claim(2)
+    queue.complete(job_id, [
+        (1, make_detections(2), {"inference": 5.0}, None),
+        (0, None, {}, "Imagem inválida: a0.jpg"),
+    ])
+    
+    status = queue.status(job_id)
+    assert (status["status"], status["done"], status["failed"]) == (RUNNING, 1, 1)
+    
+    # Só as linhas novas, pela ordem de conclusão
+    results, cursor = queue.results_since(job_id)
+    assert [(r["index"], r["filename"]) for r in results] == [(1, "a1.jpg"), (0, "a0.jpg")]
+    assert len(results[0]["detections"]) == 2
+    assert results[0]["timings"] == {"inference": 5.0}
+    assert results[1]["detections"] is None and results[1]["error"].startswith("Imagem inválida")
+    assert queue.results_since(job_id, cursor) == ([], cursor)
+    
+    queue.claim(2)
+    queue.complete(job_id, [(2, make_detections(1), {}, None)])
+    results, cursor = queue.results_since(job_id, cursor)
+    assert [r["index"] for r in results] == [2]
+    assert queue.status(job_id)["status"] == DONE
+    
+    # `results` continua a devolver tudo pela ordem de submissão
+    assert [r["filename"] for r in queue.results(job_id)] == ["a0.jpg", "a1.jpg", "a2.jpg"]
+
+
+def test_cancel_keeps_running_tasks(queue):
+    job_id = queue.submit("a", make_files("a", 4))
+    _, tasks = queue.claim(2)
+    
+    queue.cancel(job_id)
+    assert queue.status(job_id)["status"] == CANCELLED
+    assert queue.claim(2) is None
+    
+    # As imagens que já estavam num worker terminam e ficam nos resultados
+    queue.complete(job_id, [(idx, make_detections(1), {}, None) for idx, _, _ in tasks])
+    results, _ = queue.results_since(job_id)
+    assert [r["index"] for r in results] == [0, 1]
+    assert queue.status(job_id)["status"] == CANCELLED
+
+
+def test_empty_job_is_done(queue):
+    job_id = queue.submit("a", [])
+    assert queue.status(job_id)["status"] == DONE
+    assert queue.claim(4) is None
+
+
+def test_old_database_gets_seq_column(tmp_path):
+    """Bases de dados criadas antes da coluna `seq` são migradas."""
+    db_path = tmp_path / "jobs.sqlite"
+    conn = sqlite3.connect(str(db_path))
+    conn.execute(
+        "CREATE TABLE tasks (job_id TEXT NOT NULL, idx INTEGER NOT NULL, filename TEXT NOT NULL, "
+        "status TEXT NOT NULL, data BLOB, claimed_at REAL, result BLOB, timings TEXT, error TEXT, "
+        "PRIMARY KEY (job_id, idx))"
+    )
+    conn.execute("INSERT INTO tasks (job_id, idx, filename, status) VALUES ('velho', 0, 'a.jpg', ?)", (QUEUED,))
+    conn.commit()
+    conn.close()
+    
+    queue = JobQueue(db_path)
+    job_id = queue.submit("a", make_files("a", 1))
+    queue.claim(1)
+    queue.complete(job_id, [(0, make_detections(1), {}, None)])
+    results, cursor = queue.results_since(job_id)
+    assert [r["filename"] for r in results] == ["a0.jpg"] and cursor == 1
@@ -0,0 +1,92 @@
+"""
+Testes do manifesto de execução e do --resume (`src.manifest`).
+"""
+
+import os
+
+import pytest
+
+from src.manifest import ManifestMismatchError, RunManifest, entries_to_results, is_done
+
+PARAMS = {"model": "abc", "conf": 0.25, "iou": 0.45, "variant": "decode:640"}
+
+
+def make_result(filename: str, rbc: int):
+    return {
+        "filename": filename,
+        "counts": {"RBC": rbc, "WBC": 1, "Platelets": 0},
+        "percentages": {"RBC": 100.0 * rbc / (rbc + 1), "WBC": 100.0 / (rbc + 1), "Platelets": 0.0},
+    }
+
+
+@pytest.fixture
+def images(tmp_path):
+    paths = {}
+    for name in ("a.jpg", "b.jpg", "c.jpg"):
+        paths[name] = tmp_path / name
+        paths[name].write_bytes(name.encode() * 10)
+    return paths
+
+
+def test_resume_returns_completed_entries(tmp_path, images):
+    manifest = RunManifest(tmp_path, PARAMS)
+    assert manifest.start() == {}
+    manifest.append(make_result("a.jpg", 5), images["a.jpg"])
+    manifest.append(make_result("b.jpg", 7), images["b.jpg"])
+    
+    entries = RunManifest(tmp_path, dict(PARAMS)).start(resume=True)
+    assert sorted(entries) == ["a.jpg", "b.jpg"]
+    assert is_done(entries["a.jpg"], images["a.jpg"])
+    assert not is_done(entries.get("c.jpg"), images["c.jpg"])
+    
+    results = entries_to_results(entries, ["c.jpg", "b.jpg", "a.jpg"])
+    assert [r["filename"] for r in results] == ["b.jpg", "a.jpg"]
+    assert results[0]["counts"]["RBC"] == 7
+
+
+def test_changed_file_is_processed_again(tmp_path, images):
+    manifest = RunManifest(tmp_path, PARAMS)
+    manifest.start()
+    manifest.append(make_result("a.jpg", 5), images["a.jpg"])
+    manifest.append(make_result("b.jpg", 5), images["b.jpg"])
+    
+    images["a.jpg"].write_bytes(b"outra imagem")
+    stat = os.stat(images["b.jpg"])
+    os.utime(images["b.jpg"], ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    
+    entries = RunManifest(tmp_path, PARAMS).start(resume=True)
+    assert not is_done(entries["a.jpg"], images["a.jpg"])
+    assert not is_done(entries["b.jpg"], images["b.jpg"])
+    assert not is_done(entries["b.jpg"], tmp_path / "apagada.jpg")
+
+
+def test_resume_with_other_params_fails(tmp_path, images):
+    RunManifest(tmp_path, PARAMS).start()
+    other = {**PARAMS, "variant": "tile:640:0.2"}
+    with pytest.raises(ManifestMismatchError):
+        RunManifest(tmp_path, other).start(resume=True)
+    
+    # Sem --resume, o manifesto é recriado com os novos parâmetros
+    assert RunManifest(tmp_path, other).start() == {}
+    header, entries = RunManifest(tmp_path, other).read()
+    assert header["params"] == other and entries == {}
+
+
+def test_read_keeps_last_entry_and_ignores_truncated_line(tmp_path, images):
+    manifest = RunManifest(tmp_path, PARAMS)
+    manifest.start()
+    manifest.append(make_result("a.jpg", 5), images["a.jpg"])
+    manifest.append(make_result("a.jpg", 9), images["a.jpg"])
+    with open(manifest.path, "a", encoding="utf-8") as f:
+        f.write('{"type": "file", "filename": "b.jpg", "si')
+    
+    header, entries = manifest.read()
+    assert header["params"] == PARAMS
+    assert list(entries) == ["a.jpg"]
+    assert entries["a.jpg"]["counts"]["RBC"] == 9
+    
+    # A primeira entrada depois de retomar não se perde na linha incompleta
+    resumed = RunManifest(tmp_path, PARAMS)
+    assert list(resumed.start(resume=True)) == ["a.jpg"]
+    resumed.append(make_result("c.jpg", 3), images["c.jpg"])
+    assert sorted(resumed.read()[1]) == ["a.jpg", "c.jpg"]
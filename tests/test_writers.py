@@ -0,0 +1,69 @@
+"""
+Testes das tabelas de resultados retomadas com --resume (`src.writers`).
+"""
+
+import pytest
+
+from src.writers import TableWriter
+
+FIELDS = ["filename", "value"]
+
+
+def rows(*filenames):
+    return {"filename": list(filenames), "value": list(range(len(filenames)))}
+
+
+def read_filenames(table: TableWriter):
+    if table.output_format == "csv":
+        return [line.split(",")[0] for line in table.path.read_text().splitlines()[1:]]
+    import pandas as pd
+    if not any(table.path.glob("part-*.parquet")):
+        return []
+    return pd.read_parquet(table.path)["filename"].tolist()
+
+
+@pytest.fixture(params=["csv", "parquet"])
+def output_format(request):
+    if request.param == "parquet":
+        pytest.importorskip("pyarrow")
+        pytest.importorskip("pandas")
+    return request.param
+
+
+def test_resume_drops_rows_missing_from_manifest(tmp_path, output_format):
+    """Linhas escritas antes de uma interrupção, sem entrada no manifesto, são removidas."""
+    table = TableWriter(tmp_path, "results", FIELDS, output_format)
+    assert table.start()
+    table.write(rows("a.jpg", "b.jpg"))
+    table.write(rows("c.jpg", "d.jpg"))
+    table.write(rows("e.jpg"))
+    
+    resumed = TableWriter(tmp_path, "results", FIELDS, output_format)
+    assert not resumed.start(resume=True, committed={"a.jpg", "b.jpg", "c.jpg"})
+    assert read_filenames(resumed) == ["a.jpg", "b.jpg", "c.jpg"]
+    
+    # As imagens processadas de novo ficam uma única vez
+    resumed.write(rows("d.jpg", "e.jpg"))
+    assert read_filenames(resumed) == ["a.jpg", "b.jpg", "c.jpg", "d.jpg", "e.jpg"]
+
+
+def test_resume_without_committed_rows_starts_empty(tmp_path, output_format):
+    table = TableWriter(tmp_path, "results", FIELDS, output_format)
+    table.start()
+    table.write(rows("a.jpg"))
+    
+    resumed = TableWriter(tmp_path, "results", FIELDS, output_format)
+    assert resumed.start(resume=True, committed=set())
+    assert read_filenames(resumed) == []
+
+
+def test_resume_cuts_truncated_csv_row(tmp_path):
+    table = TableWriter(tmp_path, "results", FIELDS)
+    table.start()
+    table.write(rows("a.jpg", "b.jpg"))
+    with open(table.path, "a") as f:
+        f.write("c.jp")
+    
+    assert not table.start(resume=True, committed={"a.jpg", "b.jpg"})
+    table.write(rows("c.jpg"))
+    assert read_filenames(table) == ["a.jpg", "b.jpg", "c.jpg"]